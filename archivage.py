@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime, timezone
+
+from base_donnees import FORMAT_HORODATAGE
+
+
+class Archivage:
+    """Archive régulièrement les commandes terminées et compacte les bases.
+
+    Les commandes expédiées ou annulées depuis plus de `retention` quittent la
+    table `commandes` pour la base d'archives : l'historique courant et ses
+    index restent petits. L'espace libéré est ensuite rendu au système de
+    fichiers par vacuum incrémental. Tout se fait par petites transactions,
+    entre lesquelles les autres écritures continuent d'être servies.
+    """
+
+    def __init__(self, boutiques, retention, intervalle):
+        self.boutiques = boutiques
+        self.retention = retention
+        self.intervalle = intervalle
+        self._tache = None
+        self.archivees = 0
+
+    def demarrer(self):
+        self._tache = asyncio.create_task(self._boucle())
+
+    def arreter(self):
+        if self._tache is not None:
+            self._tache.cancel()
+
+    async def executer(self):
+        """Un passage complet sur toutes les boutiques, retourne le nombre de commandes archivées"""
+        avant = (datetime.now(timezone.utc) - self.retention).strftime(FORMAT_HORODATAGE)
+        archivees = 0
+        stockages = []
+        for guild_id in await self.boutiques.existantes():
+            stockage = await self.boutiques.pour(guild_id)
+            archivees += await stockage.archiver_commandes(guild_id, avant)
+            if stockage not in stockages:
+                stockages.append(stockage)
+        for stockage in stockages:
+            await stockage.compacter()
+        self.archivees += archivees
+        return archivees
+
+    async def _boucle(self):
+        while True:
+            try:
+                archivees = await self.executer()
+                if archivees:
+                    print(f"{archivees} commande(s) archivée(s)")
+            except Exception as e:
+                print(f"Archivage des commandes impossible : {e}")
+            await asyncio.sleep(self.intervalle.total_seconds())
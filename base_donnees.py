@@ -0,0 +1,1350 @@
+import functools
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from metriques import mesurer_requete
+
+DATABASE_FILE = 'boutique.db'
+
+# Réglages appliqués à chaque connexion
+DELAI_ATTENTE_VERROU_MS = 5000
+TAILLE_MMAP = 256 * 1024 * 1024
+TAILLE_CACHE_REQUETES = 128
+# Bases ouvertes au plus par thread (une base par serveur) : au-delà, la moins récemment utilisée est fermée
+NB_CONNEXIONS_PAR_THREAD = 16
+
+TAILLE_PAGE_COMMANDES = 10
+TAILLE_LOT_CURSEUR = 1000
+
+# Format des horodatages en base (UTC), identique à CURRENT_TIMESTAMP
+FORMAT_HORODATAGE = '%Y-%m-%d %H:%M:%S'
+
+# Réessais des écritures lorsque la base est verrouillée
+TENTATIVES_ECRITURE = 5
+DELAI_REESSAI_INITIAL = 0.02
+
+
+# Modèles des lignes lues : des tuples nommés (pas de dict par ligne), construits
+# directement par le `row_factory` du curseur ; les champs suivent l'ordre des colonnes
+Produit = namedtuple('Produit', 'id nom description prix stock')
+Commande = namedtuple('Commande', 'id user_id produit_id quantite prix_unitaire total statut date_commande')
+CommandeDetaillee = namedtuple(
+    'CommandeDetaillee', 'id user_id produit_id nom_produit quantite prix_unitaire total statut date_commande'
+)
+LigneVentes = namedtuple('LigneVentes', 'produit_id nb_commandes unites chiffre_affaires montant_encaisse')
+
+
+class GestionnaireConnexions:
+    """Connexions SQLite persistantes à une base, une par thread.
+
+    Chaque thread (l'écrivain et chaque lecteur de `Stockage`) garde sa
+    connexion ouverte pour toute la durée de vie du bot : plus de coût de
+    connexion par appel, et les requêtes préparées restent en cache. Le mode
+    WAL permet aux lecteurs de travailler pendant une écriture.
+
+    Avec une base par serveur, un thread garde ses connexions à
+    NB_CONNEXIONS_PAR_THREAD bases au plus : celle qu'il a utilisée le moins
+    récemment est fermée, puis rouverte si besoin.
+    """
+
+    # Par thread : gestionnaires où ce thread a une connexion, du moins au plus récemment utilisé
+    _recentes = threading.local()
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self._local = threading.local()
+        self._connexions = []
+        self._verrou = threading.Lock()
+
+    def _ouvrir(self):
+        conn = sqlite3.connect(
+            self.chemin,
+            timeout=DELAI_ATTENTE_VERROU_MS / 1000,
+            isolation_level=None,  # transactions gérées explicitement
+            cached_statements=TAILLE_CACHE_REQUETES,
+            check_same_thread=False,
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {DELAI_ATTENTE_VERROU_MS}')
+        conn.execute(f'PRAGMA mmap_size = {TAILLE_MMAP}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        # Commandes archivées, dans un fichier à part pour que la base principale reste petite
+        conn.execute('ATTACH DATABASE ? AS archive', (chemin_archive(self.chemin),))
+        conn.execute('PRAGMA archive.journal_mode = WAL')
+        conn.execute('PRAGMA archive.synchronous = NORMAL')
+        return conn
+
+    def connexion(self):
+        """Retourne la connexion du thread courant, ouverte au premier appel"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._ouvrir()
+            self._local.conn = conn
+            with self._verrou:
+                self._connexions.append(conn)
+        self._utiliser()
+        return conn
+
+    def _utiliser(self):
+        recentes = getattr(self._recentes, 'gestionnaires', None)
+        if recentes is None:
+            recentes = self._recentes.gestionnaires = OrderedDict()
+        recentes[self] = None
+        recentes.move_to_end(self)
+        while len(recentes) > NB_CONNEXIONS_PAR_THREAD:
+            ancien, _ = recentes.popitem(last=False)
+            ancien.fermer_du_thread()
+
+    def fermer_du_thread(self):
+        """Ferme la connexion du thread courant à cette base, s'il en a une"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._verrou:
+            if conn in self._connexions:
+                self._connexions.remove(conn)
+        conn.close()
+
+    def fermer(self):
+        """Ferme toutes les connexions ouvertes (à appeler une fois les threads arrêtés)"""
+        with self._verrou:
+            for conn in self._connexions:
+                conn.close()
+            self._connexions.clear()
+        self._local = threading.local()
+
+def chemin_archive(chemin):
+    """Base d'archives associée à une base (`boutique.db` -> `boutique.archive.db`)"""
+    return os.path.splitext(chemin)[0] + '.archive.db'
+
+def copier_base(source, destination):
+    """Copie une base et sa base d'archives vers `destination` si elle n'existe pas encore.
+
+    La copie passe par l'API de sauvegarde de SQLite (cohérente même si la
+    source est ouverte) et par un fichier temporaire renommé à la fin : une
+    copie interrompue est refaite au démarrage suivant. Retourne True si la
+    base a été copiée.
+    """
+    if os.path.exists(destination) or not os.path.exists(source):
+        return False
+    temporaire = destination + '.copie'
+    for de, vers in ((chemin_archive(source), chemin_archive(destination)), (source, temporaire)):
+        if not os.path.exists(de):
+            continue
+        origine, copie = sqlite3.connect(de), sqlite3.connect(vers)
+        try:
+            origine.backup(copie)
+        finally:
+            copie.close()
+            origine.close()
+    os.replace(temporaire, destination)
+    return True
+
+_gestionnaires = {}  # chemin -> GestionnaireConnexions
+_verrou_gestionnaires = threading.Lock()
+_base_courante = threading.local()
+
+def configurer(chemin=None):
+    """Choisit la base par défaut, une fois au démarrage (ferme les connexions ouvertes)"""
+    global DATABASE_FILE
+    fermer_connexions()
+    if chemin is not None:
+        DATABASE_FILE = chemin
+    invalider_catalogues()
+
+def gestionnaire(chemin=None):
+    """Retourne le gestionnaire de connexions d'une base (la base par défaut si `chemin` est None)"""
+    chemin = chemin or DATABASE_FILE
+    with _verrou_gestionnaires:
+        if chemin not in _gestionnaires:
+            _gestionnaires[chemin] = GestionnaireConnexions(chemin)
+        return _gestionnaires[chemin]
+
+def sur_base(chemin, fonction, *args):
+    """Exécute `fonction` avec `chemin` comme base du thread courant (une base par serveur)"""
+    _base_courante.chemin = chemin
+    try:
+        return fonction(*args)
+    finally:
+        _base_courante.chemin = None
+
+def connexion():
+    """Retourne la connexion persistante du thread courant à la base courante"""
+    return gestionnaire(getattr(_base_courante, 'chemin', None)).connexion()
+
+def curseur(modele):
+    """Curseur de la connexion courante dont chaque ligne est un `modele` (tuple nommé)"""
+    cursor = connexion().cursor()
+    cursor.row_factory = lambda _, ligne: modele._make(ligne)
+    return cursor
+
+def fermer_connexions():
+    """Ferme les connexions persistantes de toutes les bases"""
+    with _verrou_gestionnaires:
+        gestionnaires = list(_gestionnaires.values())
+        _gestionnaires.clear()
+    for g in gestionnaires:
+        g.fermer()
+
+
+class CatalogueCache:
+    """Copie en mémoire des produits (`Produit`) d'un serveur, indexée par ID.
+
+    Le cache est alimenté une fois depuis la base puis tenu à jour par les
+    fonctions d'écriture après chaque commit (`ajouter_produit`,
+    `supprimer_produit`, `ajouter_commande`). `version` est incrémenté à
+    chaque changement, ce qui permet aux consommateurs de savoir si leurs
+    données dérivées sont encore valides. Les produits retournés sont partagés :
+    ils ne doivent pas être modifiés.
+
+    Les abonnés (comme l'index de recherche) reçoivent chaque ajout, mise à
+    jour ou retrait de produit ; les simples variations de stock ne leur sont
+    pas transmises.
+    """
+
+    def __init__(self):
+        self._produits = {}
+        self._liste = None
+        self.version = 0
+        self.charge = False
+        self._abonnes = []
+        self._verrou = threading.Lock()
+
+    def abonner(self, abonne):
+        """Abonne un objet ayant les méthodes `charger`, `mettre_a_jour` et `retirer`"""
+        with self._verrou:
+            abonne.charger(self._produits.values())
+            self._abonnes.append(abonne)
+
+    def charger(self, produits, version_attendue=None):
+        """Remplace le contenu du cache, sauf s'il a changé depuis `version_attendue`"""
+        with self._verrou:
+            if version_attendue is not None and version_attendue != self.version:
+                return False
+            self._produits = {p.id: p for p in produits}
+            self._changement()
+            self.charge = True
+            for abonne in self._abonnes:
+                abonne.charger(self._produits.values())
+            return True
+
+    def invalider(self):
+        """Vide le cache : il sera rechargé depuis la base au prochain accès"""
+        with self._verrou:
+            self._produits = {}
+            self._changement()
+            self.charge = False
+            for abonne in self._abonnes:
+                abonne.charger(())
+
+    def _changement(self):
+        self._liste = None
+        self.version += 1
+
+    def produits(self):
+        """Retourne la liste des produits triée par ID"""
+        with self._verrou:
+            if self._liste is None:
+                self._liste = sorted(self._produits.values(), key=lambda p: p.id)
+            return self._liste
+
+    def obtenir(self, produit_id):
+        return self._produits.get(produit_id)
+
+    # Les méthodes suivantes incrémentent la version même si le cache n'est pas
+    # encore chargé, pour qu'un chargement concurrent et périmé soit ignoré.
+
+    def mettre_a_jour(self, produit):
+        with self._verrou:
+            if self.charge:
+                self._produits[produit.id] = produit
+                for abonne in self._abonnes:
+                    abonne.mettre_a_jour(produit)
+            self._changement()
+
+    def retirer(self, produit_id):
+        with self._verrou:
+            self._produits.pop(produit_id, None)
+            for abonne in self._abonnes:
+                abonne.retirer(produit_id)
+            self._changement()
+
+    def ajuster_stock(self, produit_id, delta):
+        with self._verrou:
+            produit = self._produits.get(produit_id)
+            if produit is not None:
+                # Copie plutôt que modification : les lecteurs gardent un état cohérent
+                self._produits[produit_id] = produit._replace(stock=produit.stock + delta)
+            self._changement()
+
+# Un catalogue par serveur Discord (guild) : les IDs de serveur sont uniques,
+# même quand chaque serveur a sa propre base
+_catalogues = {}
+_verrou_catalogues = threading.Lock()
+
+def catalogue_de(guild_id):
+    """Retourne le cache du catalogue d'un serveur, créé vide au premier appel"""
+    with _verrou_catalogues:
+        if guild_id not in _catalogues:
+            _catalogues[guild_id] = CatalogueCache()
+        return _catalogues[guild_id]
+
+def invalider_catalogues():
+    with _verrou_catalogues:
+        catalogues = list(_catalogues.values())
+    for cache in catalogues:
+        cache.invalider()
+
+@contextmanager
+def transaction(conn, immediate=False):
+    """Exécute un bloc dans une transaction, annulée en cas d'exception"""
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def avec_reessais(fonction):
+    """Réessaie une écriture si la base est verrouillée, avec un délai exponentiel.
+
+    Le `busy_timeout` couvre la plupart des attentes ; ce filet gère les cas où
+    SQLite abandonne immédiatement (conflit de verrou détecté en cours de
+    transaction). Après `TENTATIVES_ECRITURE` échecs, l'erreur est propagée.
+    """
+    @functools.wraps(fonction)
+    def wrapper(*args, **kwargs):
+        delai = DELAI_REESSAI_INITIAL
+        for tentative in range(1, TENTATIVES_ECRITURE + 1):
+            try:
+                return fonction(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                message = str(e)
+                if tentative == TENTATIVES_ECRITURE or ('locked' not in message and 'busy' not in message):
+                    raise
+            time.sleep(delai * random.uniform(0.5, 1.5))
+            delai *= 2
+    return wrapper
+
+
+# Migrations du schéma
+# Chaque migration est appliquée une seule fois, dans sa propre transaction ;
+# le numéro de la dernière migration appliquée est conservé dans
+# `PRAGMA user_version`. Ne jamais modifier une migration déjà publiée :
+# en ajouter une nouvelle à la fin de la liste.
+
+def _migration_schema_initial(cursor):
+    # Création de la table des produits
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS produits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT NOT NULL,
+            description TEXT NOT NULL,
+            prix REAL NOT NULL,
+            stock INTEGER DEFAULT 0,
+            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Création de la table des commandes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS commandes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            produit_id INTEGER NOT NULL,
+            quantite INTEGER NOT NULL,
+            prix_unitaire REAL NOT NULL,
+            total REAL NOT NULL,
+            statut TEXT DEFAULT 'en_attente',
+            date_commande TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (produit_id) REFERENCES produits (id)
+        )
+    ''')
+
+def _migration_index_commandes(cursor):
+    # Historique d'un utilisateur : filtre sur user_id, tri par date
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_user_date
+        ON commandes (user_id, date_commande DESC)
+    ''')
+    # Commandes d'un produit (suppression d'un produit)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_produit
+        ON commandes (produit_id)
+    ''')
+    # Pagination des commandes (clé (date_commande, id))
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_date
+        ON commandes (date_commande, id)
+    ''')
+
+def _migration_normaliser_dates(cursor):
+    # Toutes les dates au format canonique de CURRENT_TIMESTAMP, pour que les
+    # comparaisons de plages sur l'index soient exactes
+    cursor.execute('''
+        UPDATE commandes
+        SET date_commande = datetime(date_commande)
+        WHERE datetime(date_commande) IS NOT NULL
+          AND date_commande IS NOT datetime(date_commande)
+    ''')
+
+# Contribution d'une commande aux agrégats selon son statut : les commandes
+# annulées ne comptent pas, seules les payées/expédiées sont encaissées
+_COMPTEE = "({0}.statut != 'annule')"
+_ENCAISSEE = "({0}.statut IN ('paye', 'envoye'))"
+
+def _migration_agregats_ventes(cursor):
+    # Ventes par jour (heure locale) et par produit, tenues à jour par des
+    # triggers dans la transaction même qui crée ou modifie la commande
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventes_jour (
+            jour TEXT NOT NULL,
+            produit_id INTEGER NOT NULL,
+            nb_commandes INTEGER NOT NULL DEFAULT 0,
+            unites INTEGER NOT NULL DEFAULT 0,
+            chiffre_affaires REAL NOT NULL DEFAULT 0,
+            montant_encaisse REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (jour, produit_id)
+        ) WITHOUT ROWID
+    ''')
+
+    cumul = '''
+        ON CONFLICT (jour, produit_id) DO UPDATE SET
+            nb_commandes = nb_commandes + excluded.nb_commandes,
+            unites = unites + excluded.unites,
+            chiffre_affaires = chiffre_affaires + excluded.chiffre_affaires,
+            montant_encaisse = montant_encaisse + excluded.montant_encaisse
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_ventes_insertion
+        AFTER INSERT ON commandes
+        WHEN {_COMPTEE.format('NEW')}
+        BEGIN
+            INSERT INTO ventes_jour (jour, produit_id, nb_commandes, unites, chiffre_affaires, montant_encaisse)
+            VALUES (
+                date(NEW.date_commande, 'localtime'), NEW.produit_id, 1, NEW.quantite, NEW.total,
+                {_ENCAISSEE.format('NEW')} * NEW.total
+            )
+            {cumul};
+        END
+    ''')
+
+    compte = f"({_COMPTEE.format('NEW')} - {_COMPTEE.format('OLD')})"
+    encaisse = f"({_ENCAISSEE.format('NEW')} - {_ENCAISSEE.format('OLD')})"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_ventes_statut
+        AFTER UPDATE OF statut ON commandes
+        WHEN OLD.statut IS NOT NEW.statut
+        BEGIN
+            INSERT INTO ventes_jour (jour, produit_id, nb_commandes, unites, chiffre_affaires, montant_encaisse)
+            VALUES (
+                date(NEW.date_commande, 'localtime'), NEW.produit_id,
+                {compte}, {compte} * NEW.quantite, {compte} * NEW.total, {encaisse} * NEW.total
+            )
+            {cumul};
+        END
+    ''')
+
+    # Reprise de l'historique existant
+    cursor.execute(f'''
+        INSERT INTO ventes_jour (jour, produit_id, nb_commandes, unites, chiffre_affaires, montant_encaisse)
+        SELECT date(c.date_commande, 'localtime'), c.produit_id, COUNT(*), SUM(c.quantite), SUM(c.total),
+               SUM({_ENCAISSEE.format('c')} * c.total)
+        FROM commandes c
+        WHERE {_COMPTEE.format('c')}
+        GROUP BY 1, 2
+    ''')
+
+def _migration_index_statut_date(cursor):
+    # Commandes d'un statut par ancienneté (expiration des commandes non payées)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_statut_date
+        ON commandes (statut, date_commande)
+    ''')
+
+def _migration_paiements(cursor):
+    # Notifications de paiement reçues : la clé primaire rend leur traitement idempotent
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paiements (
+            id TEXT PRIMARY KEY,
+            commande_id INTEGER,
+            montant REAL,
+            resultat TEXT NOT NULL,
+            date_reception TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_groupes_commandes(cursor):
+    # Commandes passées ensemble depuis un panier : un seul paiement pour le groupe
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS groupes_commandes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('ALTER TABLE commandes ADD COLUMN groupe_id INTEGER REFERENCES groupes_commandes (id)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_groupe
+        ON commandes (groupe_id) WHERE groupe_id IS NOT NULL
+    ''')
+    cursor.execute('ALTER TABLE paiements ADD COLUMN groupe_id INTEGER')
+
+def _migration_serveurs(cursor):
+    # Une boutique par serveur Discord (guild) : les données existantes
+    # appartiennent au serveur 0 jusqu'à leur attribution (`attribuer_historique`)
+    for table in ('produits', 'commandes', 'groupes_commandes', 'paiements'):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0')
+
+    # Le serveur en tête de chaque index : une requête ne parcourt jamais
+    # les données des autres serveurs
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_guild ON produits (guild_id)')
+    cursor.execute('DROP INDEX IF EXISTS idx_commandes_user_date')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_guild_user_date
+        ON commandes (guild_id, user_id, date_commande DESC)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_commandes_date')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_guild_date
+        ON commandes (guild_id, date_commande, id)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_commandes_statut_date')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commandes_guild_statut_date
+        ON commandes (guild_id, statut, date_commande)
+    ''')
+
+    # Agrégats des ventes par serveur : la table et ses triggers sont recréés
+    cursor.execute('DROP TRIGGER IF EXISTS trg_ventes_insertion')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_ventes_statut')
+    cursor.execute('ALTER TABLE ventes_jour RENAME TO ventes_jour_ancienne')
+    cursor.execute('''
+        CREATE TABLE ventes_jour (
+            guild_id INTEGER NOT NULL,
+            jour TEXT NOT NULL,
+            produit_id INTEGER NOT NULL,
+            nb_commandes INTEGER NOT NULL DEFAULT 0,
+            unites INTEGER NOT NULL DEFAULT 0,
+            chiffre_affaires REAL NOT NULL DEFAULT 0,
+            montant_encaisse REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, jour, produit_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO ventes_jour
+        SELECT 0, jour, produit_id, nb_commandes, unites, chiffre_affaires, montant_encaisse
+        FROM ventes_jour_ancienne
+    ''')
+    cursor.execute('DROP TABLE ventes_jour_ancienne')
+
+    cumul = '''
+        ON CONFLICT (guild_id, jour, produit_id) DO UPDATE SET
+            nb_commandes = nb_commandes + excluded.nb_commandes,
+            unites = unites + excluded.unites,
+            chiffre_affaires = chiffre_affaires + excluded.chiffre_affaires,
+            montant_encaisse = montant_encaisse + excluded.montant_encaisse
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER trg_ventes_insertion
+        AFTER INSERT ON commandes
+        WHEN {_COMPTEE.format('NEW')}
+        BEGIN
+            INSERT INTO ventes_jour (guild_id, jour, produit_id, nb_commandes, unites, chiffre_affaires, montant_encaisse)
+            VALUES (
+                NEW.guild_id, date(NEW.date_commande, 'localtime'), NEW.produit_id, 1, NEW.quantite, NEW.total,
+                {_ENCAISSEE.format('NEW')} * NEW.total
+            )
+            {cumul};
+        END
+    ''')
+
+    compte = f"({_COMPTEE.format('NEW')} - {_COMPTEE.format('OLD')})"
+    encaisse = f"({_ENCAISSEE.format('NEW')} - {_ENCAISSEE.format('OLD')})"
+    cursor.execute(f'''
+        CREATE TRIGGER trg_ventes_statut
+        AFTER UPDATE OF statut ON commandes
+        WHEN OLD.statut IS NOT NEW.statut
+        BEGIN
+            INSERT INTO ventes_jour (guild_id, jour, produit_id, nb_commandes, unites, chiffre_affaires, montant_encaisse)
+            VALUES (
+                NEW.guild_id, date(NEW.date_commande, 'localtime'), NEW.produit_id,
+                {compte}, {compte} * NEW.quantite, {compte} * NEW.total, {encaisse} * NEW.total
+            )
+            {cumul};
+        END
+    ''')
+
+MIGRATIONS = [
+    _migration_schema_initial,
+    _migration_index_commandes,
+    _migration_normaliser_dates,
+    _migration_agregats_ventes,
+    _migration_index_statut_date,
+    _migration_paiements,
+    _migration_groupes_commandes,
+    _migration_serveurs,
+]
+
+def version_schema(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def appliquer_migrations(conn):
+    """Applique les migrations manquantes, retourne la version finale du schéma"""
+    version = version_schema(conn)
+    for numero, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with transaction(conn, immediate=True):
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {numero}')
+    return len(MIGRATIONS)
+
+def _schema_archives(conn):
+    # La base d'archives est recréée vide si son fichier a disparu : son
+    # schéma est vérifié à chaque démarrage plutôt que suivi par les migrations
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.commandes_archive (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            produit_id INTEGER NOT NULL,
+            quantite INTEGER NOT NULL,
+            prix_unitaire REAL NOT NULL,
+            total REAL NOT NULL,
+            statut TEXT NOT NULL,
+            date_commande TIMESTAMP NOT NULL,
+            groupe_id INTEGER,
+            date_archivage TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_guild_user_date
+        ON commandes_archive (guild_id, user_id, date_commande DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_guild_date
+        ON commandes_archive (guild_id, date_commande, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_produit
+        ON commandes_archive (produit_id)
+    ''')
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+def migrer():
+    """Applique les migrations manquantes à la base courante et prépare sa base d'archives.
+
+    Une base créée sans `auto_vacuum = INCREMENTAL` est convertie par un
+    VACUUM complet, une seule fois : ensuite, `compacter` rend l'espace libéré
+    par l'archivage sans bloquer la base.
+    """
+    conn = connexion()
+    version = appliquer_migrations(conn)
+    with transaction(conn, immediate=True):
+        _schema_archives(conn)
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    return version
+
+SERVEUR_HISTORIQUE = 0  # serveur des données antérieures au découpage par serveur
+
+def initialiser_base_donnees(guild_id=SERVEUR_HISTORIQUE):
+    """Initialise la base de données SQLite : migrations puis produits par défaut du serveur"""
+    migrer()
+
+    conn = connexion()
+    with transaction(conn, immediate=True):
+        cursor = conn.cursor()
+
+        # Insertion des produits par défaut si le serveur n'en a aucun
+        cursor.execute('SELECT COUNT(*) FROM produits WHERE guild_id = ?', (guild_id,))
+        if cursor.fetchone()[0] == 0:
+            produits_defaut = [
+                ("T-shirt Bessans", "T-shirt en coton avec le logo de Bessans", 25.0, 50),
+                ("Casquette Montagne", "Casquette de randonnée avec protection UV", 15.0, 30),
+                ("Mug Bessans", "Mug en céramique avec vue sur les montagnes", 12.0, 25),
+                ("Poster Panoramique", "Poster A3 des plus belles vues de Bessans", 8.0, 40),
+                ("Stickers Pack", "Pack de 5 stickers Bessans pour voiture", 5.0, 100)
+            ]
+            cursor.executemany('''
+                INSERT INTO produits (guild_id, nom, description, prix, stock)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(guild_id, *produit) for produit in produits_defaut])
+
+    charger_catalogue(guild_id)
+
+REQUETE_SERVEURS = 'SELECT DISTINCT guild_id FROM produits'
+
+@mesurer_requete
+def serveurs():
+    """IDs des serveurs ayant une boutique dans la base courante"""
+    return [row[0] for row in connexion().execute(REQUETE_SERVEURS)]
+
+@mesurer_requete
+def attribuer_historique(guild_id):
+    """Rattache à un serveur les données antérieures au découpage par serveur.
+
+    Sans effet une fois fait ; retourne le nombre de produits rattachés.
+    """
+    conn = connexion()
+    with transaction(conn, immediate=True):
+        nb_produits = conn.execute(
+            'UPDATE produits SET guild_id = ? WHERE guild_id = ?', (guild_id, SERVEUR_HISTORIQUE)
+        ).rowcount
+        for table in ('commandes', 'groupes_commandes', 'paiements', 'ventes_jour', 'archive.commandes_archive'):
+            conn.execute(f'UPDATE {table} SET guild_id = ? WHERE guild_id = ?', (guild_id, SERVEUR_HISTORIQUE))
+    invalider_catalogues()
+    return nb_produits
+
+def _inserer_commande(conn, guild_id, user_id, produit_id, quantite, prix_unitaire):
+    """Réserve le stock et insère la commande (dans une transaction ouverte).
+
+    La réservation est une mise à jour conditionnelle (`stock >= quantite`) :
+    deux acheteurs simultanés ne peuvent pas faire passer le stock en négatif.
+    Retourne (ID de la commande ou None si le stock est insuffisant ou si le
+    produit n'est pas vendu sur ce serveur, variations de stock).
+    """
+    cursor = conn.execute('''
+        UPDATE produits
+        SET stock = stock - ?
+        WHERE id = ? AND guild_id = ? AND stock >= ?
+    ''', (quantite, produit_id, guild_id, quantite))
+    if cursor.rowcount == 0:
+        return None, ()
+
+    cursor = conn.execute('''
+        INSERT INTO commandes (guild_id, user_id, produit_id, quantite, prix_unitaire, total)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (guild_id, user_id, produit_id, quantite, prix_unitaire, quantite * prix_unitaire))
+    return cursor.lastrowid, ((produit_id, -quantite),)
+
+def _changer_statut(conn, guild_id, commande_id, statut):
+    """Change le statut d'une commande (dans une transaction ouverte).
+
+    Passer une commande à `annule` rend sa quantité au stock ; la sortir de
+    `annule` la réserve à nouveau (ValueError si le stock ne suffit plus).
+    Retourne (False si la commande n'existe pas sur ce serveur, sinon True ; variations de stock).
+    """
+    commande = conn.execute(
+        "SELECT produit_id, quantite, statut FROM commandes WHERE id = ? AND guild_id = ?", (commande_id, guild_id)
+    ).fetchone()
+    if not commande:
+        return False, ()
+    produit_id, quantite, ancien_statut = commande
+
+    delta = 0
+    if statut == 'annule' and ancien_statut != 'annule':
+        delta = quantite
+    elif ancien_statut == 'annule' and statut != 'annule':
+        delta = -quantite
+    if delta:
+        cursor = conn.execute(
+            'UPDATE produits SET stock = stock + ? WHERE id = ? AND stock + ? >= 0',
+            (delta, produit_id, delta)
+        )
+        if cursor.rowcount == 0 and delta < 0:
+            raise ValueError("stock insuffisant pour réactiver cette commande")
+
+    conn.execute(
+        "UPDATE commandes SET statut = ? WHERE id = ?",
+        (statut, commande_id)
+    )
+    return True, ((produit_id, delta),) if delta else ()
+
+class StockInsuffisant(ValueError):
+    """Stock insuffisant pour l'une des lignes d'un panier"""
+
+    def __init__(self, produit_id):
+        super().__init__(f"stock insuffisant pour le produit {produit_id}")
+        self.produit_id = produit_id
+
+def _valider_panier(conn, guild_id, user_id, lignes):
+    """Crée un groupe de commandes, une par ligne (produit_id, quantite, prix_unitaire).
+
+    Toutes les lignes sont réservées ou aucune : StockInsuffisant annule le
+    point de sauvegarde de l'opération, donc les réservations déjà faites.
+    Retourne ((ID du groupe, IDs des commandes), variations de stock).
+    """
+    groupe_id = conn.execute(
+        'INSERT INTO groupes_commandes (guild_id, user_id) VALUES (?, ?)', (guild_id, user_id)
+    ).lastrowid
+    commande_ids = []
+    variations = []
+    for produit_id, quantite, prix_unitaire in lignes:
+        cursor = conn.execute(
+            'UPDATE produits SET stock = stock - ? WHERE id = ? AND guild_id = ? AND stock >= ?',
+            (quantite, produit_id, guild_id, quantite)
+        )
+        if cursor.rowcount == 0:
+            raise StockInsuffisant(produit_id)
+        cursor = conn.execute('''
+            INSERT INTO commandes (guild_id, user_id, produit_id, quantite, prix_unitaire, total, groupe_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (guild_id, user_id, produit_id, quantite, prix_unitaire, quantite * prix_unitaire, groupe_id))
+        commande_ids.append(cursor.lastrowid)
+        variations.append((produit_id, -quantite))
+    return (groupe_id, commande_ids), variations
+
+TOLERANCE_MONTANT = 0.005  # écart accepté entre le montant payé et le total à régler
+
+REQUETE_COMMANDES_GROUPE = 'SELECT id, total, statut FROM commandes WHERE groupe_id = ? AND guild_id = ?'
+
+def _enregistrer_paiement(conn, guild_id, notification_id, reference, montant):
+    """Rapproche une notification de paiement de ce qu'elle règle (dans une transaction ouverte).
+
+    `reference` désigne une commande (`"12"`) ou un groupe de commandes issu
+    d'un panier (`"G12"`, réglé en une fois). Si tout est en attente et que le
+    montant correspond, tout passe à `paye`. Retourne (résultat, variations de
+    stock) ; le résultat vaut `paye`, `doublon` (notification déjà traitée),
+    `commande_inconnue`, `montant_incorrect`, `deja_payee` ou `commande_annulee`.
+    """
+    commande_id = groupe_id = None
+    if reference.startswith('G'):
+        groupe_id = int(reference[1:])
+        commandes = conn.execute(REQUETE_COMMANDES_GROUPE, (groupe_id, guild_id)).fetchall()
+    else:
+        commande_id = int(reference)
+        commandes = conn.execute(
+            'SELECT id, total, statut FROM commandes WHERE id = ? AND guild_id = ?', (commande_id, guild_id)
+        ).fetchall()
+
+    statuts = {statut for _, _, statut in commandes}
+    if not commandes:
+        resultat = 'commande_inconnue'
+    elif not abs(sum(total for _, total, _ in commandes) - montant) <= TOLERANCE_MONTANT:  # NaN compris
+        resultat = 'montant_incorrect'
+    elif statuts == {'en_attente'}:
+        resultat = 'paye'
+    elif 'annule' in statuts:
+        resultat = 'commande_annulee'
+    else:
+        resultat = 'deja_payee'
+
+    cursor = conn.execute(
+        'INSERT OR IGNORE INTO paiements (id, guild_id, commande_id, groupe_id, montant, resultat) VALUES (?, ?, ?, ?, ?, ?)',
+        (notification_id, guild_id, commande_id, groupe_id, montant, resultat)
+    )
+    if cursor.rowcount == 0:
+        return 'doublon', ()
+    if resultat == 'paye':
+        conn.executemany("UPDATE commandes SET statut = 'paye' WHERE id = ?", [(c[0],) for c in commandes])
+    return resultat, ()
+
+# Opérations regroupables dans un même lot, par nom ; chacune reçoit
+# (conn, guild_id, ...) et retourne (résultat, variations de stock du serveur)
+OPERATIONS_LOT = {
+    'ajouter_commande': _inserer_commande,
+    'modifier_statut_commande': _changer_statut,
+    'enregistrer_paiement': _enregistrer_paiement,
+    'valider_panier': _valider_panier,
+}
+
+@mesurer_requete
+@avec_reessais
+def executer_lot(operations):
+    """Exécute des opérations d'écriture [(nom, args), ...] dans une seule transaction.
+
+    Chaque opération a son propre point de sauvegarde : si elle échoue, seules
+    ses modifications sont annulées et les autres sont tout de même validées.
+    Un seul commit pour tout le lot, au lieu d'un par opération.
+    Retourne, dans l'ordre, un (True, résultat) ou (False, exception) par opération.
+    """
+    conn = connexion()
+    resultats = []
+    ajustements = []
+    with transaction(conn, immediate=True):
+        for nom, args in operations:
+            conn.execute('SAVEPOINT operation')
+            try:
+                resultat, variations = OPERATIONS_LOT[nom](conn, *args)
+            except sqlite3.OperationalError:
+                raise  # base verrouillée ou indisponible : tout le lot est réessayé
+            except Exception as e:
+                conn.execute('ROLLBACK TO operation')
+                conn.execute('RELEASE operation')
+                resultats.append((False, e))
+                continue
+            conn.execute('RELEASE operation')
+            resultats.append((True, resultat))
+            ajustements.extend((args[0], produit_id, delta) for produit_id, delta in variations)
+
+    # Le cache n'est mis à jour qu'une fois le lot validé
+    for guild_id, produit_id, delta in ajustements:
+        catalogue_de(guild_id).ajuster_stock(produit_id, delta)
+    return resultats
+
+def _executer_seule(nom, *args):
+    [(reussie, resultat)] = executer_lot([(nom, args)])
+    if not reussie:
+        raise resultat
+    return resultat
+
+def ajouter_commande(guild_id, user_id, produit_id, quantite, prix_unitaire):
+    """Réserve le stock et enregistre la commande dans une même transaction.
+
+    Retourne l'ID de la commande, ou None si le stock est insuffisant.
+    """
+    return _executer_seule('ajouter_commande', guild_id, user_id, produit_id, quantite, prix_unitaire)
+
+REQUETE_COMMANDES_UTILISATEUR = '''
+    SELECT c.id, c.user_id, c.produit_id, c.quantite, c.prix_unitaire, c.total, c.statut, c.date_commande
+    FROM commandes c
+    WHERE c.guild_id = ? AND c.user_id = ?
+    ORDER BY c.date_commande DESC
+'''
+
+# Commandes récentes puis archivées, fusionnées dans l'ordre des deux index ;
+# une commande encore présente dans `commandes` (archivage interrompu entre
+# ses deux transactions) n'est comptée qu'une fois
+REQUETE_COMMANDES_UTILISATEUR_ARCHIVES = '''
+    SELECT c.id, c.user_id, c.produit_id, c.quantite, c.prix_unitaire, c.total, c.statut, c.date_commande
+    FROM commandes c
+    WHERE c.guild_id = ?1 AND c.user_id = ?2
+    UNION ALL
+    SELECT a.id, a.user_id, a.produit_id, a.quantite, a.prix_unitaire, a.total, a.statut, a.date_commande
+    FROM archive.commandes_archive a
+    WHERE a.guild_id = ?1 AND a.user_id = ?2
+      AND NOT EXISTS (SELECT 1 FROM commandes c WHERE c.id = a.id)
+    ORDER BY 8 DESC
+'''
+
+def _par_lots(cursor, taille_lot):
+    while True:
+        lignes = cursor.fetchmany(taille_lot)
+        if not lignes:
+            return
+        yield from lignes
+
+@mesurer_requete
+def obtenir_commandes_utilisateur(guild_id, user_id, archives=False):
+    """Récupère les commandes (`Commande`) d'un utilisateur sur un serveur, avec les archives si `archives`"""
+    return list(iterer_commandes_utilisateur(guild_id, user_id, archives))
+
+@mesurer_requete
+def iterer_commandes_utilisateur(guild_id, user_id, archives=False, taille_lot=TAILLE_LOT_CURSEUR):
+    """Comme `obtenir_commandes_utilisateur`, mais lit les commandes par lots au fil du parcours.
+
+    À consommer sur le thread qui l'a appelée (la connexion lui est propre).
+    """
+    requete = REQUETE_COMMANDES_UTILISATEUR_ARCHIVES if archives else REQUETE_COMMANDES_UTILISATEUR
+    yield from _par_lots(curseur(Commande).execute(requete, (guild_id, user_id)), taille_lot)
+
+@mesurer_requete
+def obtenir_toutes_commandes(guild_id):
+    """Récupère toutes les commandes (`Commande`) d'un serveur, hors archives"""
+    return curseur(Commande).execute('''
+        SELECT id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande
+        FROM commandes
+        WHERE guild_id = ?
+        ORDER BY date_commande DESC
+    ''', (guild_id,)).fetchall()
+
+REQUETE_COMMANDES_SERVEUR = '''
+    SELECT id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande
+    FROM commandes
+    WHERE guild_id = ?
+    ORDER BY date_commande, id
+'''
+
+REQUETE_COMMANDES_SERVEUR_ARCHIVES = '''
+    SELECT id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande
+    FROM commandes
+    WHERE guild_id = ?1
+    UNION ALL
+    SELECT a.id, a.user_id, a.produit_id, a.quantite, a.prix_unitaire, a.total, a.statut, a.date_commande
+    FROM archive.commandes_archive a
+    WHERE a.guild_id = ?1
+      AND NOT EXISTS (SELECT 1 FROM commandes c WHERE c.id = a.id)
+    ORDER BY 8, 1
+'''
+
+@mesurer_requete
+def iterer_commandes(guild_id, taille_lot=TAILLE_LOT_CURSEUR, archives=False):
+    """Parcourt les commandes d'un serveur dans l'ordre chronologique, par lots, sans les charger en mémoire"""
+    requete = REQUETE_COMMANDES_SERVEUR_ARCHIVES if archives else REQUETE_COMMANDES_SERVEUR
+    yield from _par_lots(curseur(Commande).execute(requete, (guild_id,)), taille_lot)
+
+def _requete_page_commandes(guild_id, avant, apres, limite):
+    requete = '''
+        SELECT c.id, c.user_id, c.produit_id, p.nom, c.quantite, c.prix_unitaire,
+               c.total, c.statut, c.date_commande
+        FROM commandes c
+        LEFT JOIN produits p ON p.id = c.produit_id
+        WHERE c.guild_id = ?
+    '''
+    if apres is not None:
+        requete += 'AND (c.date_commande, c.id) > (?, ?) ORDER BY c.date_commande ASC, c.id ASC LIMIT ?'
+        return requete, (guild_id, *apres, limite)
+    if avant is not None:
+        requete += 'AND (c.date_commande, c.id) < (?, ?) ORDER BY c.date_commande DESC, c.id DESC LIMIT ?'
+        return requete, (guild_id, *avant, limite)
+    requete += 'ORDER BY c.date_commande DESC, c.id DESC LIMIT ?'
+    return requete, (guild_id, limite)
+
+@mesurer_requete
+def obtenir_page_commandes(guild_id, avant=None, apres=None, limite=TAILLE_PAGE_COMMANDES):
+    """Récupère une page des commandes d'un serveur, de la plus récente à la plus ancienne.
+
+    La pagination se fait par clé (`date_commande`, `id`) et non par OFFSET :
+    `avant` donne la page qui suit la clé indiquée, `apres` celle qui la
+    précède. Le coût d'une page ne dépend pas du nombre total de commandes.
+    Retourne `(commandes, encore)`, `encore` indiquant s'il reste des
+    commandes au-delà de la page dans le sens du parcours.
+    """
+    requete, parametres = _requete_page_commandes(guild_id, avant, apres, limite + 1)
+    commandes = curseur(CommandeDetaillee).execute(requete, parametres).fetchall()
+    encore = len(commandes) > limite
+    commandes = commandes[:limite]
+    if apres is not None:
+        commandes.reverse()
+    return commandes, encore
+
+def verifier_stock(guild_id, produit_id, quantite):
+    """Vérifie si un produit a assez de stock"""
+    produit = obtenir_produit(guild_id, produit_id)
+
+    if produit and produit.stock >= quantite:
+        return True
+    return False
+
+def charger_catalogue(guild_id):
+    """(Re)charge le cache du catalogue d'un serveur depuis la base de données"""
+    catalogue = catalogue_de(guild_id)
+    version = catalogue.version
+    produits = lire_produits(guild_id)
+    catalogue.charger(produits, version_attendue=version)
+    return produits
+
+def obtenir_produits(guild_id):
+    """Récupère tous les produits d'un serveur, depuis le cache du catalogue"""
+    catalogue = catalogue_de(guild_id)
+    if catalogue.charge:
+        return catalogue.produits()
+    return charger_catalogue(guild_id)
+
+REQUETE_PRODUITS = 'SELECT id, nom, description, prix, stock FROM produits WHERE guild_id = ? ORDER BY id'
+
+@mesurer_requete
+def lire_produits(guild_id):
+    """Lit tous les produits (`Produit`) d'un serveur dans la base de données (sans passer par le cache)"""
+    return curseur(Produit).execute(REQUETE_PRODUITS, (guild_id,)).fetchall()
+
+def obtenir_produit(guild_id, produit_id):
+    """Récupère un produit du serveur par son ID (None s'il n'existe pas)"""
+    catalogue = catalogue_de(guild_id)
+    if not catalogue.charge:
+        produits = charger_catalogue(guild_id)
+        if not catalogue.charge:
+            # Chargement écarté (le cache a changé pendant la lecture) : la lecture reste valable
+            return next((p for p in produits if p.id == produit_id), None)
+    return catalogue.obtenir(produit_id)
+
+def valider_produit(nom, description, prix, stock):
+    """Vérifie les champs d'un produit, retourne un message d'erreur ou None"""
+    if not math.isfinite(prix):  # un prix infini ou NaN rendrait les montants des ventes NaN
+        return "Le prix doit être un nombre."
+    if prix <= 0:
+        return "Le prix doit être positif."
+    if stock < 0:
+        return "Le stock ne peut pas être négatif."
+    if len(nom) < 3:
+        return "Le nom du produit doit contenir au moins 3 caractères."
+    if len(description) < 10:
+        return "La description doit contenir au moins 10 caractères."
+    return None
+
+@mesurer_requete
+@avec_reessais
+def ajouter_produit(guild_id, nom, description, prix, stock):
+    """Ajoute un nouveau produit à la boutique d'un serveur"""
+    conn = connexion()
+    with transaction(conn):
+        cursor = conn.execute('''
+            INSERT INTO produits (guild_id, nom, description, prix, stock)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (guild_id, nom, description, prix, stock))
+
+    produit_id = cursor.lastrowid
+    catalogue_de(guild_id).mettre_a_jour(Produit(produit_id, nom, description, prix, stock))
+    return produit_id
+
+@mesurer_requete
+def inserer_produits(guild_id, lignes):
+    """Insère en une transaction des produits (nom, description, prix, stock) fournis par un itérable.
+
+    Si l'itérable lève une exception, aucun produit n'est ajouté.
+    Retourne le nombre de produits insérés.
+    """
+    conn = connexion()
+    with transaction(conn, immediate=True):
+        cursor = conn.executemany('''
+            INSERT INTO produits (guild_id, nom, description, prix, stock)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((guild_id, *ligne) for ligne in lignes))
+        nb_produits = cursor.rowcount
+
+    charger_catalogue(guild_id)
+    return nb_produits
+
+# Les commandes annulées (annulation, expiration) n'empêchent pas de supprimer un produit
+REQUETE_COMPTE_COMMANDES_PRODUIT = '''
+    SELECT (SELECT COUNT(*) FROM commandes WHERE produit_id = ?1 AND statut != 'annule')
+         + (SELECT COUNT(*) FROM archive.commandes_archive WHERE produit_id = ?1 AND statut != 'annule')
+'''
+
+@mesurer_requete
+def compter_commandes_produit(produit_id):
+    """Compte les commandes non annulées d'un produit, archives comprises"""
+    return connexion().execute(REQUETE_COMPTE_COMMANDES_PRODUIT, (produit_id,)).fetchone()[0]
+
+@mesurer_requete
+@avec_reessais
+def supprimer_produit(guild_id, produit_id):
+    """Supprime un produit de la boutique d'un serveur"""
+    conn = connexion()
+    with transaction(conn, immediate=True):
+        produit = conn.execute(
+            'SELECT nom FROM produits WHERE id = ? AND guild_id = ?', (produit_id, guild_id)
+        ).fetchone()
+        if not produit:
+            return False
+
+        nb_commandes = conn.execute(REQUETE_COMPTE_COMMANDES_PRODUIT, (produit_id,)).fetchone()[0]
+        if nb_commandes > 0:
+            return False
+
+        conn.execute('DELETE FROM produits WHERE id = ?', (produit_id,))
+
+    catalogue_de(guild_id).retirer(produit_id)
+    return True
+
+def bornes_jour(jour):
+    """Convertit un jour local en intervalle [début, fin[ comparable à `date_commande`.
+
+    Les dates de commande sont stockées en UTC au format 'AAAA-MM-JJ HH:MM:SS'
+    (celui de CURRENT_TIMESTAMP), qui se trie comme les instants qu'il représente :
+    un jour devient une plage de recherche sur l'index.
+    """
+    debut = datetime.combine(jour, datetime.min.time()).astimezone(timezone.utc)
+    fin = datetime.combine(jour + timedelta(days=1), datetime.min.time()).astimezone(timezone.utc)
+    return debut.strftime(FORMAT_HORODATAGE), fin.strftime(FORMAT_HORODATAGE)
+
+def _restaurer_stock(conn, commandes):
+    """Rend au stock les quantités des commandes annulées (liste de (produit_id, quantite))"""
+    quantites = {}
+    for produit_id, quantite in commandes:
+        quantites[produit_id] = quantites.get(produit_id, 0) + quantite
+    conn.executemany(
+        'UPDATE produits SET stock = stock + ? WHERE id = ?',
+        [(quantite, produit_id) for produit_id, quantite in quantites.items()]
+    )
+    return quantites
+
+REQUETE_COMMANDES_DU_JOUR = '''
+    SELECT id, produit_id, quantite
+    FROM commandes
+    WHERE guild_id = ? AND user_id = ? AND date_commande >= ? AND date_commande < ?
+      AND produit_id = ? AND statut IN ('en_attente', 'paye')
+'''
+
+@mesurer_requete
+@avec_reessais
+def annuler_commandes_du_jour(guild_id, user_id, produit_id, jour):
+    """Annule les commandes d'un utilisateur pour un produit passées un jour donné.
+
+    Les commandes en attente ou payées passent au statut `annule` et leur
+    quantité est rendue au stock ; les commandes expédiées ne sont pas
+    concernées. Retourne le nombre de commandes annulées.
+    """
+    debut, fin = bornes_jour(jour)
+    conn = connexion()
+    with transaction(conn, immediate=True):
+        commandes = conn.execute(REQUETE_COMMANDES_DU_JOUR, (guild_id, user_id, debut, fin, produit_id)).fetchall()
+        if not commandes:
+            return 0
+        conn.executemany(
+            "UPDATE commandes SET statut = 'annule' WHERE id = ?",
+            [(commande_id,) for commande_id, _, _ in commandes]
+        )
+        quantites = _restaurer_stock(conn, [(pid, quantite) for _, pid, quantite in commandes])
+
+    catalogue = catalogue_de(guild_id)
+    for pid, quantite in quantites.items():
+        catalogue.ajuster_stock(pid, quantite)
+    return len(commandes)
+
+TAILLE_LOT_EXPIRATION = 500  # commandes annulées au plus par transaction
+
+REQUETE_COMMANDES_EN_ATTENTE = '''
+    SELECT id, date_commande
+    FROM commandes
+    WHERE guild_id = ? AND statut = 'en_attente'
+    ORDER BY date_commande
+'''
+
+@mesurer_requete
+def commandes_en_attente(guild_id):
+    """Retourne les (id, date_commande) des commandes non payées d'un serveur, des plus anciennes aux plus récentes"""
+    return connexion().execute(REQUETE_COMMANDES_EN_ATTENTE, (guild_id,)).fetchall()
+
+@mesurer_requete
+@avec_reessais
+def expirer_commandes(guild_id, commande_ids, avant):
+    """Annule celles des commandes indiquées qui sont encore en attente et datent d'avant `avant`.
+
+    Le statut est revérifié dans la transaction : une commande payée entre-temps
+    n'est pas touchée. La quantité des commandes annulées est rendue au stock.
+    Retourne le nombre de commandes annulées.
+    """
+    conn = connexion()
+    annulees = []
+    with transaction(conn, immediate=True):
+        for i in range(0, len(commande_ids), TAILLE_LOT_EXPIRATION):
+            lot = commande_ids[i:i + TAILLE_LOT_EXPIRATION]
+            annulees += conn.execute(f'''
+                UPDATE commandes SET statut = 'annule'
+                WHERE id IN ({', '.join('?' * len(lot))})
+                  AND guild_id = ? AND statut = 'en_attente' AND date_commande <= ?
+                RETURNING produit_id, quantite
+            ''', (*lot, guild_id, avant)).fetchall()
+        quantites = _restaurer_stock(conn, annulees)
+
+    catalogue = catalogue_de(guild_id)
+    for pid, quantite in quantites.items():
+        catalogue.ajuster_stock(pid, quantite)
+    return len(annulees)
+
+TAILLE_LOT_ARCHIVAGE = 200   # commandes archivées au plus par transaction (écrivain occupé quelques ms)
+PAGES_PAR_COMPACTAGE = 1000  # pages rendues au plus par transaction de `compacter`
+
+COLONNES_ARCHIVE = 'id, guild_id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande, groupe_id'
+
+REQUETE_COMMANDES_A_ARCHIVER = '''
+    SELECT id
+    FROM commandes
+    WHERE guild_id = ? AND statut IN ('envoye', 'annule') AND date_commande < ?
+    LIMIT ?
+'''
+
+@mesurer_requete
+@avec_reessais
+def archiver_commandes(guild_id, avant, taille_lot=TAILLE_LOT_ARCHIVAGE):
+    """Déplace vers la base d'archives un lot de commandes expédiées ou annulées d'avant `avant`.
+
+    La copie puis la suppression sont deux transactions courtes : SQLite ne
+    rend pas atomique un commit sur deux bases en mode WAL. Si la suppression
+    n'a pas lieu, la commande est recopiée au lot suivant (la copie remplace
+    l'ancienne) puis supprimée. Les agrégats `ventes_jour` ne sont pas touchés.
+    Retourne le nombre de commandes archivées : appeler à nouveau tant qu'il
+    vaut `taille_lot`.
+    """
+    conn = connexion()
+    ids = [row[0] for row in conn.execute(REQUETE_COMMANDES_A_ARCHIVER, (guild_id, avant, taille_lot))]
+    if not ids:
+        return 0
+    selection = f"id IN ({', '.join('?' * len(ids))}) AND statut IN ('envoye', 'annule')"
+    with transaction(conn, immediate=True):
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.commandes_archive ({COLONNES_ARCHIVE})
+            SELECT {COLONNES_ARCHIVE} FROM commandes WHERE {selection}
+        ''', ids)
+    with transaction(conn, immediate=True):
+        return conn.execute(f'DELETE FROM commandes WHERE {selection}', ids).rowcount
+
+@mesurer_requete
+@avec_reessais
+def compacter(nb_pages=PAGES_PAR_COMPACTAGE):
+    """Rend au système de fichiers au plus `nb_pages` pages libres de la base (vacuum incrémental).
+
+    Retourne le nombre de pages encore libres : appeler à nouveau tant qu'il
+    n'est pas nul, chaque appel étant une transaction courte.
+    """
+    conn = connexion()
+    # `execute` n'avance le pragma que d'une page : `executescript` l'exécute jusqu'au bout
+    conn.executescript(f'PRAGMA incremental_vacuum({int(nb_pages)})')
+    return conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+def modifier_statut_commande(guild_id, commande_id, statut):
+    """Modifie le statut d'une commande, retourne False si elle n'existe pas.
+
+    Passer une commande à `annule` rend sa quantité au stock ; la sortir de
+    `annule` la réserve à nouveau (ValueError si le stock ne suffit plus).
+    """
+    return _executer_seule('modifier_statut_commande', guild_id, commande_id, statut)
+
+@mesurer_requete
+def rapport_ventes(guild_id, debut=None, fin=None):
+    """Totaux des ventes d'un serveur par produit entre deux jours locaux [debut, fin[ (bornes facultatives).
+
+    Lit uniquement la table d'agrégats `ventes_jour` : le coût dépend du nombre
+    de jours et de produits de la période, pas du nombre de commandes.
+    Retourne des `LigneVentes` triées par chiffre d'affaires décroissant.
+    """
+    return curseur(LigneVentes).execute(REQUETE_RAPPORT_VENTES, (
+        guild_id,
+        debut.isoformat() if debut else '0000-00-00',
+        fin.isoformat() if fin else '9999-99-99',
+    )).fetchall()
+
+REQUETE_RAPPORT_VENTES = '''
+    SELECT produit_id, SUM(nb_commandes), SUM(unites), SUM(chiffre_affaires), SUM(montant_encaisse)
+    FROM ventes_jour
+    WHERE guild_id = ? AND jour >= ? AND jour < ?
+    GROUP BY produit_id
+    HAVING SUM(nb_commandes) != 0 OR SUM(montant_encaisse) != 0
+    ORDER BY SUM(chiffre_affaires) DESC
+'''
+
+def requetes_indexees():
+    """Requêtes des parcours fréquents, qui doivent toujours passer par un index.
+
+    Associe à chaque nom `(requete, parametres, parcours_autorise)` ; toutes
+    commencent par une recherche sur le serveur (`guild_id` en tête des index)
+    et ne doivent jamais parcourir les données des autres serveurs.
+    """
+    return {
+        'produits': (REQUETE_PRODUITS, (0,), False),
+        'commandes_utilisateur': (REQUETE_COMMANDES_UTILISATEUR, (0, 0), False),
+        'commandes_utilisateur_archives': (REQUETE_COMMANDES_UTILISATEUR_ARCHIVES, (0, 0), False),
+        'commandes_serveur_archives': (REQUETE_COMMANDES_SERVEUR_ARCHIVES, (0,), False),
+        'commandes_a_archiver': (REQUETE_COMMANDES_A_ARCHIVER, (0, '', 0), False),
+        'compte_commandes_produit': (REQUETE_COMPTE_COMMANDES_PRODUIT, (0,), False),
+        'commandes_du_jour': (REQUETE_COMMANDES_DU_JOUR, (0, 0, '', '', 0), False),
+        'commandes_en_attente': (REQUETE_COMMANDES_EN_ATTENTE, (0,), False),
+        'commandes_groupe': (REQUETE_COMMANDES_GROUPE, (0, 0), False),
+        'premiere_page_commandes': (*_requete_page_commandes(0, None, None, TAILLE_PAGE_COMMANDES), False),
+        'page_commandes_suivante': (*_requete_page_commandes(0, ('', 0), None, TAILLE_PAGE_COMMANDES), False),
+        'page_commandes_precedente': (*_requete_page_commandes(0, None, ('', 0), TAILLE_PAGE_COMMANDES), False),
+    }
+
+def plans_sans_index():
+    """Vérifie avec EXPLAIN QUERY PLAN que les requêtes indexées n'ont pas régressé.
+
+    Retourne, pour chaque requête fautive, les étapes du plan qui parcourent
+    une table entière ou trient les résultats en mémoire.
+    """
+    conn = connexion()
+    regressions = {}
+    for nom, (requete, parametres, parcours_autorise) in requetes_indexees().items():
+        etapes = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + requete, parametres)]
+        fautives = [
+            etape for etape in etapes
+            if (etape.startswith('SCAN') and etape != 'SCAN CONSTANT ROW'  # SELECT sans FROM
+                and not (parcours_autorise and 'USING' in etape))
+            or 'TEMP B-TREE' in etape
+        ]
+        if fautives:
+            regressions[nom] = fautives
+    return regressions
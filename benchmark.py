@@ -0,0 +1,475 @@
+"""Mesures de performance de la boutique, sans connexion Discord.
+
+Usage :
+    python benchmark.py boucle [--duree 5] [--ecrivains 8]
+    python benchmark.py stock [--acheteurs 16] [--achats 200] [--stock 1000]
+    python benchmark.py lots [--acheteurs 200] [--duree 3] [--taille-lot 200]
+    python benchmark.py paiements [--commandes 5000] [--concurrence 500] [--http 8081]
+    python benchmark.py plans
+    python benchmark.py archivage [--commandes 200000] [--retention 90]
+    python benchmark.py memoire [--commandes 100000]
+    python benchmark.py charge [--debit 200] [--duree 10] [--melange acheter=3,produits=5] [--serveurs 1]
+                               [--base copie.db | --bases-par-serveur]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import base_donnees as bd
+from stockage import TAILLE_LOT, Boutiques, Stockage
+
+SERVEUR = bd.SERVEUR_HISTORIQUE  # serveur des mesures qui n'en simulent qu'un
+
+
+def centile(valeurs, p):
+    """Retourne le centile p (0-100) d'une liste de valeurs"""
+    if not valeurs:
+        return 0.0
+    valeurs = sorted(valeurs)
+    index = min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))
+    return valeurs[index]
+
+def base_temporaire():
+    """Crée une base vide dans un dossier temporaire et la désigne comme base courante"""
+    dossier = tempfile.mkdtemp(prefix="boutique-bench-")
+    chemin = os.path.join(dossier, "boutique.db")
+    bd.configurer(chemin)
+    bd.initialiser_base_donnees()
+    return chemin
+
+
+async def mesurer_retard_boucle(duree, intervalle=0.005):
+    """Mesure le retard de réveil de la boucle asyncio (en ms) pendant `duree` secondes"""
+    retards = []
+    fin = time.perf_counter() + duree
+    while time.perf_counter() < fin:
+        debut = time.perf_counter()
+        await asyncio.sleep(intervalle)
+        retards.append((time.perf_counter() - debut - intervalle) * 1000)
+    return retards
+
+def boucle_stable(repos, charge):
+    """La boucle reste réactive : le p99 de son retard sous charge reste du même ordre qu'au repos"""
+    return centile(charge, 99) <= max(5 * centile(repos, 99), 5.0)
+
+async def saturer_ecritures(stockage, arret, compteur):
+    """Enchaîne les commandes sans pause jusqu'à ce que `arret` soit positionné"""
+    while not arret.is_set():
+        await stockage.ajouter_commande(SERVEUR, 42, 1, 1, 25.0)
+        compteur[0] += 1
+
+async def bench_boucle(args):
+    stockage = Stockage(base_temporaire())
+    try:
+        repos = await mesurer_retard_boucle(args.duree)
+
+        arret = asyncio.Event()
+        compteur = [0]
+        ecrivains = [asyncio.create_task(saturer_ecritures(stockage, arret, compteur)) for _ in range(args.ecrivains)]
+        charge = await mesurer_retard_boucle(args.duree)
+        arret.set()
+        await asyncio.gather(*ecrivains)
+    finally:
+        stockage.fermer()
+
+    print(f"Écritures effectuées pendant la mesure : {compteur[0]} ({compteur[0] / args.duree:.0f}/s)")
+    for nom, retards in (("au repos", repos), ("sous charge", charge)):
+        print(
+            f"Retard de la boucle {nom:12} : médiane {statistics.median(retards):.2f} ms, "
+            f"p99 {centile(retards, 99):.2f} ms, max {max(retards):.2f} ms"
+        )
+
+    ok = boucle_stable(repos, charge)
+    print("✅ Latence de la boucle stable" if ok else "❌ La boucle est bloquée par les écritures")
+    return 0 if ok else 1
+
+def bench_stock(args):
+    """Fait acheter un même produit par de nombreux threads, chacun avec sa propre connexion"""
+    base_temporaire()
+    conn = bd.connexion()
+    conn.execute('UPDATE produits SET stock = ? WHERE id = 1', (args.stock,))
+    bd.charger_catalogue(SERVEUR)
+
+    latences = []
+    compteurs = {'reussies': 0, 'refusees': 0, 'erreurs': 0}
+    verrou = threading.Lock()
+
+    def acheteur(user_id):
+        for _ in range(args.achats):
+            debut = time.perf_counter()
+            try:
+                resultat = bd.ajouter_commande(SERVEUR, user_id, 1, 1, 25.0)
+                cle = 'reussies' if resultat is not None else 'refusees'
+            except sqlite3.OperationalError:
+                cle = 'erreurs'
+            duree = (time.perf_counter() - debut) * 1000
+            with verrou:
+                latences.append(duree)
+                compteurs[cle] += 1
+
+    threads = [threading.Thread(target=acheteur, args=(i,)) for i in range(args.acheteurs)]
+    debut = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duree = time.perf_counter() - debut
+
+    stock_final = conn.execute('SELECT stock FROM produits WHERE id = 1').fetchone()[0]
+    vendues = conn.execute('SELECT COALESCE(SUM(quantite), 0) FROM commandes WHERE produit_id = 1').fetchone()[0]
+    bd.fermer_connexions()
+
+    print(f"{args.acheteurs} acheteurs x {args.achats} achats sur un stock de {args.stock}")
+    print(
+        f"Commandes : {compteurs['reussies']} acceptées, {compteurs['refusees']} refusées (stock épuisé), "
+        f"{compteurs['erreurs']} erreurs de verrou"
+    )
+    print(f"Débit : {(compteurs['reussies'] + compteurs['refusees']) / duree:.0f} tentatives/s, {compteurs['reussies'] / duree:.0f} commandes/s")
+    print(f"Latence : médiane {statistics.median(latences):.2f} ms, p99 {centile(latences, 99):.2f} ms")
+    print(f"Stock final : {stock_final}, unités vendues : {vendues}")
+
+    ok = stock_final >= 0 and stock_final + vendues == args.stock and compteurs['reussies'] == vendues
+    print("✅ Aucune survente" if ok else "❌ Incohérence du stock")
+    return 0 if ok else 1
+
+async def acheter_en_continu(stockage, duree, acheteurs):
+    """Lance `acheteurs` tâches qui commandent sans pause pendant `duree` secondes"""
+    compteurs = {'reussies': 0, 'refusees': 0}
+    fin = time.perf_counter() + duree
+
+    async def acheteur(user_id):
+        while time.perf_counter() < fin:
+            resultat = await stockage.ajouter_commande(SERVEUR, user_id, 1, 1, 25.0)
+            compteurs['reussies' if resultat is not None else 'refusees'] += 1
+
+    await asyncio.gather(*(acheteur(i) for i in range(acheteurs)))
+    return compteurs
+
+async def bench_lots(args):
+    """Compare le débit de commandes avec et sans validation groupée"""
+    debits = {}
+    for nom, taille_lot in (("une transaction par commande", 1), ("validation groupée", args.taille_lot)):
+        stockage = Stockage(base_temporaire(), taille_lot=taille_lot)
+        try:
+            await stockage.initialiser()
+            bd.connexion().execute('UPDATE produits SET stock = ? WHERE id = 1', (10 ** 9,))
+            bd.charger_catalogue(SERVEUR)
+            compteurs = await acheter_en_continu(stockage, args.duree, args.acheteurs)
+        finally:
+            stockage.fermer()
+        debits[nom] = compteurs['reussies'] / args.duree
+        print(f"{nom:30} : {debits[nom]:8.0f} commandes/s ({compteurs['refusees']} refusées)")
+
+    gain = debits["validation groupée"] / debits["une transaction par commande"]
+    print(f"Gain : x{gain:.1f}")
+    return 0
+
+async def bench_paiements(args):
+    """Rejoue des notifications de paiement (doublons et anomalies compris) et vérifie les statuts"""
+    import paiements
+
+    boutiques = Boutiques(base_temporaire())
+    try:
+        stockage = await boutiques.pour(SERVEUR)
+        bd.connexion().execute('UPDATE produits SET stock = ? WHERE id = 1', (10 ** 9,))
+        bd.charger_catalogue(SERVEUR)
+        commandes = await asyncio.gather(*(
+            stockage.ajouter_commande(SERVEUR, i, 1, 1, 25.0) for i in range(args.commandes)
+        ))
+        notifications = paiements.simuler_notifications([(SERVEUR, c, 25.0) for c in commandes])
+        pipeline = paiements.PipelinePaiements(boutiques, signaler=lambda message: None)
+
+        if args.http:
+            import aiohttp
+            runner = await paiements.demarrer_serveur_paiements(pipeline, args.http)
+            session = aiohttp.ClientSession()
+            url = f"http://127.0.0.1:{args.http}{paiements.CHEMIN_WEBHOOK}"
+
+            async def envoyer(notification):
+                async with session.post(url, json=notification) as reponse:
+                    reponse.raise_for_status()
+        else:
+            envoyer = pipeline.recevoir
+
+        latences = []
+        limite = asyncio.Semaphore(args.concurrence)
+
+        async def recevoir(notification):
+            async with limite:
+                debut = time.perf_counter()
+                await envoyer(notification)
+                latences.append((time.perf_counter() - debut) * 1000)
+
+        debut = time.perf_counter()
+        try:
+            await asyncio.gather(*(recevoir(n) for n in notifications))
+        finally:
+            if args.http:
+                await session.close()
+                await runner.cleanup()
+        duree = time.perf_counter() - debut
+
+        statuts = dict(bd.connexion().execute('SELECT statut, COUNT(*) FROM commandes GROUP BY statut').fetchall())
+        nb_notifications = bd.connexion().execute('SELECT COUNT(*) FROM paiements').fetchone()[0]
+    finally:
+        boutiques.fermer()
+
+    print(f"{len(notifications)} notifications pour {args.commandes} commandes en {duree:.2f} s ({len(notifications) / duree:.0f}/s)")
+    print(f"Latence : médiane {statistics.median(latences):.2f} ms, p99 {centile(latences, 99):.2f} ms")
+    print("Résultats : " + ", ".join(f"{nom} {n}" for nom, n in sorted(pipeline.resultats.items())))
+
+    ok = (
+        statuts.get('paye', 0) == pipeline.resultats['paye']
+        and statuts.get('paye', 0) + statuts.get('en_attente', 0) == args.commandes
+        and statuts.get('en_attente', 0) == pipeline.resultats['montant_incorrect']
+        and nb_notifications == args.commandes
+    )
+    print("✅ Chaque commande payée une seule fois" if ok else f"❌ Statuts incohérents : {statuts}")
+    return 0 if ok else 1
+
+def bench_plans(args):
+    """Vérifie que les requêtes fréquentes utilisent leurs index (EXPLAIN QUERY PLAN)"""
+    base_temporaire()
+    regressions = bd.plans_sans_index()
+    bd.fermer_connexions()
+
+    for nom, etapes in regressions.items():
+        print(f"❌ {nom} : {', '.join(etapes)}")
+    if regressions:
+        return 1
+    print(f"✅ {len(bd.requetes_indexees())} requêtes vérifiées, toutes indexées")
+    return 0
+
+def taille_fichiers(chemin):
+    """Taille en Mo d'une base et de son journal WAL"""
+    return sum(os.path.getsize(f) for f in (chemin, chemin + '-wal') if os.path.exists(f)) / 1e6
+
+def bench_archivage(args):
+    """Archive l'historique ancien d'une base peuplée puis la compacte, sans bloquer les écritures"""
+    import random
+    from datetime import datetime, timedelta, timezone
+
+    chemin = base_temporaire()
+    conn = bd.connexion()
+    maintenant = datetime.now(timezone.utc)
+    statuts = ('en_attente', 'paye', 'envoye', 'envoye', 'envoye', 'annule')
+    with bd.transaction(conn, immediate=True):
+        conn.executemany('''
+            INSERT INTO commandes (guild_id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande)
+            VALUES (?, ?, 1, 1, 25.0, 25.0, ?, ?)
+        ''', (
+            (SERVEUR, random.randrange(1000), random.choice(statuts),
+             (maintenant - timedelta(days=random.uniform(0, 4 * args.retention))).strftime(bd.FORMAT_HORODATAGE))
+            for _ in range(args.commandes)
+        ))
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    ventes_avant = conn.execute('SELECT SUM(nb_commandes), SUM(montant_encaisse) FROM ventes_jour').fetchone()
+    historique_avant = len(bd.obtenir_commandes_utilisateur(SERVEUR, 1))
+    taille_avant = taille_fichiers(chemin)
+
+    avant = (maintenant - timedelta(days=args.retention)).strftime(bd.FORMAT_HORODATAGE)
+    durees = []
+    debut = time.perf_counter()
+    while True:
+        t = time.perf_counter()
+        nb = bd.archiver_commandes(SERVEUR, avant)
+        durees.append((time.perf_counter() - t) * 1000)
+        if nb < bd.TAILLE_LOT_ARCHIVAGE:
+            break
+    duree_archivage = time.perf_counter() - debut
+    pages_libres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    durees_compactage = []
+    while True:
+        t = time.perf_counter()
+        restantes = bd.compacter()
+        durees_compactage.append((time.perf_counter() - t) * 1000)
+        if not restantes:
+            break
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    taille_apres = taille_fichiers(chemin)
+
+    restantes = conn.execute('SELECT COUNT(*) FROM commandes').fetchone()[0]
+    archivees = conn.execute('SELECT COUNT(*) FROM archive.commandes_archive').fetchone()[0]
+    ventes_apres = conn.execute('SELECT SUM(nb_commandes), SUM(montant_encaisse) FROM ventes_jour').fetchone()
+    historique_courant = len(bd.obtenir_commandes_utilisateur(SERVEUR, 1))
+    historique_complet = len(bd.obtenir_commandes_utilisateur(SERVEUR, 1, archives=True))
+    bd.fermer_connexions()
+
+    print(f"Archivage : {archivees} commandes en {duree_archivage:.2f} s, {len(durees)} lots "
+          f"(p99 {centile(durees, 99):.1f} ms, max {max(durees):.1f} ms par lot)")
+    print(f"Compactage : {pages_libres} pages libres rendues en {len(durees_compactage)} transactions "
+          f"(max {max(durees_compactage):.1f} ms)")
+    print(f"Base principale : {taille_avant:.1f} Mo -> {taille_apres:.1f} Mo, {restantes} commandes courantes")
+    print(f"Historique de l'utilisateur 1 : {historique_courant} commandes courantes, {historique_complet} avec les archives")
+    ok = (
+        restantes + archivees == args.commandes
+        and ventes_apres == ventes_avant
+        and historique_complet == historique_avant
+    )
+    print("✅ Aucune commande perdue, agrégats inchangés" if ok else "❌ Archivage incohérent")
+    return 0 if ok else 1
+
+def pic_memoire(fonction):
+    """Exécute `fonction` sous tracemalloc, retourne (pic d'allocation en Mo, durée en s)"""
+    tracemalloc.start()
+    debut = time.perf_counter()
+    resultat = fonction()  # gardé en vie jusqu'à la mesure du pic
+    duree = time.perf_counter() - debut
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del resultat
+    return pic / 1e6, duree
+
+def commandes_en_dicts(guild_id):
+    """Lecture de toutes les commandes en dicts, telle que la faisait `obtenir_toutes_commandes` (référence)"""
+    champs = bd.Commande._fields
+    rows = bd.connexion().execute(bd.REQUETE_COMMANDES_SERVEUR, (guild_id,)).fetchall()
+    return [dict(zip(champs, row)) for row in rows]
+
+def bench_memoire(args):
+    """Mémoire allouée pour lire toutes les commandes : dicts, tuples nommés, parcours par lots"""
+    base_temporaire()
+    conn = bd.connexion()
+    with bd.transaction(conn, immediate=True):
+        conn.executemany('''
+            INSERT INTO commandes (guild_id, user_id, produit_id, quantite, prix_unitaire, total, statut)
+            VALUES (?, ?, 1, 2, 25.0, 50.0, 'envoye')
+        ''', ((SERVEUR, i % 1000) for i in range(args.commandes)))
+
+    mesures = {
+        "dicts (fetchall)": lambda: commandes_en_dicts(SERVEUR),
+        "tuples nommés (fetchall)": lambda: bd.obtenir_toutes_commandes(SERVEUR),
+        "parcours par lots (fetchmany)": lambda: sum(c.total for c in bd.iterer_commandes(SERVEUR)),
+    }
+    pics = {}
+    for nom, fonction in mesures.items():
+        pics[nom], duree = pic_memoire(fonction)
+        print(f"{nom:30} : pic {pics[nom]:7.1f} Mo, {duree * 1000:6.0f} ms")
+    bd.fermer_connexions()
+
+    reference = pics["dicts (fetchall)"]
+    print(f"Réduction : x{reference / pics['tuples nommés (fetchall)']:.1f} avec les tuples nommés, "
+          f"x{reference / pics['parcours par lots (fetchmany)']:.0f} en parcours par lots")
+    return 0
+
+def bench_charge(args):
+    """Rejoue un mélange de commandes slash sur une base peuplée, sans Discord"""
+    if args.bases_par_serveur:
+        # Lu par le bot à son import : une base par serveur dans ce dossier
+        os.environ['DOSSIER_BASES'] = tempfile.mkdtemp(prefix="boutique-bench-")
+
+    # Import tardif : nécessite discord.py, contrairement aux autres mesures
+    import charge
+
+    melange = charge.lire_melange(args.melange) if args.melange else charge.MELANGE_DEFAUT
+    produits_par_serveur = {}
+    if args.base:
+        bd.configurer(args.base)
+        bd.migrer()
+        for guild_id in bd.serveurs():
+            produits_par_serveur[guild_id] = [p.id for p in bd.lire_produits(guild_id)]
+    else:
+        base_temporaire()
+        debut = time.perf_counter()
+        for guild_id in range(1, args.serveurs + 1):
+            chemin = charge.bb.boutiques.chemin(guild_id) if args.bases_par_serveur else None
+            produits_par_serveur[guild_id] = bd.sur_base(
+                chemin, charge.peupler, guild_id,
+                args.produits, args.commandes // args.serveurs, args.utilisateurs
+            )
+        print(
+            f"Base peuplée : {args.serveurs} serveur(s) de {args.produits} produits, {args.commandes} commandes au total "
+            f"({time.perf_counter() - debut:.1f} s)"
+        )
+
+    async def executer():
+        try:
+            return await charge.executer_charge(melange, args.debit, args.duree, args.utilisateurs, produits_par_serveur)
+        finally:
+            charge.bb.boutiques.fermer()
+
+    resultats = asyncio.run(executer())
+
+    print(f"Débit visé : {args.debit:.0f} appels/s pendant {args.duree:.0f} s")
+    print(f"{'commande':22} {'appels':>7} {'/s':>7} {'erreurs':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'accusé p99':>11}")
+    total_erreurs = 0
+    for nom, r in sorted(resultats.items()):
+        latences = [l * 1000 for l in r['latences']]
+        total_erreurs += r['erreurs']
+        print(
+            f"{nom:22} {len(latences):7} {len(latences) / args.duree:7.1f} {r['erreurs']:8} "
+            f"{centile(latences, 50):8.2f} {centile(latences, 95):8.2f} {centile(latences, 99):8.2f} "
+            f"{centile([a * 1000 for a in r['accuses']], 99):11.2f}"
+        )
+    if charge.bb.limiteur.rejets:
+        rejets = ", ".join(f"{nom} {n}" for nom, n in sorted(charge.bb.limiteur.rejets.items()))
+        print(f"Appels refusés par la limitation de débit : {rejets}")
+    return 1 if total_erreurs else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesures de performance de la boutique")
+    sous = parser.add_subparsers(dest="mesure", required=True)
+
+    boucle = sous.add_parser("boucle", help="Latence de la boucle asyncio pendant des écritures saturées")
+    boucle.add_argument("--duree", type=float, default=5.0, help="Durée de chaque phase en secondes")
+    boucle.add_argument("--ecrivains", type=int, default=8, help="Nombre de tâches d'écriture concurrentes")
+    boucle.set_defaults(executer=bench_boucle)
+
+    stock = sous.add_parser("stock", help="Achats concurrents d'un même produit (survente, débit, p99)")
+    stock.add_argument("--acheteurs", type=int, default=16, help="Nombre de threads acheteurs")
+    stock.add_argument("--achats", type=int, default=200, help="Achats tentés par acheteur")
+    stock.add_argument("--stock", type=int, default=1000, help="Stock initial du produit")
+    stock.set_defaults(executer=bench_stock)
+
+    lots = sous.add_parser("lots", help="Débit de commandes avec et sans validation groupée")
+    lots.add_argument("--acheteurs", type=int, default=200, help="Nombre de tâches acheteuses concurrentes")
+    lots.add_argument("--duree", type=float, default=3.0, help="Durée de chaque mesure en secondes")
+    lots.add_argument("--taille-lot", type=int, default=TAILLE_LOT, help="Opérations au plus par transaction")
+    lots.set_defaults(executer=bench_lots)
+
+    paiements = sous.add_parser("paiements", help="Rejoue des notifications de paiement et vérifie les statuts")
+    paiements.add_argument("--commandes", type=int, default=5000, help="Nombre de commandes à payer")
+    paiements.add_argument("--concurrence", type=int, default=500, help="Notifications traitées simultanément")
+    paiements.add_argument("--http", type=int, metavar="PORT", help="Passe par le webhook HTTP local (nécessite aiohttp)")
+    paiements.set_defaults(executer=bench_paiements)
+
+    plans = sous.add_parser("plans", help="Détecte les requêtes fréquentes qui ne passent plus par un index")
+    plans.set_defaults(executer=bench_plans)
+
+    archivage = sous.add_parser("archivage", help="Archive l'historique ancien et compacte la base")
+    archivage.add_argument("--commandes", type=int, default=200_000, help="Commandes créées dans la base temporaire")
+    archivage.add_argument("--retention", type=float, default=90.0, help="Jours de commandes gardés dans la table courante")
+    archivage.set_defaults(executer=bench_archivage)
+
+    memoire = sous.add_parser("memoire", help="Mémoire allouée pour lire toutes les commandes (tracemalloc)")
+    memoire.add_argument("--commandes", type=int, default=100_000, help="Commandes créées dans la base temporaire")
+    memoire.set_defaults(executer=bench_memoire)
+
+    charge = sous.add_parser("charge", help="Rejoue des commandes slash avec de fausses interactions (nécessite discord.py)")
+    charge.add_argument("--debit", type=float, default=200.0, help="Appels par seconde visés")
+    charge.add_argument("--duree", type=float, default=10.0, help="Durée du test en secondes")
+    charge.add_argument("--melange", help="Poids des commandes, ex. 'acheter=3,produits=5,mes_commandes=2'")
+    charge.add_argument("--utilisateurs", type=int, default=1000, help="Nombre d'utilisateurs simulés")
+    charge.add_argument("--produits", type=int, default=200, help="Produits créés par serveur dans la base temporaire")
+    charge.add_argument("--commandes", type=int, default=100_000, help="Commandes créées dans la base temporaire")
+    charge.add_argument("--serveurs", type=int, default=1, help="Serveurs Discord simulés, chacun avec sa boutique")
+    charge.add_argument("--bases-par-serveur", action="store_true", help="Une base par serveur au lieu d'une base commune")
+    charge.add_argument("--base", help="Base existante à utiliser (elle sera modifiée : travailler sur une copie)")
+    charge.set_defaults(executer=bench_charge)
+
+    args = parser.parse_args()
+    resultat = args.executer(args)
+    if asyncio.iscoroutine(resultat):
+        resultat = asyncio.run(resultat)
+    return resultat
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,80 @@
 import discord
 from discord import app_commands
-import sqlite3
+import asyncio
+import hashlib
+import json
 import os
-from datetime import datetime
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
 from enum import Enum
+from functools import partial
+from itertools import chain
 from dotenv import load_dotenv
 
+from archivage import Archivage
+from base_donnees import StockInsuffisant, valider_produit
+from echanges import ErreurImport, FORMATS, format_fichier
+from expiration import PlanificateurExpiration
+from limiteur import Limiteur, limiter
+from metriques import demarrer_serveur, exporter_fichier, mesurer_commande, rendre_metriques
+from paiements import PipelinePaiements, demarrer_serveur_paiements, reference_paiement
+from panier import Paniers
+from recherche import LIMITE_SUGGESTIONS
+from rendu import (
+    LIMITE_MESSAGE, CacheRendu, decouper_messages, rendre_catalogue, rendre_catalogue_admin, rendre_commandes, rendre_panier
+)
+from stockage import Boutiques
+from travaux import PRIORITE_FICHIER, PRIORITE_INTERACTIVE, PRIORITE_RAPPORT, FileSaturee, FileTravaux
+
 # Chargement des variables d'environnement
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 PAYPAL_USER = os.getenv('PAYPAL_USER', 'toncompte')
+# Serveur de développement : les commandes y sont synchronisées immédiatement
+DEV_GUILD_ID = os.getenv('DEV_GUILD_ID')
+FORCER_SYNC = os.getenv('FORCER_SYNC', '') == '1'
+
+# Une boutique par serveur : dans une base commune, ou une base par serveur dans DOSSIER_BASES
+DOSSIER_BASES = os.getenv('DOSSIER_BASES')
+# Serveur auquel rattacher les données d'avant le découpage par serveur
+SERVEUR_HISTORIQUE = int(os.getenv('SERVEUR_HISTORIQUE', '0'))
+# Nombre de shards (connexions à la gateway) ; par défaut, celui recommandé par Discord
+NB_SHARDS = os.getenv('NB_SHARDS')
+
+# Export des métriques au format Prometheus (facultatif)
+METRIQUES_PORT = os.getenv('METRIQUES_PORT')
+METRIQUES_FICHIER = os.getenv('METRIQUES_FICHIER')
+
+# Webhook local des notifications de paiement (facultatif)
+PAIEMENTS_PORT = os.getenv('PAIEMENTS_PORT')
+PAIEMENTS_SECRET = os.getenv('PAIEMENTS_SECRET')
+
+# Débit maximal des commandes d'écriture : (rafale, appels par seconde) par utilisateur
+LIMITES_ECRITURE = {
+    "acheter": (5, 1 / 2),
+    "panier_valider": (5, 1 / 2),
+    "annuler_commande": (3, 1 / 5),
+    "ajouter_produit": (5, 1 / 2),
+    "supprimer_produit": (5, 1 / 2),
+    "importer_produits": (2, 1 / 30),
+    "modifier_statut": (10, 1),
+}
+# Budget partagé par tous les utilisateurs (écritures par seconde)
+ECRITURES_PAR_SECONDE = float(os.getenv('ECRITURES_PAR_SECONDE', '50'))
+
+# Délai de paiement : passé ce délai, une commande en attente est annulée et son stock rendu
+DELAI_PAIEMENT = timedelta(hours=float(os.getenv('DELAI_PAIEMENT_HEURES', '24')))
+
+# Archivage : les commandes expédiées ou annulées depuis plus de RETENTION_JOURS
+# quittent la table des commandes (toujours consultables avec /mes_commandes archives:True)
+RETENTION_COMMANDES = timedelta(days=float(os.getenv('RETENTION_JOURS', '90')))
+INTERVALLE_ARCHIVAGE = timedelta(hours=float(os.getenv('ARCHIVAGE_HEURES', '6')))
+
+FICHIER_EMPREINTES_COMMANDES = '.commandes_sync.json'
+DEBUT_PROCESSUS = time.perf_counter()
 
-DATABASE_FILE = 'boutique.db'
 DATE_FORMAT = "%d/%m/%Y"
 
 class Statut(Enum):
@@ -31,242 +94,97 @@ class Statut(Enum):
 
 
 
-def initialiser_base_donnees():
-    """Initialise la base de données SQLite avec les tables nécessaires"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    # Création de la table des produits
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS produits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nom TEXT NOT NULL,
-            description TEXT NOT NULL,
-            prix REAL NOT NULL,
-            stock INTEGER DEFAULT 0,
-            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Création de la table des commandes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS commandes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            produit_id INTEGER NOT NULL,
-            quantite INTEGER NOT NULL,
-            prix_unitaire REAL NOT NULL,
-            total REAL NOT NULL,
-            statut TEXT DEFAULT 'en_attente',
-            date_commande TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (produit_id) REFERENCES produits (id)
-        )
-    ''')
-    
-    # Insertion des produits par défaut s'ils n'existent pas
-    cursor.execute('SELECT COUNT(*) FROM produits')
-    if cursor.fetchone()[0] == 0:
-        produits_defaut = [
-            ("T-shirt Bessans", "T-shirt en coton avec le logo de Bessans", 25.0, 50),
-            ("Casquette Montagne", "Casquette de randonnée avec protection UV", 15.0, 30),
-            ("Mug Bessans", "Mug en céramique avec vue sur les montagnes", 12.0, 25),
-            ("Poster Panoramique", "Poster A3 des plus belles vues de Bessans", 8.0, 40),
-            ("Stickers Pack", "Pack de 5 stickers Bessans pour voiture", 5.0, 100)
-        ]
-        cursor.executemany('''
-            INSERT INTO produits (nom, description, prix, stock)
-            VALUES (?, ?, ?, ?)
-        ''', produits_defaut)
-    
-    conn.commit()
-    conn.close()
-
-def ajouter_commande(user_id, produit_id, quantite, prix_unitaire):
-    """Ajoute une nouvelle commande à la base de données"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    total = quantite * prix_unitaire
-    
-    cursor.execute('''
-        INSERT INTO commandes (user_id, produit_id, quantite, prix_unitaire, total)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, produit_id, quantite, prix_unitaire, total))
-    
-    # Mise à jour du stock
-    cursor.execute('''
-        UPDATE produits 
-        SET stock = stock - ? 
-        WHERE id = ?
-    ''', (quantite, produit_id))
-    
-    conn.commit()
-    conn.close()
-
-def obtenir_commandes_utilisateur(user_id):
-    """Récupère toutes les commandes d'un utilisateur"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT c.produit_id, c.quantite, c.prix_unitaire, c.total, c.statut, c.date_commande
-        FROM commandes c
-        WHERE c.user_id = ?
-        ORDER BY c.date_commande DESC
-    ''', (user_id,))
-    
-    commandes = []
-    for row in cursor.fetchall():
-        commandes.append({
-            'user_id': user_id,
-            'produit_id': row[0],
-            'quantite': row[1],
-            'prix_unitaire': row[2],
-            'total': row[3],
-            'statut': row[4],
-            'date_commande': row[5]
-        })
-    
-    conn.close()
-    return commandes
-
-def obtenir_toutes_commandes():
-    """Récupère toutes les commandes"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande
-        FROM commandes
-        ORDER BY date_commande DESC
-    ''')
-    
-    commandes = []
-    for row in cursor.fetchall():
-        commandes.append({
-            'id': row[0],
-            'user_id': row[1],
-            'produit_id': row[2],
-            'quantite': row[3],
-            'prix_unitaire': row[4],
-            'total': row[5],
-            'statut': row[6],
-            'date_commande': row[7]
-        })
-    
-    conn.close()
-    return commandes
-
-def verifier_stock(produit_id, quantite):
-    """Vérifie si un produit a assez de stock"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
-    
-    if result and result[0] >= quantite:
-        return True
-    return False
-
 def calculer_montant(produit, quantite):
-    return quantite * produit['prix']
-
-def generer_lien_paypal(produit, quantite, montant):
-    note = f"{produit['nom']} x{quantite}".replace(' ', '+')
-    return f"https://www.paypal.com/paypalme/{PAYPAL_USER}/{montant}?locale.x=fr_FR&note={note}"
-
-def format_commandes(user_id, commandes):
-    user_cmd = [c for c in commandes if c['user_id'] == user_id]
-    if not user_cmd:
-        return "Tu n'as aucune commande. 😢\nAchète vite des produits de la boutique !"
-    
-    produits = obtenir_produits()
-    msg = "__**🛒 Tes commandes :**__\n"
-    for c in user_cmd:
-        produit = next((p for p in produits if p['id'] == c['produit_id']), None)
-        if produit:
-            msg += (
-                f"📦 **{produit['nom']}**\n"
-                f"   📊 Quantité : {c['quantite']}x\n"
-                f"   💶 Prix unitaire : {c['prix_unitaire']} €\n"
-                f"   💰 Total : {c['total']} €\n"
-                f"   📋 Statut : {c['statut']}\n"
-                "-----------------------------\n"
-            )
-    msg += "\nMerci pour tes achats ! 🛍️"
+    return quantite * produit.prix
+
+def _lien_paypal(montant, note):
+    return f"https://www.paypal.com/paypalme/{PAYPAL_USER}/{montant}?locale.x=fr_FR&note={note.replace(' ', '+')}"
+
+def generer_lien_paypal(produit, quantite, montant, commande_id=None, guild_id=None):
+    note = f"{produit.nom} x{quantite}"
+    if commande_id is not None:
+        # Référence de la commande rappelée dans la note, pour le rapprochement du paiement
+        note = f"Commande {reference_paiement(guild_id, commande_id)} - {note}"
+    return _lien_paypal(montant, note)
+
+def generer_lien_paypal_groupe(guild_id, groupe_id, nb_articles, montant):
+    return _lien_paypal(montant, f"Commande {reference_paiement(guild_id, f'G{groupe_id}')} - {nb_articles} article(s)")
+
+def format_commandes(user_id, commandes, produit_par_id):
+    """Retourne l'historique des commandes d'un utilisateur, découpé en messages.
+
+    `commandes` peut être un générateur : il est parcouru une seule fois.
+    """
+    user_cmd = (c for c in commandes if c.user_id == user_id)
+    premiere = next(user_cmd, None)
+    if premiere is None:
+        return ["Tu n'as aucune commande. 😢\nAchète vite des produits de la boutique !"]
+    
+    return rendre_commandes(chain((premiere,), user_cmd), produit_par_id)
+
+# Au-delà, une réponse découpée est paginée (un seul message et des boutons) plutôt qu'envoyée en followups
+NB_MESSAGES_MAX = 3
+
+async def envoyer_messages(interaction: discord.Interaction, messages, ephemeral=False):
+    """Envoie une réponse découpée : le premier message en réponse (sauf réponse différée), les suivants en followup.
+
+    Une réponse de plus de NB_MESSAGES_MAX messages est paginée : un gros
+    catalogue ne remplit pas le salon et ne consomme pas la limite de débit
+    du webhook.
+    """
+    premier, *suite = messages
+    options = {'ephemeral': ephemeral}
+    if len(suite) >= NB_MESSAGES_MAX:
+        options['view'] = PaginationMessages(interaction.user.id, messages)
+        suite = []
+    if interaction.response.is_done():
+        await interaction.followup.send(premier, **options)
+    else:
+        await interaction.response.send_message(premier, **options)
+    for msg in suite:
+        await interaction.followup.send(msg, ephemeral=ephemeral)
+
+PERIODES_RAPPORT = {
+    "jour": "Aujourd'hui",
+    "semaine": "7 derniers jours",
+    "mois": "Mois en cours",
+    "annee": "Année en cours",
+    "tout": "Depuis l'ouverture",
+}
+
+def bornes_periode(periode, aujourd_hui=None):
+    """Retourne les jours [debut, fin[ d'une période du rapport (None = non borné)"""
+    aujourd_hui = aujourd_hui or date.today()
+    demain = aujourd_hui + timedelta(days=1)
+    if periode == "jour":
+        return aujourd_hui, demain
+    if periode == "semaine":
+        return aujourd_hui - timedelta(days=6), demain
+    if periode == "mois":
+        return aujourd_hui.replace(day=1), demain
+    if periode == "annee":
+        return aujourd_hui.replace(month=1, day=1), demain
+    return None, None
+
+def format_rapport_ventes(lignes, titre, produit_par_id):
+    if not lignes:
+        return f"__**📈 Rapport des ventes — {titre} :**__\nAucune vente sur cette période."
+    
+    msg = f"__**📈 Rapport des ventes — {titre} :**__\n"
+    msg += (
+        f"🧾 Commandes : {sum(l.nb_commandes for l in lignes)}\n"
+        f"📦 Unités vendues : {sum(l.unites for l in lignes)}\n"
+        f"💰 Chiffre d'affaires : {sum(l.chiffre_affaires for l in lignes):.2f} €\n"
+        f"💶 Encaissé : {sum(l.montant_encaisse for l in lignes):.2f} €\n\n"
+    )
+    for l in lignes[:15]:
+        produit = produit_par_id(l.produit_id)
+        nom = produit.nom if produit else f"Produit #{l.produit_id}"
+        msg += f"🛍️ **{nom}** - {l.unites} unité(s), {l.nb_commandes} commande(s), {l.chiffre_affaires:.2f} €\n"
+    if len(lignes) > 15:
+        msg += f"… et {len(lignes) - 15} autre(s) produit(s)\n"
     return msg
 
-
-
-def obtenir_produits():
-    """Récupère tous les produits depuis la base de données"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT id, nom, description, prix, stock FROM produits ORDER BY id')
-    
-    produits = []
-    for row in cursor.fetchall():
-        produits.append({
-            'id': row[0],
-            'nom': row[1],
-            'description': row[2],
-            'prix': row[3],
-            'stock': row[4]
-        })
-    
-    conn.close()
-    return produits
-
-def ajouter_produit(nom, description, prix, stock):
-    """Ajoute un nouveau produit à la base de données"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO produits (nom, description, prix, stock)
-        VALUES (?, ?, ?, ?)
-    ''', (nom, description, prix, stock))
-    
-    produit_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return produit_id
-
-def supprimer_produit(produit_id):
-    """Supprime un produit de la base de données"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT nom FROM produits WHERE id = ?', (produit_id,))
-    produit = cursor.fetchone()
-    
-    if not produit:
-        conn.close()
-        return False
-    
-    cursor.execute('SELECT COUNT(*) FROM commandes WHERE produit_id = ?', (produit_id,))
-    nb_commandes = cursor.fetchone()[0]
-    
-    if nb_commandes > 0:
-        conn.close()
-        return False
-    
-    cursor.execute('DELETE FROM produits WHERE id = ?', (produit_id,))
-    conn.commit()
-    conn.close()
-    
-    return True
-
-def logement_choices():
-    """Retourne les choix de produits pour les commandes Discord"""
-    produits = obtenir_produits()
-    return [app_commands.Choice(name=p['nom'], value=p['id']) for p in produits]
-
 def statut_choices():
     """Retourne les choix de statut pour les commandes Discord"""
     return [
@@ -276,38 +194,260 @@ def statut_choices():
         app_commands.Choice(name="Annulée", value="annule"),
     ]
 
+LONGUEUR_CHOIX = 100  # caractères au plus dans le libellé d'un choix Discord
+
+@mesurer_commande
+async def autocompletion_produits(interaction: discord.Interaction, current: str):
+    """Suggestions de produits pendant la saisie, depuis l'index en mémoire (sans accès à la base)"""
+    stockage = await boutiques.pour(interaction.guild_id)
+    produits = stockage.rechercher_produits(interaction.guild_id, current)
+    if current.strip().isdigit():
+        # Un ID saisi directement passe en premier
+        produit = stockage.produit_en_cache(interaction.guild_id, int(current))
+        if produit:
+            produits = [produit] + [p for p in produits if p.id != produit.id]
+    return [
+        app_commands.Choice(
+            name=f"{p.nom} (#{p.id}, {p.prix} €, stock : {p.stock})"[:LONGUEUR_CHOIX],
+            value=p.id
+        )
+        for p in produits[:LIMITE_SUGGESTIONS]
+    ]
+
 def verifier_permissions_admin(interaction: discord.Interaction) -> bool:
     """Vérifie si l'utilisateur a les permissions d'administrateur"""
     if not interaction.user.guild_permissions.administrator:
         return False
     return True
 
+def format_page_commandes(commandes, page):
+    lignes = [f"__**📊 Toutes les commandes (page {page}) :**__\n"]
+    for c in commandes:
+        nom = c.nom_produit or f"Produit #{c.produit_id} (supprimé)"
+        lignes.append(f"🛍️ [ID:{c.id}] **{nom}** - {c.quantite}x ({c.total} €) - User: {c.user_id} - {c.statut}\n")
+    # Une page compte au plus TAILLE_PAGE_COMMANDES lignes : elle tient dans un message
+    return "".join(lignes)[:LIMITE_MESSAGE]
+
+class PaginationCommandes(discord.ui.View):
+    """Parcours de toutes les commandes, une page à la fois (Admin)"""
+
+    def __init__(self, auteur_id: int, stockage, guild_id: int):
+        super().__init__(timeout=300)
+        self.auteur_id = auteur_id
+        self.stockage = stockage
+        self.guild_id = guild_id
+        self.commandes = []
+        self.page = 1
+        self.a_precedent = False
+        self.a_suivant = False
+
+    async def charger(self, avant=None, apres=None):
+        """Charge la page qui suit `avant` ou qui précède `apres` (la première par défaut)"""
+        commandes, encore = await self.stockage.obtenir_page_commandes(self.guild_id, avant=avant, apres=apres)
+        if not commandes:
+            return False
+        self.commandes = commandes
+        if apres is not None:
+            self.a_precedent, self.a_suivant = encore, True
+        else:
+            self.a_precedent, self.a_suivant = avant is not None, encore
+        self.precedent.disabled = not self.a_precedent
+        self.suivant.disabled = not self.a_suivant
+        return True
+
+    def contenu(self):
+        return format_page_commandes(self.commandes, self.page)
+
+    @staticmethod
+    def cle(commande):
+        return (commande.date_commande, commande.id)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.auteur_id:
+            await interaction.response.send_message("❌ Cette pagination ne t'appartient pas.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="◀️ Précédent", style=discord.ButtonStyle.secondary)
+    async def precedent(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if await self.charger(apres=self.cle(self.commandes[0])):
+            self.page -= 1
+        await interaction.response.edit_message(content=self.contenu(), view=self)
+
+    @discord.ui.button(label="Suivant ▶️", style=discord.ButtonStyle.secondary)
+    async def suivant(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if await self.charger(avant=self.cle(self.commandes[-1])):
+            self.page += 1
+        await interaction.response.edit_message(content=self.contenu(), view=self)
+
+class PaginationMessages(discord.ui.View):
+    """Parcours d'une réponse découpée trop longue, un message à la fois"""
+
+    def __init__(self, auteur_id: int, messages):
+        super().__init__(timeout=300)
+        self.auteur_id = auteur_id
+        self.messages = messages
+        self.page = 0
+        self.afficher(0)
+
+    def afficher(self, page):
+        self.page = page
+        self.precedent.disabled = page == 0
+        self.suivant.disabled = page == len(self.messages) - 1
+        self.position.label = f"{page + 1}/{len(self.messages)}"
+        return self.messages[page]
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.auteur_id:
+            await interaction.response.send_message("❌ Cette pagination ne t'appartient pas.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="◀️ Précédent", style=discord.ButtonStyle.secondary)
+    async def precedent(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.edit_message(content=self.afficher(max(self.page - 1, 0)), view=self)
+
+    @discord.ui.button(label="1/1", style=discord.ButtonStyle.secondary, disabled=True)
+    async def position(self, interaction: discord.Interaction, button: discord.ui.Button):
+        pass
+
+    @discord.ui.button(label="Suivant ▶️", style=discord.ButtonStyle.secondary)
+    async def suivant(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.edit_message(content=self.afficher(min(self.page + 1, len(self.messages) - 1)), view=self)
+
+def empreinte_commandes(tree: app_commands.CommandTree, guild=None) -> str:
+    """Empreinte SHA-256 des définitions des commandes telles qu'envoyées à Discord"""
+    definitions = []
+    for commande in tree.get_commands(guild=guild):
+        try:
+            definitions.append(commande.to_dict(tree))
+        except TypeError:
+            # discord.py < 2.4 : to_dict() ne prend pas l'arbre en paramètre
+            definitions.append(commande.to_dict())
+    definitions.sort(key=lambda d: (d.get('type', 1), d['name']))
+    contenu = json.dumps(definitions, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenu.encode()).hexdigest()
+
+def lire_empreintes():
+    try:
+        with open(FICHIER_EMPREINTES_COMMANDES, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def ecrire_empreintes(empreintes):
+    with open(FICHIER_EMPREINTES_COMMANDES, 'w', encoding='utf-8') as f:
+        json.dump(empreintes, f, indent=2)
+
+async def synchroniser_commandes(client: discord.Client, guild=None) -> bool:
+    """Synchronise les commandes avec Discord seulement si leurs définitions ont changé.
+
+    La synchronisation globale est lente et limitée en débit : l'empreinte de
+    la dernière version envoyée est conservée localement, par application et
+    par serveur, et la synchronisation est sautée tant qu'elle est identique.
+    """
+    cle = f"{client.application_id}:{guild.id if guild else 'global'}"
+    empreinte = empreinte_commandes(client.tree, guild)
+    empreintes = lire_empreintes()
+    if not FORCER_SYNC and empreintes.get(cle) == empreinte:
+        return False
+    
+    await client.tree.sync(guild=guild)
+    empreintes[cle] = empreinte
+    ecrire_empreintes(empreintes)
+    return True
+
+class ArbreCommandes(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Chaque boutique appartient à un serveur : rien à servir en message privé
+        if interaction.guild_id is not None:
+            return True
+        if interaction.type is discord.InteractionType.application_command:
+            await interaction.response.send_message("❌ La boutique n'est disponible que sur un serveur.", ephemeral=True)
+        return False
+
 # Initialisation du bot
-class MonClient(discord.Client):
+class MonClient(discord.AutoShardedClient):
+    """Client réparti sur plusieurs shards, chacun recevant les événements d'une partie des serveurs"""
+
     def __init__(self):
         intents = discord.Intents.default()
-        super().__init__(intents=intents)
-        self.tree = app_commands.CommandTree(self)
+        super().__init__(intents=intents, shard_count=int(NB_SHARDS) if NB_SHARDS else None)
+        self.tree = ArbreCommandes(self)
+        # Mesures de démarrage (en secondes) et suivi des reconnexions
+        self.durees_demarrage = {}
+        self.deconnecte_depuis = None
+        # Tâche d'export périodique des métriques (METRIQUES_FICHIER) : gardée pour ne pas être ramassée
+        self.export_metriques = None
 
     async def setup_hook(self):
-        await self.tree.sync()
+        debut = time.perf_counter()
+        guild = None
+        if DEV_GUILD_ID:
+            guild = discord.Object(id=int(DEV_GUILD_ID))
+            self.tree.copy_global_to(guild=guild)
+        synchronise = await synchroniser_commandes(self, guild)
+        self.durees_demarrage['sync_commandes'] = time.perf_counter() - debut
+        cible = f"le serveur {DEV_GUILD_ID}" if guild else "Discord"
+        print(f"Commandes {'synchronisées avec' if synchronise else 'inchangées pour'} {cible}")
 
 bot = MonClient()
+boutiques = Boutiques(dossier=DOSSIER_BASES)
+cache_rendu = CacheRendu()
+travaux = FileTravaux()
+planificateur = PlanificateurExpiration(boutiques, DELAI_PAIEMENT)
+archivage = Archivage(boutiques, RETENTION_COMMANDES, INTERVALLE_ARCHIVAGE)
+pipeline_paiements = PipelinePaiements(boutiques, serveur_defaut=SERVEUR_HISTORIQUE)
+paniers = Paniers()
+limiteur = Limiteur(LIMITES_ECRITURE, globale=(2 * ECRITURES_PAR_SECONDE, ECRITURES_PAR_SECONDE))
+
+async def differer(interaction: discord.Interaction, priorite, travail):
+    """Accuse réception tout de suite, puis exécute `travail` dans la file des traitements lourds.
+
+    Discord exige une première réponse sous 3 secondes : le résultat est
+    envoyé ensuite en followup. Retourne le résultat de `travail()`, ou None
+    si la file est saturée ou si `travail()` échoue : l'utilisateur en est
+    averti, et la réponse différée ne reste jamais en attente.
+    """
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        return await travaux.executer(priorite, travail)
+    except FileSaturee:
+        await interaction.followup.send("⏳ Trop de traitements en cours, réessaie dans un instant.", ephemeral=True)
+    except Exception as e:
+        print(f"Traitement différé en échec : {e!r}")
+        await interaction.followup.send(f"❌ Erreur pendant le traitement : {str(e)}", ephemeral=True)
+    return None
 
 @bot.event
 async def on_ready():
-    print(f"Connecté en tant que {bot.user}")
-    # Initialisation de la base de données au démarrage
-    initialiser_base_donnees()
-    print("Base de données initialisée avec succès !")
+    if 'pret' not in bot.durees_demarrage:
+        bot.durees_demarrage['pret'] = time.perf_counter() - DEBUT_PROCESSUS
+        details = ", ".join(f"{etape} {duree:.2f} s" for etape, duree in bot.durees_demarrage.items())
+        print(f"Connecté en tant que {bot.user} sur {len(bot.guilds)} serveur(s), {bot.shard_count} shard(s) ({details})")
+    elif bot.deconnecte_depuis is not None:
+        print(f"Reconnecté en tant que {bot.user} en {time.perf_counter() - bot.deconnecte_depuis:.2f} s")
+    bot.deconnecte_depuis = None
+
+@bot.event
+async def on_disconnect():
+    if bot.deconnecte_depuis is None:
+        bot.deconnecte_depuis = time.perf_counter()
+
+@bot.event
+async def on_resumed():
+    if bot.deconnecte_depuis is not None:
+        print(f"Session reprise en {time.perf_counter() - bot.deconnecte_depuis:.2f} s")
+    bot.deconnecte_depuis = None
 
 @bot.tree.command(name="produits", description="Liste les produits disponibles")
+@mesurer_commande
 async def produits(interaction: discord.Interaction):
-    produits = obtenir_produits()
-    msg = "__**🛍️ Produits disponibles dans la boutique :**__\n"
-    for p in produits:
-        msg += f"🆔 **{p['id']}** - **{p['nom']}** ({p['prix']} €)\n   {p['description']}\n   📦 Stock : {p['stock']} unités\n\n"
-    await interaction.response.send_message(msg)
+    stockage = await boutiques.pour(interaction.guild_id)
+    version = stockage.version_catalogue(interaction.guild_id)
+    produits = await stockage.obtenir_produits(interaction.guild_id)
+    messages = cache_rendu.obtenir(f"catalogue:{interaction.guild_id}", version, lambda: rendre_catalogue(produits))
+    await envoyer_messages(interaction, messages)
 
 @bot.tree.command(name="ajouter_produit", description="Ajoute un nouveau produit (Admin)")
 @app_commands.describe(
@@ -316,6 +456,8 @@ async def produits(interaction: discord.Interaction):
     prix="Prix en euros",
     stock="Quantité en stock"
 )
+@limiter(limiteur, "ajouter_produit")
+@mesurer_commande
 async def ajouter_produit_cmd(interaction: discord.Interaction, nom: str, description: str, prix: float, stock: int):
     # Vérification des permissions admin
     if not verifier_permissions_admin(interaction):
@@ -323,24 +465,14 @@ async def ajouter_produit_cmd(interaction: discord.Interaction, nom: str, descri
         return
     
     # Validation des données
-    if prix <= 0:
-        await interaction.response.send_message("❌ Le prix doit être positif.", ephemeral=True)
-        return
-    
-    if stock < 0:
-        await interaction.response.send_message("❌ Le stock ne peut pas être négatif.", ephemeral=True)
-        return
-    
-    if len(nom) < 3:
-        await interaction.response.send_message("❌ Le nom du produit doit contenir au moins 3 caractères.", ephemeral=True)
-        return
-    
-    if len(description) < 10:
-        await interaction.response.send_message("❌ La description doit contenir au moins 10 caractères.", ephemeral=True)
+    erreur = valider_produit(nom, description, prix, stock)
+    if erreur:
+        await interaction.response.send_message(f"❌ {erreur}", ephemeral=True)
         return
     
     try:
-        produit_id = ajouter_produit(nom, description, prix, stock)
+        stockage = await boutiques.pour(interaction.guild_id)
+        produit_id = await stockage.ajouter_produit(interaction.guild_id, nom, description, prix, stock)
         await interaction.response.send_message(
             f"✅ Nouveau produit ajouté avec succès !\n"
             f"🛍️ **{nom}**\n"
@@ -356,80 +488,134 @@ async def ajouter_produit_cmd(interaction: discord.Interaction, nom: str, descri
             ephemeral=True
         )
 
-@bot.tree.command(name="supprimer_produit", description="Supprime un produit (Admin)")
+@bot.tree.command(name="importer_produits", description="Importe des produits depuis un fichier CSV ou JSONL (Admin)")
 @app_commands.describe(
-    produit_id="ID du produit à supprimer"
+    fichier="Fichier .csv (avec en-tête) ou .jsonl avec les champs nom, description, prix, stock"
 )
-async def supprimer_produit_cmd(interaction: discord.Interaction, produit_id: int):
+@limiter(limiteur, "importer_produits")
+@mesurer_commande
+async def importer_produits(interaction: discord.Interaction, fichier: discord.Attachment):
     # Vérification des permissions admin
     if not verifier_permissions_admin(interaction):
         await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
         return
     
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    # Vérification si le produit existe
-    cursor.execute('SELECT nom FROM produits WHERE id = ?', (produit_id,))
-    produit = cursor.fetchone()
-    
-    if not produit:
-        await interaction.response.send_message("❌ Produit introuvable.", ephemeral=True)
-        conn.close()
+    format = format_fichier(fichier.filename)
+    if format is None:
+        await interaction.response.send_message("❌ Format non reconnu : envoie un fichier .csv ou .jsonl.", ephemeral=True)
         return
     
-    # Vérification s'il y a des commandes pour ce produit
-    cursor.execute('SELECT COUNT(*) FROM commandes WHERE produit_id = ?', (produit_id,))
-    nb_commandes = cursor.fetchone()[0]
-    
-    if nb_commandes > 0:
-        await interaction.response.send_message(
-            f"❌ Impossible de supprimer ce produit car il a {nb_commandes} commande(s) active(s).",
-            ephemeral=True
-        )
-        conn.close()
+    async def importer():
+        stockage = await boutiques.pour(interaction.guild_id)
+        try:
+            nb_produits = await stockage.importer_produits(interaction.guild_id, await fichier.read(), format)
+        except (ErreurImport, UnicodeDecodeError) as e:
+            return f"❌ Import annulé, aucun produit ajouté ({str(e)})."
+        except sqlite3.Error as e:
+            print(f"Erreur de la base pendant l'import de {fichier.filename} : {e}")
+            return "❌ Import annulé, aucun produit ajouté (erreur de la base de données, réessaie plus tard)."
+        return f"✅ {nb_produits} produit(s) importé(s) depuis **{fichier.filename}**."
+
+    message = await differer(interaction, PRIORITE_FICHIER, importer)
+    if message:
+        await interaction.followup.send(message, ephemeral=True)
+
+@bot.tree.command(name="exporter_commandes", description="Exporte toutes les commandes dans un fichier compressé (Admin)")
+@app_commands.describe(
+    format="Format du fichier exporté"
+)
+@app_commands.choices(format=[app_commands.Choice(name=f.upper(), value=f) for f in FORMATS])
+@mesurer_commande
+async def exporter_commandes(interaction: discord.Interaction, format: app_commands.Choice[str]):
+    # Vérification des permissions admin
+    if not verifier_permissions_admin(interaction):
+        await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
         return
     
-    # Suppression du produit
-    cursor.execute('DELETE FROM produits WHERE id = ?', (produit_id,))
-    conn.commit()
-    conn.close()
+    async def exporter():
+        with tempfile.TemporaryDirectory(prefix="boutique-export-") as dossier:
+            nom_fichier = f"commandes_{datetime.now():%Y%m%d_%H%M}.{format.value}.gz"
+            chemin = os.path.join(dossier, nom_fichier)
+            stockage = await boutiques.pour(interaction.guild_id)
+            nb_commandes = await stockage.exporter_commandes(interaction.guild_id, chemin, format.value)
+            await interaction.followup.send(
+                f"✅ {nb_commandes} commande(s) exportée(s).",
+                file=discord.File(chemin, filename=nom_fichier),
+                ephemeral=True
+            )
+        return nb_commandes
+
+    await differer(interaction, PRIORITE_FICHIER, exporter)
+
+@bot.tree.command(name="supprimer_produit", description="Supprime un produit (Admin)")
+@app_commands.describe(
+    produit_id="ID du produit à supprimer"
+)
+@app_commands.autocomplete(produit_id=autocompletion_produits)
+@limiter(limiteur, "supprimer_produit")
+@mesurer_commande
+async def supprimer_produit_cmd(interaction: discord.Interaction, produit_id: int):
+    # Vérification des permissions admin
+    if not verifier_permissions_admin(interaction):
+        await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
+        return
     
-    await interaction.response.send_message(
-        f"✅ Produit **{produit[0]}** supprimé avec succès !",
-        ephemeral=True
-    )
+    async def supprimer():
+        # Vérification si le produit existe
+        stockage = await boutiques.pour(interaction.guild_id)
+        produit = await stockage.obtenir_produit(interaction.guild_id, produit_id)
+        if not produit:
+            return "❌ Produit introuvable."
+        
+        # Vérification s'il y a des commandes pour ce produit
+        nb_commandes = await stockage.compter_commandes_produit(produit_id)
+        if nb_commandes > 0:
+            return f"❌ Impossible de supprimer ce produit car il a {nb_commandes} commande(s) non annulée(s)."
+        
+        # Suppression du produit
+        if not await stockage.supprimer_produit(interaction.guild_id, produit_id):
+            return "❌ Le produit n'a pas pu être supprimé."
+        return f"✅ Produit **{produit.nom}** supprimé avec succès !"
+
+    message = await differer(interaction, PRIORITE_INTERACTIVE, supprimer)
+    if message:
+        await interaction.followup.send(message, ephemeral=True)
 
 @bot.tree.command(name="liste_produits_admin", description="Liste tous les produits avec leurs IDs (Admin)")
+@mesurer_commande
 async def liste_produits_admin(interaction: discord.Interaction):
     # Vérification des permissions admin
     if not verifier_permissions_admin(interaction):
         await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
         return
     
-    produits = obtenir_produits()
-    
-    if not produits:
-        msg = "Aucun produit enregistré."
-    else:
-        msg = "__**🛍️ Liste des produits (Admin) :**__\n"
-        for p in produits:
-            msg += f"🆔 **{p['id']}** - **{p['nom']}** ({p['prix']} €)\n   {p['description']}\n   📦 Stock : {p['stock']}\n\n"
-    
-    await interaction.response.send_message(msg, ephemeral=True)
+    async def lister():
+        stockage = await boutiques.pour(interaction.guild_id)
+        version = stockage.version_catalogue(interaction.guild_id)
+        produits = await stockage.obtenir_produits(interaction.guild_id)
+        return cache_rendu.obtenir(
+            f"catalogue_admin:{interaction.guild_id}", version, lambda: rendre_catalogue_admin(produits)
+        )
+
+    messages = await differer(interaction, PRIORITE_INTERACTIVE, lister)
+    if messages:
+        await envoyer_messages(interaction, messages, ephemeral=True)
 
 @bot.tree.command(name="acheter", description="Achète un produit")
 @app_commands.describe(
     produit_id="Choisis un produit",
     quantite="Quantité à acheter"
 )
+@app_commands.autocomplete(produit_id=autocompletion_produits)
+@limiter(limiteur, "acheter")
+@mesurer_commande
 async def acheter(
     interaction: discord.Interaction,
     produit_id: int,
     quantite: int
 ):
-    produits = obtenir_produits()
-    produit = next((p for p in produits if p['id'] == produit_id), None)
+    stockage = await boutiques.pour(interaction.guild_id)
+    produit = await stockage.obtenir_produit(interaction.guild_id, produit_id)
     if not produit:
         await interaction.response.send_message("Produit introuvable.", ephemeral=True)
         return
@@ -438,53 +624,175 @@ async def acheter(
         await interaction.response.send_message("❌ La quantité doit être positive.", ephemeral=True)
         return
     
-    if not verifier_stock(produit_id, quantite):
+    # Réservation du stock et ajout de la commande en une seule transaction
+    try:
+        commande_id = await stockage.ajouter_commande(
+            interaction.guild_id, interaction.user.id, produit.id, quantite, produit.prix
+        )
+    except Exception as e:
         await interaction.response.send_message(
-            f"❌ Stock insuffisant. Il ne reste que {produit['stock']} unité(s) en stock.",
+            f"❌ Erreur lors de l'enregistrement de la commande : {str(e)}",
             ephemeral=True
         )
         return
     
+    if commande_id is None:
+        produit = await stockage.obtenir_produit(interaction.guild_id, produit_id) or produit
+        await interaction.response.send_message(
+            f"❌ Stock insuffisant. Il ne reste que {produit.stock} unité(s) en stock.",
+            ephemeral=True
+        )
+        return
+    
+    planificateur.ajouter(interaction.guild_id, commande_id)
     montant = calculer_montant(produit, quantite)
-    paypal_url = generer_lien_paypal(produit, quantite, montant)
+    paypal_url = generer_lien_paypal(produit, quantite, montant, commande_id, interaction.guild_id)
     view = discord.ui.View()
     view.add_item(discord.ui.Button(label="Payer avec PayPal", url=paypal_url, style=discord.ButtonStyle.link))
     
-    # Ajout de la commande en base de données
-    ajouter_commande(interaction.user.id, produit['id'], quantite, produit['prix'])
-    
     await interaction.response.send_message(
-        f"Commande confirmée pour {produit['nom']} x{quantite} (\u20ac{montant}).\nMerci de procéder au paiement :",
+        f"Commande n°{commande_id} confirmée pour {produit.nom} x{quantite} (\u20ac{montant}).\n"
+        f"Merci de procéder au paiement sous {DELAI_PAIEMENT.total_seconds() / 3600:g} h, sans quoi elle sera annulée :",
         view=view
     )
 
-@bot.tree.command(name="mes_commandes", description="Affiche tes commandes")
-async def mes_commandes(interaction: discord.Interaction):
-    commandes = obtenir_commandes_utilisateur(interaction.user.id)
-    msg = format_commandes(interaction.user.id, commandes)
+@bot.tree.command(name="panier_ajouter", description="Ajoute un produit à ton panier (ou change sa quantité)")
+@app_commands.describe(
+    produit_id="Choisis un produit",
+    quantite="Quantité voulue (0 pour retirer le produit du panier)"
+)
+@app_commands.autocomplete(produit_id=autocompletion_produits)
+@mesurer_commande
+async def panier_ajouter(interaction: discord.Interaction, produit_id: int, quantite: int = 1):
+    stockage = await boutiques.pour(interaction.guild_id)
+    produit = await stockage.obtenir_produit(interaction.guild_id, produit_id)
+    if not produit:
+        await interaction.response.send_message("Produit introuvable.", ephemeral=True)
+        return
+
+    try:
+        lignes = paniers.definir((interaction.guild_id, interaction.user.id), produit_id, quantite)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Impossible de modifier le panier : {str(e)}.", ephemeral=True)
+        return
+
+    if quantite == 0:
+        msg = f"🗑️ **{produit.nom}** retiré de ton panier."
+    else:
+        msg = f"🛒 **{produit.nom}** x{quantite} dans ton panier ({len(lignes)} produit(s))."
+        if produit.stock < quantite:
+            msg += f"\n⚠️ Il ne reste que {produit.stock} unité(s) en stock."
     await interaction.response.send_message(msg, ephemeral=True)
 
+@bot.tree.command(name="panier", description="Affiche ton panier")
+@mesurer_commande
+async def panier(interaction: discord.Interaction):
+    lignes = paniers.lignes((interaction.guild_id, interaction.user.id))
+    if not lignes:
+        await interaction.response.send_message(
+            "Ton panier est vide. Ajoute des produits avec /panier_ajouter !", ephemeral=True
+        )
+        return
+    stockage = await boutiques.pour(interaction.guild_id)
+    produit_par_id = partial(stockage.produit_en_cache, interaction.guild_id)
+    await envoyer_messages(interaction, rendre_panier(lignes, produit_par_id), ephemeral=True)
+
+@bot.tree.command(name="panier_valider", description="Commande tout ton panier, avec un seul lien de paiement")
+@limiter(limiteur, "panier_valider")
+@mesurer_commande
+async def panier_valider(interaction: discord.Interaction):
+    cle_panier = (interaction.guild_id, interaction.user.id)
+    lignes = paniers.lignes(cle_panier)
+    if not lignes:
+        await interaction.response.send_message("Ton panier est vide.", ephemeral=True)
+        return
+
+    stockage = await boutiques.pour(interaction.guild_id)
+    a_commander = []
+    for produit_id, quantite in lignes.items():
+        produit = await stockage.obtenir_produit(interaction.guild_id, produit_id)
+        if not produit:
+            paniers.definir(cle_panier, produit_id, 0)
+            await interaction.response.send_message(
+                f"❌ Le produit #{produit_id} n'est plus en vente, il a été retiré de ton panier.", ephemeral=True
+            )
+            return
+        a_commander.append((produit, quantite))
+
+    # Toutes les lignes sont réservées dans une seule transaction, ou aucune
+    try:
+        groupe_id, commande_ids = await stockage.valider_panier(
+            interaction.guild_id, interaction.user.id, [(p.id, quantite, p.prix) for p, quantite in a_commander]
+        )
+    except StockInsuffisant as e:
+        produit = stockage.produit_en_cache(interaction.guild_id, e.produit_id)
+        await interaction.response.send_message(
+            f"❌ Stock insuffisant pour **{produit.nom if produit else e.produit_id}** : "
+            f"il ne reste que {produit.stock if produit else 0} unité(s). Ton panier n'a pas été validé.",
+            ephemeral=True
+        )
+        return
+    except Exception as e:
+        await interaction.response.send_message(
+            f"❌ Erreur lors de l'enregistrement de la commande : {str(e)}",
+            ephemeral=True
+        )
+        return
+
+    paniers.vider(cle_panier)
+    for commande_id in commande_ids:
+        planificateur.ajouter(interaction.guild_id, commande_id)
+    montant = round(sum(calculer_montant(p, quantite) for p, quantite in a_commander), 2)
+    nb_articles = sum(quantite for _, quantite in a_commander)
+    view = discord.ui.View()
+    view.add_item(discord.ui.Button(
+        label="Payer avec PayPal",
+        url=generer_lien_paypal_groupe(interaction.guild_id, groupe_id, nb_articles, montant),
+        style=discord.ButtonStyle.link
+    ))
+
+    await interaction.response.send_message(
+        f"Commande groupée n°G{groupe_id} confirmée : {len(a_commander)} produit(s), {nb_articles} article(s) (\u20ac{montant}).\n"
+        f"Merci de procéder au paiement sous {DELAI_PAIEMENT.total_seconds() / 3600:g} h, sans quoi elle sera annulée :",
+        view=view
+    )
+
+@bot.tree.command(name="mes_commandes", description="Affiche tes commandes")
+@app_commands.describe(archives="Inclure les commandes anciennes, expédiées ou annulées")
+@mesurer_commande
+async def mes_commandes(interaction: discord.Interaction, archives: bool = False):
+    stockage = await boutiques.pour(interaction.guild_id)
+    # Rendu sur le thread de lecture, au fil des lots lus : l'historique n'est jamais chargé en entier
+    messages = await stockage.parcourir_commandes_utilisateur(
+        interaction.guild_id, interaction.user.id,
+        partial(format_commandes, interaction.user.id, produit_par_id=partial(stockage.produit_en_cache, interaction.guild_id)),
+        archives
+    )
+    await envoyer_messages(interaction, messages, ephemeral=True)
+
 
 
 @bot.tree.command(name="stock", description="Affiche le stock d'un produit")
 @app_commands.describe(
     produit_id="Choisis un produit pour voir son stock"
 )
+@app_commands.autocomplete(produit_id=autocompletion_produits)
+@mesurer_commande
 async def stock(interaction: discord.Interaction, produit_id: int):
-    produits = obtenir_produits()
-    produit = next((p for p in produits if p['id'] == produit_id), None)
+    stockage = await boutiques.pour(interaction.guild_id)
+    produit = await stockage.obtenir_produit(interaction.guild_id, produit_id)
     if not produit:
         await interaction.response.send_message("Produit introuvable.", ephemeral=True)
         return
     
-    msg = f"📦 **{produit['nom']}**\n"
-    msg += f"🆔 ID: {produit['id']}\n"
-    msg += f"💰 Prix: {produit['prix']} €\n"
-    msg += f"📊 Stock disponible: {produit['stock']} unité(s)\n"
+    msg = f"📦 **{produit.nom}**\n"
+    msg += f"🆔 ID: {produit.id}\n"
+    msg += f"💰 Prix: {produit.prix} €\n"
+    msg += f"📊 Stock disponible: {produit.stock} unité(s)\n"
     
-    if produit['stock'] == 0:
+    if produit.stock == 0:
         msg += "❌ **Rupture de stock !**"
-    elif produit['stock'] <= 5:
+    elif produit.stock <= 5:
         msg += "⚠️ **Stock faible !**"
     else:
         msg += "✅ **En stock**"
@@ -496,6 +804,8 @@ async def stock(interaction: discord.Interaction, produit_id: int):
     produit_id="Choisis le produit de la commande à annuler",
     date_commande="Date de la commande à annuler (JJ/MM/AAAA)"
 )
+@limiter(limiteur, "annuler_commande")
+@mesurer_commande
 async def annuler_commande(interaction: discord.Interaction, produit_id: int, date_commande: str):
     # Vérification des permissions admin
     if not verifier_permissions_admin(interaction):
@@ -504,7 +814,7 @@ async def annuler_commande(interaction: discord.Interaction, produit_id: int, da
     
     # Vérification du format de date
     try:
-        datetime.strptime(date_commande, DATE_FORMAT)
+        jour = datetime.strptime(date_commande, DATE_FORMAT).date()
     except ValueError:
         await interaction.response.send_message(
             "❌ Format de date invalide. Utilise JJ/MM/AAAA.\n"
@@ -513,21 +823,15 @@ async def annuler_commande(interaction: discord.Interaction, produit_id: int, da
         )
         return
     
-    # Suppression de la commande
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    # Annulation des commandes du jour et remise en stock
+    stockage = await boutiques.pour(interaction.guild_id)
+    nb_annulees = await stockage.annuler_commandes_du_jour(interaction.guild_id, interaction.user.id, produit_id, jour)
     
-    cursor.execute('''
-        DELETE FROM commandes
-        WHERE user_id = ? AND produit_id = ? AND date_commande LIKE ?
-    ''', (interaction.user.id, produit_id, f"{date_commande}%"))
-    
-    if cursor.rowcount > 0:
-        conn.commit()
-        produits = obtenir_produits()
-        produit = next((p for p in produits if p['id'] == produit_id), None)
+    if nb_annulees > 0:
+        produit = await stockage.obtenir_produit(interaction.guild_id, produit_id)
+        nom = produit.nom if produit else f"produit #{produit_id}"
         await interaction.response.send_message(
-            f"✅ Commande annulée avec succès pour {produit['nom']} du {date_commande}.",
+            f"✅ {nb_annulees} commande(s) annulée(s) pour {nom} du {date_commande}, stock restauré.",
             ephemeral=True
         )
     else:
@@ -535,30 +839,80 @@ async def annuler_commande(interaction: discord.Interaction, produit_id: int, da
             "❌ Aucune commande trouvée avec ces critères.",
             ephemeral=True
         )
-    
-    conn.close()
 
 @bot.tree.command(name="toutes_commandes", description="Affiche toutes les commandes (Admin)")
+@mesurer_commande
 async def toutes_commandes(interaction: discord.Interaction):
     # Vérification des permissions admin
     if not verifier_permissions_admin(interaction):
         await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
         return
     
-    commandes = obtenir_toutes_commandes()
+    async def charger():
+        vue = PaginationCommandes(interaction.user.id, await boutiques.pour(interaction.guild_id), interaction.guild_id)
+        await vue.charger()
+        return vue
+
+    vue = await differer(interaction, PRIORITE_INTERACTIVE, charger)
+    if vue is None:
+        return
     
-    if not commandes:
-        msg = "Aucune commande enregistrée."
-    else:
-        msg = "__**📊 Toutes les commandes :**__\n"
-        for c in commandes:
-            produits = obtenir_produits()
-            produit = next((p for p in produits if p['id'] == c['produit_id']), None)
-            if produit:
-                print(c)
-                msg += f"🛍️ [ID:{c['id']}] **{produit['nom']}** - {c['quantite']}x ({c['total']} €) - User: {c['user_id']} - {c['statut']}\n"
+    if not vue.commandes:
+        await interaction.followup.send("Aucune commande enregistrée.", ephemeral=True)
+        return
     
-    await interaction.response.send_message(msg, ephemeral=True)
+    await interaction.followup.send(vue.contenu(), view=vue, ephemeral=True)
+
+
+@bot.tree.command(name="rapport_ventes", description="Chiffre d'affaires, unités et commandes par période (Admin)")
+@app_commands.describe(
+    periode="Période du rapport"
+)
+@app_commands.choices(periode=[app_commands.Choice(name=label, value=cle) for cle, label in PERIODES_RAPPORT.items()])
+@mesurer_commande
+async def rapport_ventes(interaction: discord.Interaction, periode: app_commands.Choice[str]):
+    # Vérification des permissions admin
+    if not verifier_permissions_admin(interaction):
+        await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
+        return
+    
+    async def calculer():
+        debut, fin = bornes_periode(periode.value)
+        stockage = await boutiques.pour(interaction.guild_id)
+        lignes = await stockage.rapport_ventes(interaction.guild_id, debut, fin)
+        return format_rapport_ventes(lignes, periode.name, partial(stockage.produit_en_cache, interaction.guild_id))
+
+    message = await differer(interaction, PRIORITE_RAPPORT, calculer)
+    if message:
+        await interaction.followup.send(message, ephemeral=True)
+
+
+@bot.tree.command(name="metrics", description="Latences, appels et erreurs des commandes et requêtes (Admin)")
+@app_commands.describe(
+    type="Limiter aux commandes ou aux requêtes SQL"
+)
+@app_commands.choices(type=[
+    app_commands.Choice(name="Commandes", value="commande"),
+    app_commands.Choice(name="Requêtes SQL", value="requete"),
+])
+@mesurer_commande
+async def metrics(interaction: discord.Interaction, type: app_commands.Choice[str] = None):
+    # Vérification des permissions admin
+    if not verifier_permissions_admin(interaction):
+        await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
+        return
+    
+    blocs = rendre_metriques(type.value if type else None)
+    if not blocs:
+        await interaction.response.send_message("Aucune mesure enregistrée pour l'instant.", ephemeral=True)
+        return
+    
+    entete = (
+        "__**⏱️ Métriques (depuis le démarrage) :**__\n"
+        f"Rendu du catalogue : {cache_rendu.succes} en cache, {cache_rendu.echecs} reconstruit(s)\n"
+        f"Traitements lourds : {travaux.executes} exécuté(s), {len(travaux)} en attente, {travaux.refuses} refusé(s)\n"
+    )
+    await envoyer_messages(interaction, decouper_messages(entete, blocs), ephemeral=True)
 
 
 @bot.tree.command(name="modifier_statut", description="Modifie le statut d'une commande (Admin)")
@@ -567,20 +921,25 @@ async def toutes_commandes(interaction: discord.Interaction):
     statut="Nouveau statut de la commande"
 )
 @app_commands.choices(statut=statut_choices())
+@limiter(limiteur, "modifier_statut")
+@mesurer_commande
 async def modifier_statut(interaction: discord.Interaction, commande_id: int, statut: app_commands.Choice[str]):
     # Vérification des permissions admin
     if not verifier_permissions_admin(interaction):
         await interaction.response.send_message("❌ Cette commande est réservée aux administrateurs.", ephemeral=True)
         return
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE commandes SET statut = ? WHERE id = ?",
-        (statut.value, commande_id)
-    )
-    if cursor.rowcount > 0:
-        conn.commit()
+    try:
+        stockage = await boutiques.pour(interaction.guild_id)
+        modifiee = await stockage.modifier_statut_commande(interaction.guild_id, commande_id, statut.value)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Impossible de modifier le statut : {str(e)}.", ephemeral=True)
+        return
+    
+    if modifiee:
+        if statut.value == Statut.EN_ATTENTE.value:
+            # Remise en attente : un nouveau délai de paiement commence
+            planificateur.ajouter(interaction.guild_id, commande_id)
         await interaction.response.send_message(
             f"✅ Statut de la commande {commande_id} mis à jour en **{statut.value}**.",
             ephemeral=True
@@ -590,7 +949,35 @@ async def modifier_statut(interaction: discord.Interaction, commande_id: int, st
             "❌ Aucune commande trouvée avec cet ID.",
             ephemeral=True
         )
-    conn.close()
+
+async def main():
+    # Le schéma est préparé une seule fois, avant la connexion à Discord ;
+    # les boutiques des nouveaux serveurs le sont à leur première commande
+    debut = time.perf_counter()
+    await boutiques.preparer(SERVEUR_HISTORIQUE)
+    nb_en_attente = await planificateur.demarrer()
+    archivage.demarrer()
+    bot.durees_demarrage['base_donnees'] = time.perf_counter() - debut
+    print(f"Base de données initialisée avec succès ! ({len(boutiques)} boutique(s))")
+    print(f"{nb_en_attente} commande(s) en attente de paiement suivie(s)")
+    
+    if METRIQUES_PORT:
+        await demarrer_serveur(int(METRIQUES_PORT))
+        print(f"Métriques exposées sur http://127.0.0.1:{METRIQUES_PORT}/metrics")
+    if METRIQUES_FICHIER:
+        bot.export_metriques = asyncio.create_task(exporter_fichier(METRIQUES_FICHIER))
+    if PAIEMENTS_PORT:
+        await demarrer_serveur_paiements(pipeline_paiements, int(PAIEMENTS_PORT), secret=PAIEMENTS_SECRET)
+        print(f"Notifications de paiement reçues sur http://127.0.0.1:{PAIEMENTS_PORT}/paiements/webhook")
+    
+    async with bot:
+        await bot.start(TOKEN)
 
 if __name__ == "__main__":
-    bot.run(TOKEN) 
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        boutiques.fermer()
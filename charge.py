@@ -0,0 +1,176 @@
+"""Tests de charge hors ligne : appelle directement les commandes slash avec de fausses interactions.
+
+Utilisé par `python benchmark.py charge` ; aucun accès réseau n'est nécessaire.
+"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from discord import app_commands
+
+import base_donnees as bd
+import bot_boutique as bb
+
+
+class FausseReponse:
+    """Imite `discord.InteractionResponse` : une seule réponse par interaction"""
+
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._faite = False
+        self.instant = None  # perf_counter() de la première réponse (accusé de réception)
+
+    def is_done(self):
+        return self._faite
+
+    def _repondre(self, contenu):
+        if self._faite:
+            raise RuntimeError("Cette interaction a déjà reçu une réponse")
+        self._faite = True
+        self.instant = time.perf_counter()
+        if contenu is not None:
+            self._interaction.messages.append(contenu)
+
+    async def send_message(self, content=None, **kwargs):
+        self._repondre(content)
+
+    async def defer(self, **kwargs):
+        self._repondre(None)
+
+    async def edit_message(self, content=None, **kwargs):
+        self._repondre(content)
+
+class FauxSuivi:
+    """Imite `interaction.followup` (webhook des messages suivants)"""
+
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        if not self._interaction.response.is_done():
+            raise RuntimeError("Followup envoyé avant la réponse initiale")
+        if content is not None:
+            self._interaction.messages.append(content)
+
+class FausseInteraction:
+    """Le strict nécessaire d'une `discord.Interaction` pour les gestionnaires du bot"""
+
+    def __init__(self, user_id, admin=False, guild_id=None):
+        self.user = SimpleNamespace(
+            id=user_id,
+            mention=f"<@{user_id}>",
+            guild_permissions=SimpleNamespace(administrator=admin),
+        )
+        self.guild_id = guild_id
+        self.messages = []
+        self.response = FausseReponse(self)
+        self.followup = FauxSuivi(self)
+
+
+def _produit_au_hasard(produit_ids):
+    return random.choice(produit_ids) if produit_ids else 1
+
+def _periode_au_hasard():
+    cle = random.choice(list(bb.PERIODES_RAPPORT))
+    return app_commands.Choice(name=bb.PERIODES_RAPPORT[cle], value=cle)
+
+# Nom -> (commande slash, administrateur ?, générateur d'arguments à partir des produits du serveur)
+SCENARIOS = {
+    'produits': (bb.produits, False, lambda ids: {}),
+    'stock': (bb.stock, False, lambda ids: {'produit_id': _produit_au_hasard(ids)}),
+    'acheter': (bb.acheter, False, lambda ids: {'produit_id': _produit_au_hasard(ids), 'quantite': 1}),
+    'mes_commandes': (bb.mes_commandes, False, lambda ids: {}),
+    'liste_produits_admin': (bb.liste_produits_admin, True, lambda ids: {}),
+    'toutes_commandes': (bb.toutes_commandes, True, lambda ids: {}),
+    'rapport_ventes': (bb.rapport_ventes, True, lambda ids: {'periode': _periode_au_hasard()}),
+}
+
+MELANGE_DEFAUT = {'produits': 5, 'stock': 3, 'acheter': 3, 'mes_commandes': 3, 'toutes_commandes': 1, 'rapport_ventes': 1}
+
+def lire_melange(texte):
+    """Analyse un mélange de la forme 'acheter=3,produits=5'"""
+    melange = {}
+    for element in texte.split(','):
+        nom, _, poids = element.partition('=')
+        nom = nom.strip()
+        if nom not in SCENARIOS:
+            raise ValueError(f"commande inconnue : {nom} (disponibles : {', '.join(SCENARIOS)})")
+        melange[nom] = float(poids or 1)
+    return melange
+
+
+def peupler(guild_id, nb_produits, nb_commandes, nb_utilisateurs):
+    """Remplit la boutique d'un serveur (base courante) avec des produits et des commandes factices.
+
+    Retourne les IDs des produits du serveur.
+    """
+    bd.initialiser_base_donnees(guild_id)
+    bd.inserer_produits(guild_id, (
+        (f"Produit {i}", f"Description du produit numéro {i}", round(random.uniform(2, 80), 2), 10_000_000)
+        for i in range(nb_produits)
+    ))
+    ids = [p.id for p in bd.lire_produits(guild_id)]
+    conn = bd.connexion()
+    with bd.transaction(conn, immediate=True):
+        conn.executemany(
+            '''
+            INSERT INTO commandes (guild_id, user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', ?))
+            ''',
+            (
+                (guild_id, random.randrange(nb_utilisateurs), random.choice(ids), 1, 10.0, 10.0,
+                 random.choice(('en_attente', 'paye', 'envoye', 'annule')), f"-{random.randrange(365 * 24 * 60)} minutes")
+                for _ in range(nb_commandes)
+            )
+        )
+    return ids
+
+
+async def executer_charge(melange, debit, duree, nb_utilisateurs, produits_par_serveur, concurrence_max=500):
+    """Rejoue le mélange de commandes au débit visé (appels/s) pendant `duree` secondes.
+
+    Les arrivées suivent un processus de Poisson (boucle ouverte) : une
+    commande lente ne ralentit pas l'envoi des suivantes. Chaque appel vient
+    d'un serveur tiré au hasard parmi `produits_par_serveur` ({guild_id: IDs
+    des produits}). Retourne, par commande, la liste des latences (s) et le
+    nombre d'erreurs, ainsi que les délais (s) avant la première réponse,
+    que Discord exige sous 3 secondes.
+    """
+    noms = list(melange)
+    serveurs = list(produits_par_serveur)
+    poids = [melange[n] for n in noms]
+    resultats = {nom: {'latences': [], 'accuses': [], 'erreurs': 0} for nom in noms}
+    limite = asyncio.Semaphore(concurrence_max)
+    taches = set()
+
+    async def appel(nom):
+        commande, admin, arguments = SCENARIOS[nom]
+        guild_id = random.choice(serveurs)
+        interaction = FausseInteraction(random.randrange(nb_utilisateurs), admin=admin, guild_id=guild_id)
+        async with limite:
+            debut = time.perf_counter()
+            try:
+                await commande.callback(interaction, **arguments(produits_par_serveur[guild_id]))
+                if not interaction.response.is_done():
+                    raise RuntimeError("aucune réponse envoyée")
+            except Exception:
+                resultats[nom]['erreurs'] += 1
+            resultats[nom]['latences'].append(time.perf_counter() - debut)
+            if interaction.response.instant is not None:
+                resultats[nom]['accuses'].append(interaction.response.instant - debut)
+
+    fin = time.perf_counter() + duree
+    prochain = time.perf_counter()
+    while prochain < fin:
+        nom = random.choices(noms, poids)[0]
+        tache = asyncio.create_task(appel(nom))
+        taches.add(tache)
+        tache.add_done_callback(taches.discard)
+        prochain += random.expovariate(debit)
+        attente = prochain - time.perf_counter()
+        if attente > 0:
+            await asyncio.sleep(attente)
+
+    await asyncio.gather(*taches)
+    return resultats
@@ -0,0 +1,95 @@
+import csv
+import gzip
+import io
+import json
+
+import base_donnees as bd
+
+FORMATS = ('csv', 'jsonl')
+CHAMPS_PRODUIT = ('nom', 'description', 'prix', 'stock')
+CHAMPS_COMMANDE = ('id', 'user_id', 'produit_id', 'quantite', 'prix_unitaire', 'total', 'statut', 'date_commande')
+
+
+class ErreurImport(ValueError):
+    """Ligne invalide dans un fichier importé : tout l'import est annulé"""
+
+    def __init__(self, numero_ligne, message):
+        super().__init__(f"ligne {numero_ligne} : {message}")
+        self.numero_ligne = numero_ligne
+
+
+def format_fichier(nom_fichier):
+    """Déduit le format (csv ou jsonl) de l'extension d'un fichier, None si inconnu"""
+    nom = nom_fichier.lower()
+    if nom.endswith('.csv'):
+        return 'csv'
+    if nom.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+def lire_lignes(flux_binaire, format):
+    """Lit un fichier CSV (avec en-tête) ou JSONL ligne par ligne, en (numéro, dict)"""
+    texte = io.TextIOWrapper(flux_binaire, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        # Ligne 1 : en-tête
+        for numero, ligne in enumerate(csv.DictReader(texte), start=2):
+            yield numero, ligne
+    else:
+        for numero, ligne in enumerate(texte, start=1):
+            if not ligne.strip():
+                continue
+            try:
+                yield numero, json.loads(ligne)
+            except json.JSONDecodeError:
+                raise ErreurImport(numero, "JSON invalide")
+
+def _entier(valeur):
+    """Comme int(), mais refuse un nombre non entier (2.9 en JSON) au lieu de le tronquer"""
+    if isinstance(valeur, float) and not valeur.is_integer():
+        raise ValueError(valeur)
+    return int(valeur)
+
+def produits_valides(lignes):
+    """Convertit et valide chaque ligne avec les règles de /ajouter_produit"""
+    for numero, ligne in lignes:
+        try:
+            nom = str(ligne['nom']).strip()
+            description = str(ligne['description']).strip()
+            prix = float(ligne['prix'])
+            stock = _entier(ligne['stock'])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ErreurImport(numero, f"champs attendus : {', '.join(CHAMPS_PRODUIT)}")
+
+        erreur = bd.valider_produit(nom, description, prix, stock)
+        if erreur:
+            raise ErreurImport(numero, erreur)
+        yield nom, description, prix, stock
+
+def importer_produits(guild_id, flux_binaire, format):
+    """Importe un fichier de produits dans une seule transaction, retourne le nombre de produits ajoutés.
+
+    Les lignes sont validées au fil de l'eau et passées directement à
+    `executemany` : le fichier n'est jamais chargé entièrement en mémoire.
+    """
+    return bd.inserer_produits(guild_id, produits_valides(lire_lignes(flux_binaire, format)))
+
+def exporter_commandes(guild_id, chemin, format):
+    """Écrit les commandes d'un serveur, archives comprises, dans un fichier compressé (gzip).
+
+    Retourne le nombre de lignes écrites. Les commandes sont lues par lots depuis un curseur et écrites aussitôt :
+    la mémoire utilisée ne dépend pas du nombre de commandes.
+    """
+    nb_lignes = 0
+    with gzip.open(chemin, 'wt', compresslevel=6, encoding='utf-8', newline='') as fichier:
+        if format == 'csv':
+            writer = csv.writer(fichier)
+            writer.writerow(CHAMPS_COMMANDE)
+            for row in bd.iterer_commandes(guild_id, archives=True):
+                writer.writerow(row)
+                nb_lignes += 1
+        else:
+            for row in bd.iterer_commandes(guild_id, archives=True):
+                fichier.write(json.dumps(dict(zip(CHAMPS_COMMANDE, row)), ensure_ascii=False))
+                fichier.write('\n')
+                nb_lignes += 1
+    return nb_lignes
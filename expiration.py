@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+from datetime import datetime, timezone
+
+from base_donnees import FORMAT_HORODATAGE, TAILLE_LOT_EXPIRATION
+
+DELAI_REESSAI_EXPIRATION = 30  # secondes avant de réessayer après une erreur
+
+
+def _horodatage(texte):
+    return datetime.strptime(texte, FORMAT_HORODATAGE).replace(tzinfo=timezone.utc)
+
+
+class PlanificateurExpiration:
+    """Annule les commandes restées `en_attente` au-delà du délai de paiement.
+
+    Les échéances sont gardées dans un tas (la plus proche en tête) : la tâche
+    dort jusqu'à la prochaine échéance au lieu de parcourir régulièrement la
+    table. Au démarrage, le tas est reconstruit à partir des commandes en
+    attente de chaque boutique (index `(guild_id, statut, date_commande)`).
+    Une commande payée ou annulée entre-temps reste dans le tas ; elle est
+    simplement ignorée par `expirer_commandes`, qui revérifie son statut.
+    """
+
+    def __init__(self, boutiques, delai):
+        self.boutiques = boutiques
+        self.delai = delai
+        self._tas = []  # (échéance, guild_id, commande_id)
+        self._reveil = asyncio.Event()
+        self._tache = None
+        self.expirees = 0
+
+    async def demarrer(self):
+        self._tas = []
+        for guild_id in await self.boutiques.existantes():
+            stockage = await self.boutiques.pour(guild_id)
+            self._tas += [
+                (_horodatage(date_commande) + self.delai, guild_id, commande_id)
+                for commande_id, date_commande in await stockage.commandes_en_attente(guild_id)
+            ]
+        heapq.heapify(self._tas)
+        self._tache = asyncio.create_task(self._boucle())
+        return len(self._tas)
+
+    def arreter(self):
+        if self._tache is not None:
+            self._tache.cancel()
+
+    def ajouter(self, guild_id, commande_id, date_commande=None):
+        """Programme l'expiration d'une commande créée à `date_commande` (maintenant par défaut)"""
+        creation = _horodatage(date_commande) if date_commande else datetime.now(timezone.utc)
+        echeance = creation + self.delai
+        if not self._tas or echeance < self._tas[0][0]:
+            self._reveil.set()  # nouvelle échéance la plus proche : la tâche doit se réveiller plus tôt
+        heapq.heappush(self._tas, (echeance, guild_id, commande_id))
+
+    def __len__(self):
+        return len(self._tas)
+
+    async def _boucle(self):
+        while True:
+            self._reveil.clear()
+            if not self._tas:
+                await self._reveil.wait()
+                continue
+
+            attente = (self._tas[0][0] - datetime.now(timezone.utc)).total_seconds()
+            if attente > 0:
+                try:
+                    await asyncio.wait_for(self._reveil.wait(), attente)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            maintenant = datetime.now(timezone.utc)
+            lot = []
+            while self._tas and self._tas[0][0] <= maintenant and len(lot) < TAILLE_LOT_EXPIRATION:
+                lot.append(heapq.heappop(self._tas))
+
+            avant = (maintenant - self.delai).strftime(FORMAT_HORODATAGE)
+            par_serveur = {}
+            for _, guild_id, commande_id in lot:
+                par_serveur.setdefault(guild_id, []).append(commande_id)
+            try:
+                for guild_id, commande_ids in par_serveur.items():
+                    stockage = await self.boutiques.pour(guild_id)
+                    self.expirees += await stockage.expirer_commandes(guild_id, commande_ids, avant)
+            except Exception as e:
+                print(f"Expiration des commandes impossible : {e}")
+                for entree in lot:
+                    heapq.heappush(self._tas, entree)
+                await asyncio.sleep(DELAI_REESSAI_EXPIRATION)
@@ -0,0 +1,109 @@
+import functools
+import math
+import time
+from collections import OrderedDict
+
+NB_SEAUX_MAX = 100_000  # seaux par utilisateur gardés au plus en mémoire
+
+
+class Seau:
+    """Seau à jetons : `capacite` appels en rafale, puis `par_seconde` appels par seconde"""
+
+    __slots__ = ('capacite', 'par_seconde', 'jetons', 'maj')
+
+    def __init__(self, capacite, par_seconde, maintenant):
+        self.capacite = capacite
+        self.par_seconde = par_seconde
+        self.jetons = float(capacite)
+        self.maj = maintenant
+
+    def _remplir(self, maintenant):
+        self.jetons = min(self.capacite, self.jetons + (maintenant - self.maj) * self.par_seconde)
+        self.maj = maintenant
+
+    def prendre(self, maintenant):
+        """Consomme un jeton ; retourne 0, ou le délai (s) avant qu'un jeton soit disponible"""
+        self._remplir(maintenant)
+        if self.jetons >= 1:
+            self.jetons -= 1
+            return 0.0
+        return (1 - self.jetons) / self.par_seconde
+
+    def rendre(self):
+        self.jetons = min(self.capacite, self.jetons + 1)
+
+    def plein(self, maintenant):
+        return self.jetons + (maintenant - self.maj) * self.par_seconde >= self.capacite
+
+
+class Limiteur:
+    """Limitation du débit des commandes d'écriture, par utilisateur et globalement.
+
+    `limites` associe à chaque commande limitée un couple (capacité, appels
+    par seconde) appliqué à chaque utilisateur ; `globale` est le budget
+    partagé par toutes ces commandes. Un seau redevenu plein équivaut à un
+    seau neuf : il est supprimé, ce qui borne la mémoire aux utilisateurs
+    actifs. `autoriser` ne contient aucun `await` : appelé depuis la boucle,
+    il vérifie et prend les jetons d'un seul tenant.
+    """
+
+    def __init__(self, limites, globale, horloge=time.monotonic):
+        self.limites = dict(limites)
+        self._horloge = horloge
+        self._global = Seau(*globale, horloge())
+        self._seaux = OrderedDict()  # (commande, user_id) -> Seau, du moins au plus récemment utilisé
+        self.rejets = {}
+
+    def autoriser(self, commande, user_id):
+        """Retourne 0 si l'appel est accepté, sinon le délai (s) avant de réessayer"""
+        limite = self.limites.get(commande)
+        if limite is None:
+            return 0.0
+        maintenant = self._horloge()
+        cle = (commande, user_id)
+        seau = self._seaux.get(cle)
+        if seau is None:
+            seau = self._seaux[cle] = Seau(*limite, maintenant)
+        else:
+            self._seaux.move_to_end(cle)
+
+        attente = seau.prendre(maintenant)
+        if not attente:
+            attente = self._global.prendre(maintenant)
+            if attente:
+                seau.rendre()  # refusé par le budget global : le jeton de l'utilisateur n'est pas perdu
+        if attente:
+            self.rejets[commande] = self.rejets.get(commande, 0) + 1
+        self._evincer(maintenant)
+        return attente
+
+    def _evincer(self, maintenant):
+        while self._seaux:
+            cle, seau = next(iter(self._seaux.items()))
+            if len(self._seaux) <= NB_SEAUX_MAX and not seau.plein(maintenant):
+                break
+            del self._seaux[cle]
+
+    def __len__(self):
+        return len(self._seaux)
+
+
+def limiter(limiteur, commande):
+    """Refuse une commande slash (message éphémère) si l'utilisateur ou le bot dépasse son débit.
+
+    À placer au-dessus de `mesurer_commande` : un appel refusé n'atteint ni
+    la base ni les métriques de latence.
+    """
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        async def wrapper(interaction, *args, **kwargs):
+            attente = limiteur.autoriser(commande, interaction.user.id)
+            if attente:
+                await interaction.response.send_message(
+                    f"⏳ Trop de demandes, réessaie dans {math.ceil(attente)} s.",
+                    ephemeral=True
+                )
+                return
+            return await fonction(interaction, *args, **kwargs)
+        return wrapper
+    return decorateur
@@ -0,0 +1,201 @@
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
+
+# Bornes des histogrammes de latence, en secondes
+BORNES_LATENCE = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Serie:
+    """Latences (histogramme cumulatif), appels, erreurs et lignes retournées d'une opération"""
+
+    def __init__(self):
+        self.compteurs = [0] * (len(BORNES_LATENCE) + 1)  # dernier : +Inf
+        self.somme = 0.0
+        self.appels = 0
+        self.erreurs = 0
+        self.lignes = 0
+
+    def observer(self, duree, erreur=False, lignes=0):
+        index = 0
+        while index < len(BORNES_LATENCE) and duree > BORNES_LATENCE[index]:
+            index += 1
+        self.compteurs[index] += 1
+        self.somme += duree
+        self.appels += 1
+        self.lignes += lignes
+        if erreur:
+            self.erreurs += 1
+
+    def quantile(self, q):
+        """Estimation d'un quantile : borne supérieure du seau qui le contient"""
+        cible = q * self.appels
+        cumul = 0
+        for index, nombre in enumerate(self.compteurs):
+            cumul += nombre
+            if cumul >= cible and nombre:
+                return BORNES_LATENCE[index] if index < len(BORNES_LATENCE) else float('inf')
+        return 0.0
+
+
+class Registre:
+    """Ensemble des séries, par type (`commande` ou `requete`) et par nom"""
+
+    def __init__(self):
+        self._series = {}
+        self._verrou = threading.Lock()
+
+    def observer(self, type, nom, duree, erreur=False, lignes=0):
+        with self._verrou:
+            serie = self._series.get((type, nom))
+            if serie is None:
+                serie = self._series[(type, nom)] = Serie()
+            serie.observer(duree, erreur, lignes)
+
+    def series(self, type=None):
+        """Copie des séries, triées par temps total décroissant"""
+        with self._verrou:
+            elements = [
+                (t, nom, serie) for (t, nom), serie in self._series.items()
+                if type is None or t == type
+            ]
+        return sorted(elements, key=lambda e: e[2].somme, reverse=True)
+
+    def vider(self):
+        with self._verrou:
+            self._series.clear()
+
+    def format_prometheus(self):
+        """Export au format texte de Prometheus"""
+        lignes = []
+        par_type = {}
+        for type, nom, serie in self.series():
+            par_type.setdefault(type, []).append((nom, serie))
+
+        for type, series in sorted(par_type.items()):
+            metrique = f"boutique_{type}_duree_secondes"
+            lignes.append(f"# HELP {metrique} Durée des appels ({type})")
+            lignes.append(f"# TYPE {metrique} histogram")
+            for nom, serie in series:
+                cumul = 0
+                for borne, nombre in zip((*BORNES_LATENCE, '+Inf'), serie.compteurs):
+                    cumul += nombre
+                    lignes.append(f'{metrique}_bucket{{nom="{nom}",le="{borne}"}} {cumul}')
+                lignes.append(f'{metrique}_sum{{nom="{nom}"}} {serie.somme}')
+                lignes.append(f'{metrique}_count{{nom="{nom}"}} {serie.appels}')
+
+            for suffixe, attribut, description in (
+                ("erreurs_total", "erreurs", "Appels terminés par une exception"),
+                ("lignes_total", "lignes", "Lignes retournées"),
+            ):
+                metrique = f"boutique_{type}_{suffixe}"
+                lignes.append(f"# HELP {metrique} {description} ({type})")
+                lignes.append(f"# TYPE {metrique} counter")
+                for nom, serie in series:
+                    lignes.append(f'{metrique}{{nom="{nom}"}} {getattr(serie, attribut)}')
+        return "\n".join(lignes) + "\n"
+
+registre = Registre()
+
+
+def _nombre_lignes(resultat):
+    if isinstance(resultat, list):
+        return len(resultat)
+    if isinstance(resultat, tuple) and resultat and isinstance(resultat[0], list):
+        # (lignes, indicateur), comme obtenir_page_commandes
+        return len(resultat[0])
+    return 1 if resultat is not None else 0
+
+def mesurer_requete(fonction):
+    """Mesure un accès à la base : durée, appels, erreurs et lignes retournées.
+
+    Pour un générateur, la durée couvre tout le parcours et chaque élément
+    produit compte pour une ligne.
+    """
+    nom = fonction.__name__
+
+    if inspect.isgeneratorfunction(fonction):
+        @functools.wraps(fonction)
+        def generateur(*args, **kwargs):
+            debut = time.perf_counter()
+            lignes = 0
+            erreur = False
+            try:
+                for element in fonction(*args, **kwargs):
+                    lignes += 1
+                    yield element
+            except BaseException:
+                erreur = True
+                raise
+            finally:
+                registre.observer("requete", nom, time.perf_counter() - debut, erreur, lignes)
+        return generateur
+
+    @functools.wraps(fonction)
+    def wrapper(*args, **kwargs):
+        debut = time.perf_counter()
+        try:
+            resultat = fonction(*args, **kwargs)
+        except BaseException:
+            registre.observer("requete", nom, time.perf_counter() - debut, erreur=True)
+            raise
+        registre.observer("requete", nom, time.perf_counter() - debut, lignes=_nombre_lignes(resultat))
+        return resultat
+    return wrapper
+
+def mesurer_commande(fonction):
+    """Mesure un gestionnaire de commande slash (à placer juste au-dessus de `async def`)"""
+    nom = fonction.__name__
+
+    @functools.wraps(fonction)
+    async def wrapper(*args, **kwargs):
+        debut = time.perf_counter()
+        try:
+            resultat = await fonction(*args, **kwargs)
+        except BaseException:
+            registre.observer("commande", nom, time.perf_counter() - debut, erreur=True)
+            raise
+        registre.observer("commande", nom, time.perf_counter() - debut)
+        return resultat
+    return wrapper
+
+
+def rendre_metriques(type=None, limite=20):
+    """Lignes lisibles pour la commande /metrics, des opérations les plus coûteuses aux moins coûteuses"""
+    blocs = []
+    for t, nom, serie in registre.series(type)[:limite]:
+        moyenne = serie.somme / serie.appels * 1000 if serie.appels else 0
+        blocs.append(
+            f"`{t[:3]}` **{nom}** - {serie.appels} appel(s), {serie.erreurs} erreur(s), "
+            f"moy. {moyenne:.1f} ms, p50 ≤ {serie.quantile(0.5) * 1000:g} ms, p99 ≤ {serie.quantile(0.99) * 1000:g} ms"
+            + (f", {serie.lignes} ligne(s)" if t == "requete" else "")
+            + "\n"
+        )
+    return blocs
+
+
+async def exporter_fichier(chemin, intervalle=15):
+    """Réécrit périodiquement le fichier d'export Prometheus (pour le collecteur textfile)"""
+    while True:
+        temporaire = chemin + ".tmp"
+        with open(temporaire, "w", encoding="utf-8") as f:
+            f.write(registre.format_prometheus())
+        os.replace(temporaire, chemin)
+        await asyncio.sleep(intervalle)
+
+async def demarrer_serveur(port, hote="127.0.0.1"):
+    """Expose les métriques sur http://hote:port/metrics, retourne le runner aiohttp"""
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=registre.format_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, hote, port).start()
+    return runner
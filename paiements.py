@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import random
+import re
+from collections import Counter
+
+# Événement envoyé par PayPal quand un paiement est encaissé
+EVENEMENT_PAIEMENT = "PAYMENT.CAPTURE.COMPLETED"
+CHEMIN_WEBHOOK = "/paiements/webhook"
+
+# Résultats signalés (dans la console par défaut) : ils demandent l'attention d'un administrateur
+ANOMALIES = ('commande_inconnue', 'montant_incorrect', 'commande_annulee')
+
+
+class NotificationInvalide(ValueError):
+    """Notification de paiement illisible ou incomplète"""
+
+
+def lire_notification(donnees):
+    """Extrait (id de la notification, serveur, référence, montant) d'une notification PayPal.
+
+    Retourne None pour les autres types d'événements, qui sont ignorés.
+    La référence (`resource.custom_id`) désigne une commande (`"12"`) ou un
+    groupe de commandes validé depuis un panier (`"G12"`), précédée de l'ID
+    du serveur de la boutique (`"123456789:G12"`) ; le serveur vaut None pour
+    les références émises avant le découpage par serveur.
+    """
+    if not isinstance(donnees, dict):
+        raise NotificationInvalide("objet JSON attendu")
+    if donnees.get('event_type') != EVENEMENT_PAIEMENT:
+        return None
+    try:
+        ressource = donnees['resource']
+        correspondance = re.fullmatch(r'(?:(\d+):)?(G?\d+)', str(ressource['custom_id']))
+        if correspondance is None:
+            raise ValueError(ressource['custom_id'])
+        guild_id, reference = correspondance.groups()
+        guild_id = int(guild_id) if guild_id is not None else None
+        montant = float(ressource['amount']['value'])
+        if not math.isfinite(montant):  # float() accepte "NaN" et "Infinity"
+            raise ValueError(montant)
+        return str(donnees['id']), guild_id, reference, montant
+    except (KeyError, TypeError, ValueError):
+        raise NotificationInvalide(
+            "champs attendus : id, resource.custom_id (serveur:commande ou serveur:G + groupe), resource.amount.value (nombre fini)"
+        )
+
+def reference_paiement(guild_id, reference):
+    """Référence à transmettre à PayPal (`custom_id`) pour une commande ou un groupe (`"G12"`)"""
+    return f"{guild_id}:{reference}"
+
+def signer(corps, secret):
+    """Signature HMAC-SHA256 (hexadécimale) du corps d'une notification"""
+    return hmac.new(secret.encode(), corps, hashlib.sha256).hexdigest()
+
+
+class PipelinePaiements:
+    """Rapprochement des notifications de paiement avec les commandes.
+
+    Une notification déjà en cours de traitement (renvoi rapide de PayPal)
+    attend le même résultat au lieu d'être traitée deux fois ; les doublons
+    plus tardifs sont écartés par la clé primaire de la table `paiements`.
+    Les rapprochements passent par la file d'écritures de `Stockage` et sont
+    donc validés par lots, quel que soit le nombre de notifications reçues.
+    Une notification pour un serveur sans boutique n'en crée pas : elle est
+    rejetée comme `commande_inconnue`.
+    """
+
+    def __init__(self, boutiques, signaler=print, serveur_defaut=0):
+        self.boutiques = boutiques
+        self.signaler = signaler
+        self.serveur_defaut = serveur_defaut  # serveur des références sans préfixe
+        self._en_cours = {}  # id de notification -> tâche de rapprochement
+        self.resultats = Counter()
+
+    async def recevoir(self, donnees):
+        """Traite une notification décodée, retourne le résultat du rapprochement"""
+        notification = lire_notification(donnees)
+        if notification is None:
+            self.resultats['ignoree'] += 1
+            return 'ignoree'
+
+        notification_id, guild_id, reference, montant = notification
+        if guild_id is None:
+            guild_id = self.serveur_defaut
+        tache = self._en_cours.get(notification_id)
+        if tache is None:
+            tache = asyncio.ensure_future(self._rapprocher(guild_id, notification_id, reference, montant))
+            self._en_cours[notification_id] = tache
+            tache.add_done_callback(lambda _: self._en_cours.pop(notification_id, None))
+            resultat = await asyncio.shield(tache)
+        else:
+            await asyncio.shield(tache)
+            resultat = 'doublon'
+
+        self.resultats[resultat] += 1
+        if resultat in ANOMALIES:
+            self.signaler(f"Paiement {notification_id} pour la commande {reference} du serveur {guild_id} ({montant} €) : {resultat}")
+        return resultat
+
+    async def _rapprocher(self, guild_id, notification_id, reference, montant):
+        stockage = await self.boutiques.existante(guild_id)
+        if stockage is None:
+            return 'commande_inconnue'
+        return await stockage.enregistrer_paiement(guild_id, notification_id, reference, montant)
+
+
+async def demarrer_serveur_paiements(pipeline, port, hote="127.0.0.1", secret=None):
+    """Reçoit les notifications sur http://hote:port/paiements/webhook, retourne le runner aiohttp.
+
+    Si `secret` est fourni, chaque requête doit porter dans l'en-tête
+    `X-Signature` la signature HMAC-SHA256 de son corps.
+    """
+    from aiohttp import web
+
+    async def webhook(request):
+        corps = await request.read()
+        if secret and not hmac.compare_digest(request.headers.get('X-Signature', ''), signer(corps, secret)):
+            return web.json_response({'erreur': "signature invalide"}, status=401)
+        try:
+            resultat = await pipeline.recevoir(json.loads(corps))
+        except ValueError as e:
+            return web.json_response({'erreur': str(e)}, status=400)
+        return web.json_response({'resultat': resultat})
+
+    app = web.Application()
+    app.router.add_post(CHEMIN_WEBHOOK, webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, hote, port).start()
+    return runner
+
+
+def notification(notification_id, reference, montant, evenement=EVENEMENT_PAIEMENT):
+    """Construit une notification au format des webhooks PayPal"""
+    return {
+        'id': notification_id,
+        'event_type': evenement,
+        'resource': {
+            'id': f"CAPTURE-{notification_id}",
+            'custom_id': str(reference),
+            'amount': {'value': f"{montant:.2f}", 'currency_code': 'EUR'},
+        },
+    }
+
+def simuler_notifications(commandes, taux_doublons=0.1, taux_anomalies=0.02):
+    """Notifications de paiement pour des commandes [(guild_id, id, total), ...], dans le désordre.
+
+    Une partie des notifications est renvoyée plusieurs fois (comme le fait
+    PayPal sans réponse rapide) et une petite partie porte un montant erroné.
+    """
+    notifications = []
+    for guild_id, commande_id, total in commandes:
+        montant = total + 1 if random.random() < taux_anomalies else total
+        notifications.append(notification(f"WH-{guild_id}-{commande_id}", reference_paiement(guild_id, commande_id), montant))
+    notifications += random.sample(notifications, int(len(notifications) * taux_doublons))
+    random.shuffle(notifications)
+    return notifications
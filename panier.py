@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+
+DUREE_PANIER = 30 * 60     # secondes d'inactivité avant qu'un panier soit oublié
+NB_LIGNES_MAX = 20         # produits différents au plus par panier
+QUANTITE_MAX = 100         # unités au plus par ligne
+
+
+class Paniers:
+    """Paniers des utilisateurs, gardés en mémoire jusqu'à leur validation.
+
+    Un panier est identifié par une clé (serveur, utilisateur) : un même
+    utilisateur a un panier distinct dans chaque boutique.
+
+    Rien n'est réservé tant que le panier n'est pas validé : le stock n'est
+    vérifié qu'une fois, au moment de la commande. Un panier inactif depuis
+    `duree` secondes est oublié ; les paniers sont rangés du moins au plus
+    récemment modifié, ce qui rend l'éviction proportionnelle au nombre de
+    paniers expirés. Les paniers ne sont jamais écrits en base : ils sont
+    perdus au redémarrage du bot.
+    """
+
+    def __init__(self, duree=DUREE_PANIER, horloge=time.monotonic):
+        self.duree = duree
+        self._horloge = horloge
+        self._paniers = OrderedDict()  # (guild_id, user_id) -> (dernière modification, {produit_id: quantité})
+
+    def _evincer(self, maintenant):
+        while self._paniers:
+            cle, (maj, _) = next(iter(self._paniers.items()))
+            if maintenant - maj < self.duree:
+                break
+            del self._paniers[cle]
+
+    def lignes(self, cle):
+        """Retourne {produit_id: quantité} (vide si l'utilisateur n'a pas de panier)"""
+        self._evincer(self._horloge())
+        entree = self._paniers.get(cle)
+        return dict(entree[1]) if entree else {}
+
+    def definir(self, cle, produit_id, quantite):
+        """Fixe la quantité d'un produit dans le panier (0 le retire), retourne les lignes.
+
+        ValueError si la quantité ou le nombre de lignes dépasse les limites.
+        """
+        if not 0 <= quantite <= QUANTITE_MAX:
+            raise ValueError(f"la quantité doit être comprise entre 0 et {QUANTITE_MAX}")
+        maintenant = self._horloge()
+        self._evincer(maintenant)
+        _, lignes = self._paniers.pop(cle, (None, {}))
+        if quantite:
+            if produit_id not in lignes and len(lignes) >= NB_LIGNES_MAX:
+                self._paniers[cle] = (maintenant, lignes)
+                raise ValueError(f"un panier contient au plus {NB_LIGNES_MAX} produits")
+            lignes[produit_id] = quantite
+        else:
+            lignes.pop(produit_id, None)
+        if lignes:
+            self._paniers[cle] = (maintenant, lignes)
+        return dict(lignes)
+
+    def vider(self, cle):
+        self._paniers.pop(cle, None)
+
+    def __len__(self):
+        return len(self._paniers)
@@ -0,0 +1,163 @@
+import difflib
+import heapq
+import re
+import threading
+import unicodedata
+
+LIMITE_SUGGESTIONS = 25  # choix affichés au plus par Discord
+SEUIL_APPROCHANT = 0.75  # similarité minimale d'un mot approchant (fautes de frappe)
+
+# Clés réservées des nœuds du trie (jamais des lettres : `\w` ne les reconnaît pas)
+TOUS = ''    # produits dont un mot du nom ou de la description a ce préfixe
+NOM = '#'    # produits dont un mot du nom a ce préfixe
+
+
+def normaliser(texte):
+    """Minuscules, sans accents : « Casquette Été » -> « casquette ete »"""
+    decompose = unicodedata.normalize('NFKD', texte)
+    return ''.join(c for c in decompose if not unicodedata.combining(c)).casefold()
+
+def mots(texte):
+    return re.findall(r'\w+', normaliser(texte))
+
+
+class IndexProduits:
+    """Index de recherche en mémoire sur le nom et la description des produits.
+
+    Un trie des mots retrouve les produits dont un mot commence par le texte
+    saisi ; un index des mots complets sert à la recherche approchante.
+    L'index est abonné au catalogue en cache (`CatalogueCache.abonner`) et
+    tenu à jour produit par produit : une recherche ne touche jamais la base.
+    """
+
+    def __init__(self):
+        self._trie = {}
+        self._mots = {}       # mot -> IDs des produits qui le contiennent
+        self._initiales = {}  # première lettre -> mots indexés
+        self._produits = {}   # ID -> (nom normalisé, mots du nom, mots de la description)
+        self._verrou = threading.Lock()
+
+    # Mises à jour, appelées par le catalogue
+
+    def charger(self, produits):
+        with self._verrou:
+            self._trie, self._mots, self._initiales, self._produits = {}, {}, {}, {}
+            for produit in produits:
+                self._indexer(produit.id, self._entree(produit))
+
+    def mettre_a_jour(self, produit):
+        entree = self._entree(produit)
+        with self._verrou:
+            ancienne = self._produits.get(produit.id)
+            if ancienne == entree:
+                return  # seuls le prix ou le stock ont changé
+            if ancienne is not None:
+                self._desindexer(produit.id)
+            self._indexer(produit.id, entree)
+
+    def retirer(self, produit_id):
+        with self._verrou:
+            if produit_id in self._produits:
+                self._desindexer(produit_id)
+
+    @staticmethod
+    def _entree(produit):
+        mots_nom = frozenset(mots(produit.nom))
+        return normaliser(produit.nom), mots_nom, frozenset(mots(produit.description or '')) - mots_nom
+
+    def _indexer(self, produit_id, entree):
+        _, mots_nom, mots_description = entree
+        self._produits[produit_id] = entree
+        for mot in mots_nom | mots_description:
+            if mot not in self._mots:
+                self._mots[mot] = set()
+                self._initiales.setdefault(mot[0], set()).add(mot)
+            self._mots[mot].add(produit_id)
+            dans_nom = mot in mots_nom
+            noeud = self._trie
+            for lettre in mot:
+                noeud = noeud.setdefault(lettre, {TOUS: set(), NOM: set()})
+                noeud[TOUS].add(produit_id)
+                if dans_nom:
+                    noeud[NOM].add(produit_id)
+
+    def _desindexer(self, produit_id):
+        _, mots_nom, mots_description = self._produits.pop(produit_id)
+        for mot in mots_nom | mots_description:
+            ids = self._mots[mot]
+            ids.discard(produit_id)
+            if not ids:
+                del self._mots[mot]
+                initiales = self._initiales[mot[0]]
+                initiales.discard(mot)
+                if not initiales:
+                    del self._initiales[mot[0]]
+            chemin = []
+            noeud = self._trie
+            for lettre in mot:
+                if lettre not in noeud:
+                    break  # branche déjà élaguée pour un autre mot de ce produit
+                chemin.append((noeud, lettre))
+                noeud = noeud[lettre]
+                noeud[TOUS].discard(produit_id)
+                noeud[NOM].discard(produit_id)
+            # Élague les branches devenues vides
+            for parent, lettre in reversed(chemin):
+                if parent[lettre][TOUS]:
+                    break
+                del parent[lettre]
+
+    # Recherche
+
+    def _prefixe(self, debut, cle=TOUS):
+        noeud = self._trie
+        for lettre in debut:
+            noeud = noeud.get(lettre)
+            if noeud is None:
+                return set()
+        return noeud[cle]
+
+    def _approchants(self, mot):
+        """Produits contenant un mot proche de `mot` (même première lettre)"""
+        ids = set()
+        vocabulaire = self._initiales.get(mot[0], ())
+        for proche in difflib.get_close_matches(mot, vocabulaire, n=5, cutoff=SEUIL_APPROCHANT):
+            ids |= self._mots[proche]
+        return ids
+
+    def rechercher(self, texte, limite=LIMITE_SUGGESTIONS):
+        """IDs des produits correspondant à `texte`, les plus pertinents d'abord.
+
+        Chaque mot saisi doit être le début d'un mot du produit ; si rien ne
+        correspond, les mots approchants sont acceptés. Viennent d'abord les
+        produits dont le nom commence par le texte, puis ceux qui
+        correspondent par leur nom, puis par leur description.
+        """
+        requete = mots(texte)
+        with self._verrou:
+            if not requete:
+                return heapq.nsmallest(limite, self._produits)
+
+            candidats = self._intersection(requete, self._prefixe)
+            if candidats:
+                par_nom = self._intersection(requete, lambda m: self._prefixe(m, NOM))
+            else:
+                candidats = self._intersection(requete, lambda m: self._prefixe(m) or self._approchants(m))
+                par_nom = set()
+
+            debut = normaliser(texte).strip()
+            debut_nom = {i for i in par_nom if self._produits[i][0].startswith(debut)}
+            resultat = []
+            for groupe in (debut_nom, par_nom - debut_nom, candidats - par_nom):
+                if len(resultat) >= limite:
+                    break
+                resultat += heapq.nsmallest(limite - len(resultat), groupe, key=lambda i: (self._produits[i][0], i))
+            return resultat
+
+    @staticmethod
+    def _intersection(requete, correspondances):
+        ensembles = sorted((correspondances(mot) for mot in requete), key=len)
+        if not ensembles[0]:
+            return set()
+        # Du plus petit au plus grand : l'intersection reste petite
+        return ensembles[0].intersection(*ensembles[1:])
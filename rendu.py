@@ -0,0 +1,120 @@
+LIMITE_MESSAGE = 2000  # caractères par message Discord
+
+
+def decouper_messages(entete, blocs, pied="", limite=LIMITE_MESSAGE):
+    """Assemble des blocs de texte en messages de moins de `limite` caractères.
+
+    L'en-tête ouvre le premier message et le pied ferme le dernier ; un bloc
+    n'est jamais coupé entre deux messages, sauf s'il dépasse à lui seul la
+    limite (il est alors découpé ligne par ligne).
+    """
+    messages = []
+    morceaux = [entete] if entete else []
+    taille = len(entete)
+
+    for bloc in _blocs_bornes(blocs, limite):
+        if taille + len(bloc) > limite and morceaux:
+            messages.append("".join(morceaux))
+            morceaux, taille = [], 0
+        morceaux.append(bloc)
+        taille += len(bloc)
+
+    if pied:
+        if taille + len(pied) > limite and morceaux:
+            messages.append("".join(morceaux))
+            morceaux = []
+        morceaux.append(pied)
+    if morceaux:
+        messages.append("".join(morceaux))
+    return messages
+
+def _blocs_bornes(blocs, limite):
+    for bloc in blocs:
+        if len(bloc) <= limite:
+            yield bloc
+            continue
+        for ligne in bloc.splitlines(keepends=True):
+            while len(ligne) > limite:
+                yield ligne[:limite]
+                ligne = ligne[limite:]
+            yield ligne
+
+
+class CacheRendu:
+    """Rendus de messages mis en cache, valables tant que la version du catalogue ne change pas.
+
+    La version doit être lue *avant* les données rendues : un rendu construit
+    pendant une modification est associé à l'ancienne version et sera refait.
+    """
+
+    def __init__(self):
+        self._entrees = {}
+        self.succes = 0
+        self.echecs = 0
+
+    def obtenir(self, cle, version, construire):
+        entree = self._entrees.get(cle)
+        if entree is not None and entree[0] == version:
+            self.succes += 1
+            return entree[1]
+        self.echecs += 1
+        messages = construire()
+        self._entrees[cle] = (version, messages)
+        return messages
+
+    def vider(self):
+        self._entrees.clear()
+
+
+def rendre_catalogue(produits):
+    blocs = (
+        f"🆔 **{p.id}** - **{p.nom}** ({p.prix} €)\n   {p.description}\n   📦 Stock : {p.stock} unités\n\n"
+        for p in produits
+    )
+    return decouper_messages("__**🛍️ Produits disponibles dans la boutique :**__\n", blocs)
+
+def rendre_catalogue_admin(produits):
+    if not produits:
+        return ["Aucun produit enregistré."]
+    blocs = (
+        f"🆔 **{p.id}** - **{p.nom}** ({p.prix} €)\n   {p.description}\n   📦 Stock : {p.stock}\n\n"
+        for p in produits
+    )
+    return decouper_messages("__**🛍️ Liste des produits (Admin) :**__\n", blocs)
+
+def rendre_commandes(commandes, produit_par_id):
+    """Rendu de l'historique d'un utilisateur ; `produit_par_id` retourne un produit ou None.
+
+    Les commandes sont consommées une à une : un générateur n'est jamais
+    chargé entièrement en mémoire.
+    """
+    blocs = (
+        f"📦 **{produit.nom}**\n"
+        f"   📊 Quantité : {c.quantite}x\n"
+        f"   💶 Prix unitaire : {c.prix_unitaire} €\n"
+        f"   💰 Total : {c.total} €\n"
+        f"   📋 Statut : {c.statut}\n"
+        "-----------------------------\n"
+        for c in commandes
+        for produit in (produit_par_id(c.produit_id),)
+        if produit
+    )
+    return decouper_messages("__**🛒 Tes commandes :**__\n", blocs, "\nMerci pour tes achats ! 🛍️")
+
+def rendre_panier(lignes, produit_par_id):
+    """Rendu d'un panier {produit_id: quantité} ; `produit_par_id` retourne un produit ou None"""
+    blocs = []
+    total = 0
+    for produit_id, quantite in lignes.items():
+        produit = produit_par_id(produit_id)
+        if produit is None:
+            blocs.append(f"❔ Produit #{produit_id} (retiré de la boutique) x{quantite}\n")
+            continue
+        sous_total = quantite * produit.prix
+        total += sous_total
+        blocs.append(f"📦 **{produit.nom}** x{quantite} - {sous_total:.2f} €\n")
+    return decouper_messages(
+        "__**🛒 Ton panier :**__\n",
+        blocs,
+        f"\n💰 Total : {total:.2f} €\nValide-le avec /panier_valider pour recevoir un seul lien de paiement."
+    )
@@ -0,0 +1,349 @@
+import asyncio
+import functools
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import base_donnees as bd
+import echanges
+from recherche import LIMITE_SUGGESTIONS, IndexProduits
+
+# Validation groupée des écritures fréquentes
+TAILLE_LOT = 200     # opérations au plus par transaction
+DELAI_LOT = 0.002    # attente maximale (s) pour compléter un lot
+
+NB_ECRIVAINS = 4     # threads écrivains partagés par les bases des serveurs (une base par serveur)
+
+
+class FileEcritures:
+    """File d'écritures validées par lots (« group commit »).
+
+    Les opérations soumises pendant quelques millisecondes, ou pendant que le
+    lot précédent s'exécute, sont regroupées dans une seule transaction par
+    `bd.executer_lot`. Chaque appelant n'est réveillé qu'une fois son lot
+    validé, avec son propre résultat ou sa propre exception.
+    """
+
+    def __init__(self, executer, taille_lot=TAILLE_LOT, delai=DELAI_LOT):
+        self._executer = executer
+        self.taille_lot = taille_lot
+        self.delai = delai
+        self._file = deque()
+        self._plein = asyncio.Event()
+        self._tache = None
+
+    async def soumettre(self, nom, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._file.append(((nom, args), future))
+        if len(self._file) >= self.taille_lot:
+            self._plein.set()
+        if self._tache is None or self._tache.done():
+            self._tache = asyncio.create_task(self._vider())
+        return await future
+
+    async def _vider(self):
+        while self._file:
+            if len(self._file) < self.taille_lot:
+                self._plein.clear()
+                try:
+                    await asyncio.wait_for(self._plein.wait(), self.delai)
+                except asyncio.TimeoutError:
+                    pass
+
+            lot = [self._file.popleft() for _ in range(min(len(self._file), self.taille_lot))]
+            try:
+                resultats = await self._executer([operation for operation, _ in lot])
+            except Exception as e:
+                for _, future in lot:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), (reussie, resultat) in zip(lot, resultats):
+                if future.done():
+                    continue  # appelant annulé : l'écriture est tout de même validée
+                if reussie:
+                    future.set_result(resultat)
+                else:
+                    future.set_exception(resultat)
+
+
+class Stockage:
+    """Accès asynchrone à une base de données de la boutique.
+
+    Les fonctions de `base_donnees` sont bloquantes : elles sont exécutées
+    hors de la boucle asyncio, les écritures sur un unique thread écrivain
+    (ce qui les sérialise) et les lectures sur un petit pool de threads.
+    Les commandes, changements de statut et paiements passent par une `FileEcritures`
+    qui les valide par lots.
+
+    Une base peut contenir les boutiques de plusieurs serveurs Discord : chaque
+    méthode reçoit l'ID du serveur (guild), dont le catalogue en cache et
+    l'index de recherche sont séparés de ceux des autres serveurs.
+    """
+
+    def __init__(self, chemin=None, nb_lecteurs=4, taille_lot=TAILLE_LOT, ecrivain=None, lecteurs=None):
+        self.chemin = chemin
+        # Threads fournis par `Boutiques` quand plusieurs bases se les partagent
+        self._threads_partages = ecrivain is not None
+        self._ecrivain = ecrivain or ThreadPoolExecutor(max_workers=1, thread_name_prefix="boutique-ecriture")
+        self._lecteurs = lecteurs or ThreadPoolExecutor(max_workers=nb_lecteurs, thread_name_prefix="boutique-lecture")
+        self._lots = FileEcritures(functools.partial(self._ecrire, bd.executer_lot), taille_lot)
+        self._index_produits = {}  # guild_id -> IndexProduits
+        self._ouvertures = {}      # guild_id -> tâche de préparation de la boutique
+
+    async def _lire(self, fonction, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._lecteurs, functools.partial(bd.sur_base, self.chemin, fonction, *args))
+
+    async def _ecrire(self, fonction, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._ecrivain, functools.partial(bd.sur_base, self.chemin, fonction, *args))
+
+    def fermer(self):
+        """Attend la fin des accès en cours puis libère les threads"""
+        if self._threads_partages:
+            return  # fermés par `Boutiques`
+        self._ecrivain.shutdown(wait=True)
+        self._lecteurs.shutdown(wait=True)
+        bd.fermer_connexions()
+
+    def _index(self, guild_id):
+        index = self._index_produits.get(guild_id)
+        if index is None:
+            index = self._index_produits[guild_id] = IndexProduits()
+            bd.catalogue_de(guild_id).abonner(index)
+        return index
+
+    # Écritures
+
+    async def migrer(self):
+        return await self._ecrire(bd.migrer)
+
+    async def initialiser(self, guild_id=bd.SERVEUR_HISTORIQUE):
+        """Prépare la boutique d'un serveur (schéma, produits par défaut, catalogue), une seule fois"""
+        tache = self._ouvertures.get(guild_id)
+        if tache is None:
+            tache = asyncio.ensure_future(self._ecrire(bd.initialiser_base_donnees, guild_id))
+            self._ouvertures[guild_id] = tache
+            tache.add_done_callback(functools.partial(self._ouverture_terminee, guild_id))
+        await asyncio.shield(tache)
+
+    def _ouverture_terminee(self, guild_id, tache):
+        if tache.cancelled() or tache.exception() is not None:
+            del self._ouvertures[guild_id]  # nouvel essai au prochain accès
+
+    async def attribuer_historique(self, guild_id):
+        return await self._ecrire(bd.attribuer_historique, guild_id)
+
+    async def importer_base(self, source):
+        """Reprend la base `source` (et ses archives) si ce stockage n'a pas encore de base"""
+        return await self._ecrire(bd.copier_base, source, self.chemin)
+
+    async def ajouter_commande(self, guild_id, user_id, produit_id, quantite, prix_unitaire):
+        return await self._lots.soumettre('ajouter_commande', guild_id, user_id, produit_id, quantite, prix_unitaire)
+
+    async def ajouter_produit(self, guild_id, nom, description, prix, stock):
+        return await self._ecrire(bd.ajouter_produit, guild_id, nom, description, prix, stock)
+
+    async def supprimer_produit(self, guild_id, produit_id):
+        return await self._ecrire(bd.supprimer_produit, guild_id, produit_id)
+
+    async def annuler_commandes_du_jour(self, guild_id, user_id, produit_id, jour):
+        return await self._ecrire(bd.annuler_commandes_du_jour, guild_id, user_id, produit_id, jour)
+
+    async def importer_produits(self, guild_id, donnees, format):
+        return await self._ecrire(echanges.importer_produits, guild_id, io.BytesIO(donnees), format)
+
+    async def enregistrer_paiement(self, guild_id, notification_id, reference, montant):
+        return await self._lots.soumettre('enregistrer_paiement', guild_id, notification_id, reference, montant)
+
+    async def valider_panier(self, guild_id, user_id, lignes):
+        return await self._lots.soumettre('valider_panier', guild_id, user_id, lignes)
+
+    async def expirer_commandes(self, guild_id, commande_ids, avant):
+        return await self._ecrire(bd.expirer_commandes, guild_id, commande_ids, avant)
+
+    async def modifier_statut_commande(self, guild_id, commande_id, statut):
+        return await self._lots.soumettre('modifier_statut_commande', guild_id, commande_id, statut)
+
+    async def archiver_commandes(self, guild_id, avant):
+        """Archive toutes les commandes terminées d'avant `avant`, un lot par transaction.
+
+        Les autres écritures s'intercalent entre les lots. Retourne le nombre
+        de commandes archivées.
+        """
+        total = 0
+        while True:
+            nb = await self._ecrire(bd.archiver_commandes, guild_id, avant)
+            total += nb
+            if nb < bd.TAILLE_LOT_ARCHIVAGE:
+                return total
+
+    async def compacter(self):
+        """Rend au système de fichiers les pages libres de la base, par petites transactions"""
+        while await self._ecrire(bd.compacter):
+            pass
+
+    # Lectures
+    # Une fois le catalogue en cache, les lectures de produits sont servies
+    # directement depuis la mémoire, sans passer par un thread.
+
+    async def obtenir_produits(self, guild_id):
+        catalogue = bd.catalogue_de(guild_id)
+        if catalogue.charge:
+            return catalogue.produits()
+        return await self._lire(bd.obtenir_produits, guild_id)
+
+    def version_catalogue(self, guild_id):
+        """Version du catalogue en cache, incrémentée à chaque changement de produit ou de stock"""
+        return bd.catalogue_de(guild_id).version
+
+    def produit_en_cache(self, guild_id, produit_id):
+        """Recherche O(1) d'un produit dans le catalogue, pour le code synchrone"""
+        return bd.catalogue_de(guild_id).obtenir(produit_id)
+
+    def rechercher_produits(self, guild_id, texte, limite=LIMITE_SUGGESTIONS):
+        """Produits dont le nom ou la description correspond à `texte`, servis par l'index en mémoire"""
+        catalogue = bd.catalogue_de(guild_id)
+        produits = (catalogue.obtenir(produit_id) for produit_id in self._index(guild_id).rechercher(texte, limite))
+        return [p for p in produits if p is not None]
+
+    async def obtenir_produit(self, guild_id, produit_id):
+        catalogue = bd.catalogue_de(guild_id)
+        if catalogue.charge:
+            return catalogue.obtenir(produit_id)
+        return await self._lire(bd.obtenir_produit, guild_id, produit_id)
+
+    async def verifier_stock(self, guild_id, produit_id, quantite):
+        if bd.catalogue_de(guild_id).charge:
+            return bd.verifier_stock(guild_id, produit_id, quantite)
+        return await self._lire(bd.verifier_stock, guild_id, produit_id, quantite)
+
+    async def compter_commandes_produit(self, produit_id):
+        return await self._lire(bd.compter_commandes_produit, produit_id)
+
+    async def serveurs(self):
+        return await self._lire(bd.serveurs)
+
+    async def obtenir_commandes_utilisateur(self, guild_id, user_id, archives=False):
+        return await self._lire(bd.obtenir_commandes_utilisateur, guild_id, user_id, archives)
+
+    async def parcourir_commandes_utilisateur(self, guild_id, user_id, consommer, archives=False):
+        """Passe à `consommer` un générateur des commandes d'un utilisateur, lues par lots.
+
+        `consommer` s'exécute sur le thread de lecture (qui possède le curseur) ;
+        son résultat est retourné.
+        """
+        return await self._lire(
+            lambda: consommer(bd.iterer_commandes_utilisateur(guild_id, user_id, archives))
+        )
+
+    async def commandes_en_attente(self, guild_id):
+        return await self._lire(bd.commandes_en_attente, guild_id)
+
+    async def obtenir_toutes_commandes(self, guild_id):
+        return await self._lire(bd.obtenir_toutes_commandes, guild_id)
+
+    async def rapport_ventes(self, guild_id, debut=None, fin=None):
+        return await self._lire(bd.rapport_ventes, guild_id, debut, fin)
+
+    async def exporter_commandes(self, guild_id, chemin, format):
+        return await self._lire(echanges.exporter_commandes, guild_id, chemin, format)
+
+    async def obtenir_page_commandes(self, guild_id, avant=None, apres=None, limite=bd.TAILLE_PAGE_COMMANDES):
+        return await self._lire(bd.obtenir_page_commandes, guild_id, avant, apres, limite)
+
+
+class Boutiques:
+    """Boutiques des serveurs Discord (guilds) où le bot est installé.
+
+    Par défaut, toutes les boutiques sont dans une même base, chaque ligne
+    portant l'ID de son serveur. Avec `dossier`, chaque serveur a sa propre
+    base (`<dossier>/<guild_id>.db`) : ni transaction ni verrou partagé entre
+    serveurs. Ces bases se partagent un pool de threads ; une base est toujours
+    écrite par le même thread (choisi d'après l'ID du serveur), ce qui garde un
+    seul écrivain par base.
+    """
+
+    def __init__(self, chemin=None, dossier=None, nb_lecteurs=4, nb_ecrivains=NB_ECRIVAINS):
+        self.dossier = dossier
+        self._chemin_commun = chemin  # base commune, ou d'avant le découpage en une base par serveur
+        self._ouvertes = set()
+        if dossier is None:
+            self._commun = Stockage(chemin, nb_lecteurs)
+            return
+        self._commun = None
+        self._stockages = {}  # guild_id -> Stockage de sa base
+        self._ecrivains = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"boutique-ecriture-{i}")
+            for i in range(nb_ecrivains)
+        ]
+        self._lecteurs = ThreadPoolExecutor(max_workers=nb_lecteurs, thread_name_prefix="boutique-lecture")
+
+    def chemin(self, guild_id):
+        """Base d'un serveur quand chaque serveur a la sienne"""
+        return os.path.join(self.dossier, f"{guild_id}.db")
+
+    def _stockage(self, guild_id):
+        if self._commun is not None:
+            return self._commun
+        stockage = self._stockages.get(guild_id)
+        if stockage is None:
+            os.makedirs(self.dossier, exist_ok=True)
+            stockage = self._stockages[guild_id] = Stockage(
+                self.chemin(guild_id),
+                ecrivain=self._ecrivains[guild_id % len(self._ecrivains)],
+                lecteurs=self._lecteurs,
+            )
+        return stockage
+
+    async def preparer(self, serveur_historique=None):
+        """Migre la base commune et rattache les données antérieures au découpage à `serveur_historique`.
+
+        Avec une base par serveur, la base commune existante devient celle de
+        `serveur_historique` (copiée au premier démarrage, puis laissée en place).
+        """
+        if self._commun is not None:
+            await self._commun.migrer()
+        if serveur_historique:
+            stockage = self._stockage(serveur_historique)
+            if self._commun is None:
+                source = self._chemin_commun or bd.DATABASE_FILE
+                if await stockage.importer_base(source):
+                    print(f"Base {source} reprise comme base du serveur {serveur_historique} ({stockage.chemin})")
+            await stockage.migrer()
+            await stockage.attribuer_historique(serveur_historique)
+
+    async def pour(self, guild_id):
+        """Stockage de la boutique d'un serveur, préparée au premier accès"""
+        stockage = self._stockage(guild_id)
+        await stockage.initialiser(guild_id)
+        self._ouvertes.add(guild_id)
+        return stockage
+
+    async def existantes(self):
+        """IDs des serveurs qui ont déjà une boutique"""
+        if self._commun is not None:
+            return await self._commun.serveurs()
+        if not os.path.isdir(self.dossier):
+            return []
+        return [int(nom[:-3]) for nom in os.listdir(self.dossier) if nom.endswith('.db') and nom[:-3].isdigit()]
+
+    async def existante(self, guild_id):
+        """Comme `pour`, mais retourne None au lieu de créer une boutique (requête externe)"""
+        if guild_id not in self._ouvertes and guild_id not in await self.existantes():
+            return None
+        return await self.pour(guild_id)
+
+    def __len__(self):
+        return len(self._ouvertes)
+
+    def fermer(self):
+        if self._commun is not None:
+            self._commun.fermer()
+            return
+        for executeur in (*self._ecrivains, self._lecteurs):
+            executeur.shutdown(wait=True)
+        bd.fermer_connexions()
@@ -0,0 +1,13 @@
+import pytest
+
+import base_donnees as bd
+
+
+@pytest.fixture
+def base(tmp_path):
+    """Base temporaire initialisée (serveur historique), désignée comme base courante"""
+    chemin = str(tmp_path / "boutique.db")
+    bd.configurer(chemin)
+    bd.initialiser_base_donnees()
+    yield chemin
+    bd.fermer_connexions()
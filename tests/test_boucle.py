@@ -0,0 +1,24 @@
+import asyncio
+
+from benchmark import boucle_stable, centile, mesurer_retard_boucle, saturer_ecritures
+from stockage import Stockage
+
+
+def test_latence_boucle_stable_sous_ecritures(base):
+    async def mesurer():
+        stockage = Stockage(base)
+        try:
+            repos = await mesurer_retard_boucle(1.0)
+            arret = asyncio.Event()
+            compteur = [0]
+            ecrivains = [asyncio.create_task(saturer_ecritures(stockage, arret, compteur)) for _ in range(8)]
+            charge = await mesurer_retard_boucle(1.0)
+            arret.set()
+            await asyncio.gather(*ecrivains)
+        finally:
+            stockage.fermer()
+        return repos, charge, compteur[0]
+
+    repos, charge, nb_ecritures = asyncio.run(mesurer())
+    assert nb_ecritures > 0
+    assert boucle_stable(repos, charge), (centile(repos, 99), centile(charge, 99))
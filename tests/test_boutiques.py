@@ -0,0 +1,40 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+import base_donnees as bd
+from stockage import Boutiques
+
+SERVEUR = 42
+
+
+def test_base_commune_reprise_par_le_serveur_historique(base, tmp_path):
+    # Base commune d'avant le découpage : une commande en cours, une autre archivée
+    bd.ajouter_commande(bd.SERVEUR_HISTORIQUE, 5, 1, 1, 25.0)
+    expediee = bd.ajouter_commande(bd.SERVEUR_HISTORIQUE, 5, 2, 1, 15.0)
+    bd.modifier_statut_commande(bd.SERVEUR_HISTORIQUE, expediee, 'envoye')
+    demain = (datetime.now(timezone.utc) + timedelta(days=1)).strftime(bd.FORMAT_HORODATAGE)
+    assert bd.archiver_commandes(bd.SERVEUR_HISTORIQUE, demain) == 1
+
+    boutiques = Boutiques(chemin=base, dossier=str(tmp_path / "bases"))
+
+    async def demarrer():
+        await boutiques.preparer(SERVEUR)
+        stockage = await boutiques.pour(SERVEUR)
+        commandes = await stockage.obtenir_commandes_utilisateur(SERVEUR, 5, archives=True)
+        # Au démarrage suivant, la base du serveur existe : elle n'est plus recopiée
+        await stockage.ajouter_produit(SERVEUR, "Gourde", "Gourde isotherme", 18.0, 7)
+        await boutiques.preparer(SERVEUR)
+        return commandes, await stockage.obtenir_produits(SERVEUR)
+
+    try:
+        commandes, produits = asyncio.run(demarrer())
+    finally:
+        boutiques.fermer()
+
+    assert len(commandes) == 2
+    assert len(produits) == 6
+    assert os.path.exists(bd.chemin_archive(boutiques.chemin(SERVEUR)))
+    # La base commune n'est pas modifiée
+    bd.configurer(base)
+    assert len(bd.lire_produits(bd.SERVEUR_HISTORIQUE)) == 5
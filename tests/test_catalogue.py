@@ -0,0 +1,27 @@
+import base_donnees as bd
+
+SERVEUR = bd.SERVEUR_HISTORIQUE
+
+
+def test_produit_trouve_malgre_un_chargement_ecarte(base, monkeypatch):
+    catalogue = bd.catalogue_de(SERVEUR)
+    catalogue.invalider()
+    lire_produits = bd.lire_produits
+
+    def lecture_concurrente(guild_id):
+        produits = lire_produits(guild_id)
+        catalogue.ajuster_stock(1, 0)  # écriture pendant la lecture : le chargement sera écarté
+        return produits
+
+    monkeypatch.setattr(bd, 'lire_produits', lecture_concurrente)
+    produit = bd.obtenir_produit(SERVEUR, 1)
+    assert not catalogue.charge
+    assert produit is not None and produit.id == 1
+    assert bd.verifier_stock(SERVEUR, 1, 1)
+
+
+def test_cache_mis_a_jour_apres_ecriture(base):
+    produit_id = bd.ajouter_produit(SERVEUR, "Gourde", "Gourde isotherme 50 cl", 18.0, 7)
+    assert bd.obtenir_produit(SERVEUR, produit_id).stock == 7
+    assert bd.ajouter_commande(SERVEUR, 1, produit_id, 3, 18.0) is not None
+    assert bd.obtenir_produit(SERVEUR, produit_id).stock == 4
@@ -0,0 +1,49 @@
+"""Tests de charge des commandes slash (pytest-benchmark) ; nécessitent discord.py"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("pytest_benchmark")
+
+import base_donnees as bd  # noqa: E402
+import charge  # noqa: E402
+from benchmark import centile  # noqa: E402
+
+SERVEUR = 1
+
+
+@pytest.fixture(scope="module")
+def boutique(tmp_path_factory):
+    """Base peuplée et boucle asyncio communes au module.
+
+    Les objets du bot (file d'écritures, limiteur…) sont liés à la boucle où
+    ils ont servi la première fois : toutes les mesures passent par la même.
+    """
+    bd.configurer(str(tmp_path_factory.mktemp("charge") / "boutique.db"))
+    bd.initialiser_base_donnees()
+    ids = charge.peupler(SERVEUR, nb_produits=200, nb_commandes=20_000, nb_utilisateurs=500)
+    boucle = asyncio.new_event_loop()
+    yield boucle, {SERVEUR: ids}
+    charge.bb.boutiques.fermer()
+    boucle.close()
+
+
+@pytest.mark.parametrize("melange", [
+    charge.MELANGE_DEFAUT,
+    {'acheter': 1},
+    {'produits': 1, 'liste_produits_admin': 1},
+], ids=["defaut", "acheter", "catalogue"])
+def test_charge(benchmark, boutique, melange):
+    boucle, produits_par_serveur = boutique
+
+    def rejouer():
+        return boucle.run_until_complete(charge.executer_charge(
+            melange, debit=100, duree=0.5, nb_utilisateurs=500, produits_par_serveur=produits_par_serveur
+        ))
+
+    resultats = benchmark.pedantic(rejouer, rounds=3, iterations=1)
+    for nom, r in resultats.items():
+        assert r['erreurs'] == 0, nom
+        # Discord exige un accusé de réception sous 3 secondes
+        assert centile(r['accuses'], 99) < 3.0, nom
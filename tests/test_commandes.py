@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import base_donnees as bd
+
+SERVEUR = bd.SERVEUR_HISTORIQUE
+
+
+def test_annulation_du_jour_rend_le_stock(base):
+    stock = bd.obtenir_produit(SERVEUR, 2).stock
+    bd.ajouter_commande(SERVEUR, 5, 2, 3, 15.0)
+    jour = datetime.now().date()
+    assert bd.annuler_commandes_du_jour(SERVEUR, 5, 2, jour) == 1
+    assert bd.obtenir_produit(SERVEUR, 2).stock == stock
+    assert bd.annuler_commandes_du_jour(SERVEUR, 5, 2, jour) == 0
+
+
+def test_produit_supprimable_si_toutes_ses_commandes_sont_annulees(base):
+    produit_id = bd.ajouter_produit(SERVEUR, "Gourde", "Gourde isotherme 50 cl", 18.0, 7)
+    commande_id = bd.ajouter_commande(SERVEUR, 5, produit_id, 1, 18.0)
+    assert bd.compter_commandes_produit(produit_id) == 1
+    assert not bd.supprimer_produit(SERVEUR, produit_id)
+
+    bd.modifier_statut_commande(SERVEUR, commande_id, 'annule')
+    assert bd.compter_commandes_produit(produit_id) == 0
+    assert bd.supprimer_produit(SERVEUR, produit_id)
+    assert bd.obtenir_produit(SERVEUR, produit_id) is None
@@ -0,0 +1,17 @@
+import base_donnees as bd
+
+
+def test_connexions_bornees_par_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(bd, 'NB_CONNEXIONS_PAR_THREAD', 2)
+    chemins = [str(tmp_path / f"{guild_id}.db") for guild_id in (1, 2, 3)]
+    try:
+        for guild_id, chemin in enumerate(chemins, 1):
+            bd.sur_base(chemin, bd.initialiser_base_donnees, guild_id)
+        # La base la moins récemment utilisée a été fermée ; les deux autres restent ouvertes
+        assert [len(bd.gestionnaire(c)._connexions) for c in chemins] == [0, 1, 1]
+
+        # Rouverte au besoin, elle ferme à son tour la moins récemment utilisée
+        assert len(bd.sur_base(chemins[0], bd.lire_produits, 1)) == 5
+        assert [len(bd.gestionnaire(c)._connexions) for c in chemins] == [1, 0, 1]
+    finally:
+        bd.fermer_connexions()
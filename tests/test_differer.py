@@ -0,0 +1,31 @@
+"""Réponses différées des commandes lourdes ; nécessitent discord.py"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+
+import charge  # noqa: E402
+from travaux import FileSaturee  # noqa: E402
+
+
+async def echouer():
+    raise RuntimeError("base indisponible")
+
+async def saturer():
+    raise FileSaturee()
+
+async def reussir():
+    return 42
+
+
+@pytest.mark.parametrize("travail, resultat, message", [
+    (reussir, 42, None),
+    (echouer, None, "❌ Erreur pendant le traitement : base indisponible"),
+    (saturer, None, "⏳ Trop de traitements en cours, réessaie dans un instant."),
+])
+def test_differer_repond_toujours(travail, resultat, message):
+    interaction = charge.FausseInteraction(1, admin=True)
+    assert asyncio.run(charge.bb.differer(interaction, 0, travail)) == resultat
+    assert interaction.response.is_done()
+    assert interaction.messages == ([message] if message else [])
@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+import base_donnees as bd
+from echanges import ErreurImport, importer_produits
+
+SERVEUR = bd.SERVEUR_HISTORIQUE
+DESCRIPTION = "Description assez longue"
+
+
+def importer(texte, format):
+    return importer_produits(SERVEUR, io.BytesIO(texte.encode()), format)
+
+
+@pytest.mark.parametrize("prix", ["nan", "inf", "-inf"])
+def test_csv_prix_non_fini_refuse(base, prix):
+    with pytest.raises(ErreurImport, match="ligne 3"):
+        importer(f"nom,description,prix,stock\nGourde,{DESCRIPTION},12.5,3\nBonnet,{DESCRIPTION},{prix},3\n", 'csv')
+    assert len(bd.lire_produits(SERVEUR)) == 5
+
+
+@pytest.mark.parametrize("prix", ["1e400", "NaN", "Infinity"])
+def test_jsonl_prix_non_fini_refuse(base, prix):
+    with pytest.raises(ErreurImport, match="ligne 1"):
+        importer(f'{{"nom": "Gourde", "description": "{DESCRIPTION}", "prix": {prix}, "stock": 3}}\n', 'jsonl')
+
+
+@pytest.mark.parametrize("stock", ["2.9", "1e400"])
+def test_jsonl_stock_non_entier_refuse(base, stock):
+    with pytest.raises(ErreurImport, match="ligne 1"):
+        importer(f'{{"nom": "Gourde", "description": "{DESCRIPTION}", "prix": 12.5, "stock": {stock}}}\n', 'jsonl')
+
+
+def test_csv_stock_non_entier_refuse(base):
+    with pytest.raises(ErreurImport, match="ligne 2"):
+        importer(f"nom,description,prix,stock\nGourde,{DESCRIPTION},12.5,2.9\n", 'csv')
+
+
+def test_import_valide(base):
+    assert importer(
+        f'{{"nom": "Gourde", "description": "{DESCRIPTION}", "prix": 12.5, "stock": 3.0}}\n'
+        f'{{"nom": "Bonnet", "description": "{DESCRIPTION}", "prix": 9, "stock": "4"}}\n', 'jsonl'
+    ) == 2
+    stocks = {p.nom: p.stock for p in bd.lire_produits(SERVEUR)}
+    assert (stocks["Gourde"], stocks["Bonnet"]) == (3, 4)
+
+
+@pytest.mark.parametrize("prix", [float('nan'), float('inf')])
+def test_valider_produit_prix_non_fini(prix):
+    assert bd.valider_produit("Gourde", DESCRIPTION, prix, 3) is not None
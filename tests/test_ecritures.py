@@ -0,0 +1,67 @@
+import asyncio
+
+import base_donnees as bd
+from stockage import FileEcritures
+
+SERVEUR = bd.SERVEUR_HISTORIQUE
+
+
+def _echouer_apres_ecriture(conn, guild_id, user_id, produit_id):
+    """Opération qui écrit (commande et stock réservé) puis échoue"""
+    bd.OPERATIONS_LOT['ajouter_commande'](conn, guild_id, user_id, produit_id, 1, 25.0)
+    raise RuntimeError("échec au milieu du lot")
+
+
+def test_echec_isole_dans_un_lot(base, monkeypatch):
+    monkeypatch.setitem(bd.OPERATIONS_LOT, 'echouer', _echouer_apres_ecriture)
+    stock = bd.obtenir_produit(SERVEUR, 1).stock
+    annulee = bd.ajouter_commande(SERVEUR, 9, 2, 1, 15.0)
+    bd.modifier_statut_commande(SERVEUR, annulee, 'annule')
+    bd.connexion().execute('UPDATE produits SET stock = 0 WHERE id = 2')
+    bd.invalider_catalogues()
+    nb_commandes = bd.connexion().execute('SELECT COUNT(*) FROM commandes').fetchone()[0]
+
+    lots = []
+
+    async def executer(operations):
+        lots.append(len(operations))
+        return bd.executer_lot(operations)
+
+    async def soumettre():
+        file = FileEcritures(executer)
+        return await asyncio.gather(
+            file.soumettre('ajouter_commande', SERVEUR, 5, 1, 1, 25.0),
+            file.soumettre('echouer', SERVEUR, 6, 1),
+            file.soumettre('modifier_statut_commande', SERVEUR, annulee, 'paye'),  # plus de stock : ValueError
+            file.soumettre('ajouter_commande', SERVEUR, 7, 1, 2, 25.0),
+            return_exceptions=True,
+        )
+
+    premiere, echec, reactivation, derniere = asyncio.run(soumettre())
+
+    assert lots == [4]
+    assert isinstance(echec, RuntimeError)
+    assert isinstance(reactivation, ValueError)
+    assert premiere and derniere
+    # Seules les opérations réussies sont validées, le stock réservé par l'échec est rendu
+    assert bd.connexion().execute('SELECT COUNT(*) FROM commandes').fetchone()[0] == nb_commandes + 2
+    assert {p.id: p.stock for p in bd.lire_produits(SERVEUR)}[1] == stock - 3
+    assert bd.obtenir_produit(SERVEUR, 1).stock == stock - 3
+    assert bd.connexion().execute(
+        'SELECT statut FROM commandes WHERE id = ?', (annulee,)
+    ).fetchone()[0] == 'annule'
+
+
+def test_erreur_de_lot_transmise_a_chaque_appelant(base):
+    async def executer(operations):
+        raise OSError("base indisponible")
+
+    async def soumettre():
+        file = FileEcritures(executer)
+        return await asyncio.gather(
+            file.soumettre('ajouter_commande', SERVEUR, 5, 1, 1, 25.0),
+            file.soumettre('ajouter_commande', SERVEUR, 6, 1, 1, 25.0),
+            return_exceptions=True,
+        )
+
+    assert [type(r) for r in asyncio.run(soumettre())] == [OSError, OSError]
@@ -0,0 +1,75 @@
+import pytest
+
+import limiteur
+from limiteur import Limiteur
+
+
+class Horloge:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def horloge():
+    return Horloge()
+
+
+def test_rafale_puis_debit(horloge):
+    lim = Limiteur({"acheter": (3, 1 / 2)}, globale=(100, 100), horloge=horloge)
+    assert [lim.autoriser("acheter", 1) for _ in range(3)] == [0, 0, 0]
+    assert lim.autoriser("acheter", 1) == pytest.approx(2.0)
+    horloge.t += 1
+    assert lim.autoriser("acheter", 1) == pytest.approx(1.0)
+    horloge.t += 1
+    assert lim.autoriser("acheter", 1) == 0
+    assert lim.rejets == {"acheter": 2}
+
+
+def test_limites_par_utilisateur_et_par_commande(horloge):
+    lim = Limiteur({"acheter": (1, 1), "annuler": (1, 1)}, globale=(100, 100), horloge=horloge)
+    assert lim.autoriser("acheter", 1) == 0
+    assert lim.autoriser("acheter", 1) > 0
+    assert lim.autoriser("acheter", 2) == 0
+    assert lim.autoriser("annuler", 1) == 0
+    # Commande non limitée : toujours acceptée, sans seau
+    assert lim.autoriser("produits", 1) == 0
+    assert len(lim) == 3
+
+
+def test_budget_global_rend_le_jeton_utilisateur(horloge):
+    lim = Limiteur({"acheter": (2, 1)}, globale=(1, 1), horloge=horloge)
+    assert lim.autoriser("acheter", 1) == 0
+    # Refusé par le budget global : l'utilisateur 2 garde ses deux jetons
+    assert lim.autoriser("acheter", 2) == pytest.approx(1.0)
+    horloge.t += 1
+    assert lim.autoriser("acheter", 2) == 0
+    horloge.t += 1
+    assert lim.autoriser("acheter", 2) == 0
+
+
+def test_seaux_pleins_evinces(horloge):
+    lim = Limiteur({"acheter": (2, 1)}, globale=(100, 100), horloge=horloge)
+    lim.autoriser("acheter", 1)
+    horloge.t += 0.5
+    lim.autoriser("acheter", 2)
+    assert len(lim) == 2
+    # Le seau de 1 est de nouveau plein (le plus ancien) : il est supprimé au passage suivant
+    horloge.t += 0.6
+    lim.autoriser("acheter", 3)
+    assert len(lim) == 2
+    horloge.t += 10
+    lim.autoriser("acheter", 3)
+    assert len(lim) == 1
+
+
+def test_nombre_de_seaux_borne(horloge, monkeypatch):
+    monkeypatch.setattr(limiteur, "NB_SEAUX_MAX", 3)
+    lim = Limiteur({"acheter": (2, 1)}, globale=(100, 100), horloge=horloge)
+    for user_id in range(5):
+        lim.autoriser("acheter", user_id)
+    assert len(lim) == 3
+    # Les moins récemment utilisés sont partis : l'utilisateur 0 repart avec un seau neuf
+    assert [lim.autoriser("acheter", 0) for _ in range(2)] == [0, 0]
@@ -0,0 +1,23 @@
+import asyncio
+
+import base_donnees as bd
+from metriques import registre
+from stockage import Stockage
+
+SERVEUR = bd.SERVEUR_HISTORIQUE
+
+
+def test_parcours_historique_mesure(base):
+    for _ in range(3):
+        bd.ajouter_commande(SERVEUR, 5, 1, 1, 25.0)
+    stockage = Stockage(base)
+    registre.vider()
+    try:
+        nb = asyncio.run(stockage.parcourir_commandes_utilisateur(SERVEUR, 5, lambda commandes: sum(1 for _ in commandes)))
+    finally:
+        stockage.fermer()
+
+    assert nb == 3
+    series = {nom: serie for _, nom, serie in registre.series("requete")}
+    serie = series["iterer_commandes_utilisateur"]
+    assert (serie.appels, serie.lignes, serie.erreurs) == (1, 3, 0)
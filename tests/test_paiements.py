@@ -0,0 +1,36 @@
+import pytest
+
+import base_donnees as bd
+from paiements import NotificationInvalide, lire_notification, notification
+
+SERVEUR = bd.SERVEUR_HISTORIQUE
+
+
+@pytest.mark.parametrize("montant", ["NaN", "nan", "Infinity", "-inf"])
+def test_montant_non_fini_refuse(montant):
+    donnees = notification("N1", f"{SERVEUR}:12", 0)
+    donnees['resource']['amount']['value'] = montant
+    with pytest.raises(NotificationInvalide):
+        lire_notification(donnees)
+
+
+def test_lecture_notification():
+    assert lire_notification(notification("N1", "42:G7", 19.5)) == ("N1", 42, "G7", 19.5)
+    assert lire_notification(notification("N2", "12", 3)) == ("N2", None, "12", 3.0)
+
+
+def payer(commande_id, notification_id, montant):
+    [(reussie, resultat)] = bd.executer_lot([
+        ('enregistrer_paiement', (SERVEUR, notification_id, str(commande_id), montant))
+    ])
+    assert reussie
+    return resultat
+
+
+def test_rapprochement(base):
+    commande_id = bd.ajouter_commande(SERVEUR, 5, 1, 1, 20.0)
+    assert payer(commande_id, "N1", 19.0) == 'montant_incorrect'
+    assert payer(commande_id, "N2", float('nan')) == 'montant_incorrect'
+    assert payer(commande_id, "N3", 20.0) == 'paye'
+    assert payer(commande_id, "N3", 20.0) == 'doublon'
+    assert payer(commande_id, "N4", 20.0) == 'deja_payee'
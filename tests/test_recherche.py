@@ -0,0 +1,53 @@
+from base_donnees import Produit
+from recherche import IndexProduits
+
+
+def produit(produit_id, nom, description="Article de la boutique"):
+    return Produit(produit_id, nom, description, 10.0, 5)
+
+
+def index_de(*produits):
+    index = IndexProduits()
+    index.charger(produits)
+    return index
+
+
+def test_recherche_par_prefixe_et_approchante():
+    index = index_de(produit(1, "Casquette Été"), produit(2, "Mug montagne"), produit(3, "Poster", "Vue des montagnes"))
+    assert index.rechercher("casq") == [1]
+    assert index.rechercher("ete") == [1]
+    # Le nom passe avant la description
+    assert index.rechercher("mont") == [2, 3]
+    assert index.rechercher("casquete") == [1]
+
+
+def test_renommage():
+    index = index_de(produit(1, "Casquette rouge"), produit(2, "Casquette bleue"))
+    index.mettre_a_jour(produit(1, "Bonnet rouge"))
+    assert index.rechercher("casquette") == [2]
+    assert index.rechercher("bonnet") == [1]
+    assert index.rechercher("rouge") == [1]
+
+
+def test_suppression_elague_le_trie():
+    index = index_de(produit(1, "Zèbre"), produit(2, "Zébu"), produit(3, "Mug"))
+    index.retirer(1)
+    assert index.rechercher("zebre") == []
+    assert index.rechercher("zeb") == [2]
+    assert set(index._trie["z"]["e"]["b"]) == {"", "#", "u"}
+
+    index.retirer(2)
+    assert index.rechercher("ze") == []
+    assert "z" not in index._trie
+    # Plus aucun mot en « z » : l'initiale disparaît, les autres restent
+    assert "z" not in index._initiales
+    assert "m" in index._initiales
+    assert "zebu" not in index._mots
+
+
+def test_suppression_de_tout_le_catalogue():
+    index = index_de(produit(1, "Mug montagne"), produit(2, "Poster montagne"))
+    index.retirer(1)
+    index.retirer(2)
+    index.retirer(2)  # sans effet
+    assert (index._trie, index._mots, index._initiales, index._produits) == ({}, {}, {}, {})
@@ -0,0 +1,33 @@
+import sqlite3
+
+import base_donnees as bd
+
+
+def test_requetes_frequentes_indexees(base):
+    assert bd.plans_sans_index() == {}
+
+
+def test_migration_depuis_le_schema_d_origine(tmp_path):
+    chemin = str(tmp_path / "ancienne.db")
+    # Base créée par la première version du bot, sans numéro de schéma
+    conn = sqlite3.connect(chemin)
+    bd._migration_schema_initial(conn.cursor())
+    conn.execute("INSERT INTO produits (nom, description, prix, stock) VALUES ('Mug', 'Mug en céramique', 12.0, 5)")
+    conn.execute('''
+        INSERT INTO commandes (user_id, produit_id, quantite, prix_unitaire, total, statut, date_commande)
+        VALUES (7, 1, 2, 12.0, 24.0, 'paye', '2024-03-01T10:00:00')
+    ''')
+    conn.commit()
+    conn.close()
+
+    bd.configurer(chemin)
+    try:
+        assert bd.migrer() == len(bd.MIGRATIONS)
+        conn = bd.connexion()
+        assert bd.version_schema(conn) == len(bd.MIGRATIONS)
+        assert conn.execute('SELECT date_commande, guild_id FROM commandes').fetchone() == ('2024-03-01 10:00:00', 0)
+        [ligne] = bd.rapport_ventes(bd.SERVEUR_HISTORIQUE)
+        assert (ligne.nb_commandes, ligne.unites, ligne.montant_encaisse) == (1, 2, 24.0)
+        assert bd.migrer() == len(bd.MIGRATIONS)  # sans effet une seconde fois
+    finally:
+        bd.fermer_connexions()
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from travaux import FileSaturee, FileTravaux
+
+
+async def valeur(v):
+    return v
+
+
+def test_priorites_et_saturation():
+    async def scenario():
+        file = FileTravaux(nb_simultanes=1, taille_max=2)
+        fin = asyncio.get_running_loop().create_future()
+        ordre = []
+
+        async def travail(nom):
+            ordre.append(nom)
+
+        premier = asyncio.create_task(file.executer(0, lambda: fin))
+        await asyncio.sleep(0)
+        taches = [asyncio.create_task(file.executer(p, lambda n=n: travail(n))) for n, p in (("fichier", 2), ("rapport", 1))]
+        await asyncio.sleep(0)
+        with pytest.raises(FileSaturee):
+            await file.executer(0, lambda: valeur(None))
+        fin.set_result(None)
+        await asyncio.gather(premier, *taches)
+        return ordre, file
+
+    ordre, file = asyncio.run(scenario())
+    assert ordre == ["rapport", "fichier"]
+    assert (len(file), file._en_cours, file.refuses) == (0, 0, 1)
+
+
+def test_annulation_pendant_la_liberation():
+    """Un traitement en attente annulé dans le même tour de boucle que la fin du traitement en cours"""
+    async def scenario():
+        file = FileTravaux(nb_simultanes=1)
+        fin = asyncio.get_running_loop().create_future()
+        en_cours = asyncio.create_task(file.executer(0, lambda: fin))
+        await asyncio.sleep(0)
+        annule = asyncio.create_task(file.executer(0, lambda: valeur("annulé")))
+        suivant = asyncio.create_task(file.executer(1, lambda: valeur("suivant")))
+        await asyncio.sleep(0)
+
+        # La place libérée par `en_cours` est donnée avant que `annule` ait traité son annulation
+        fin.set_result("en cours")
+        annule.cancel()
+        resultats = await asyncio.gather(en_cours, annule, suivant, return_exceptions=True)
+        return resultats, file
+
+    (premier, annule, suivant), file = asyncio.run(scenario())
+    assert premier == "en cours"
+    assert isinstance(annule, asyncio.CancelledError)
+    assert suivant == "suivant"
+    assert (len(file), file._en_cours) == (0, 0)
@@ -0,0 +1,80 @@
+import asyncio
+import heapq
+import itertools
+
+# Priorités des traitements lourds (la plus petite passe en premier)
+PRIORITE_INTERACTIVE = 0  # vues d'administration attendues aussitôt (liste, pagination, suppression)
+PRIORITE_RAPPORT = 1      # rapports calculés
+PRIORITE_FICHIER = 2      # imports et exports de fichiers
+
+NB_TRAVAUX_SIMULTANES = 2  # inférieur au nombre de lecteurs de `Stockage` : il en reste pour les clients
+TAILLE_FILE_TRAVAUX = 50   # traitements en attente au plus
+
+
+class FileSaturee(Exception):
+    """Trop de traitements lourds en attente : la demande est refusée"""
+
+
+class FileTravaux:
+    """File à priorités des traitements lourds (commandes d'administration).
+
+    Au plus `nb_simultanes` traitements s'exécutent à la fois ; les suivants
+    attendent dans un tas, par priorité puis par ordre d'arrivée, et au-delà
+    de `taille_max` en attente la demande est refusée (`FileSaturee`). Un
+    traitement lent n'occupe donc jamais tous les threads de lecture, et les
+    commandes des clients, qui ne passent pas par cette file, restent rapides.
+    Une place libérée est donnée directement au suivant (sa future de départ
+    est résolue) : un traitement qui arrive entre-temps ne peut pas la prendre.
+    """
+
+    def __init__(self, nb_simultanes=NB_TRAVAUX_SIMULTANES, taille_max=TAILLE_FILE_TRAVAUX):
+        self.nb_simultanes = nb_simultanes
+        self.taille_max = taille_max
+        self._tas = []  # (priorité, numéro d'arrivée, future du départ)
+        self._arrivees = itertools.count()
+        self._en_cours = 0
+        self.executes = 0
+        self.refuses = 0
+
+    async def executer(self, priorite, travail):
+        """Exécute la coroutine `travail()` à son tour, retourne son résultat"""
+        if self._en_cours < self.nb_simultanes:
+            self._en_cours += 1
+        else:
+            if len(self._tas) >= self.taille_max:
+                self.refuses += 1
+                raise FileSaturee()
+            depart = asyncio.get_running_loop().create_future()
+            entree = (priorite, next(self._arrivees), depart)
+            heapq.heappush(self._tas, entree)
+            try:
+                await depart
+            except asyncio.CancelledError:
+                if depart.cancelled():
+                    # Annulé pendant l'attente : ne compte plus dans la file (sauf si `_liberer` l'a déjà écarté)
+                    if entree in self._tas:
+                        self._tas.remove(entree)
+                        heapq.heapify(self._tas)
+                else:
+                    self._liberer()  # place attribuée juste avant l'annulation : elle passe au suivant
+                raise
+
+        try:
+            return await travail()
+        finally:
+            self.executes += 1
+            self._liberer()
+
+    def _liberer(self):
+        # La place libérée passe directement au prochain traitement en attente ; un
+        # traitement annulé dont l'annulation n'a pas encore été traitée est écarté
+        while self._tas:
+            _, _, depart = heapq.heappop(self._tas)
+            if not depart.done():
+                depart.set_result(None)
+                return
+        self._en_cours -= 1
+
+    def __len__(self):
+        """Nombre de traitements en attente"""
+        return len(self._tas)